@@ -0,0 +1,51 @@
+import sys
+import time
+
+import numpy as np
+
+from load_data import load_data
+from text_normalization import clean_text, iter_lemmas
+from word_vectors import load_word_vectors
+from train_svm import train_svm
+
+
+def reference_transform(vectorizer, X):
+    """
+    Former per-word implementation of TfidfEmbeddingVectorizer.transform, kept as the numerical reference.
+    """
+    return np.array([
+        np.mean([vectorizer.word2vec[w] * vectorizer.word2weight[w]
+                 for w in words if w in vectorizer.word2vec] or
+                [np.zeros(vectorizer.dim)], axis=0)
+        for words in X
+    ])
+
+
+def run(path='Data/essays.csv'):
+    """
+    Compares the per-word and the sparse x dense TfidfEmbeddingVectorizer on the essays corpus.
+    """
+    _, X_essays, y_essays, _ = load_data(path).run()
+    X = [list(iter_lemmas(clean_text(doc))) for doc in X_essays]
+    print('Number of documents :', len(X), '- number of tokens :', sum(len(doc) for doc in X))
+
+    word2vec = load_word_vectors()
+    wv_dict = {w: word2vec[w] for w in set(w for doc in X for w in doc) if w in word2vec}
+    vectorizer = train_svm.TfidfEmbeddingVectorizer(wv_dict).fit(X, y_essays)
+
+    start = time.perf_counter()
+    reference = reference_transform(vectorizer, X)
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = vectorizer.transform(X)
+    vectorized_time = time.perf_counter() - start
+
+    print('Per-word transform : {:.3f}s'.format(reference_time))
+    print('Sparse x dense transform : {:.3f}s ({:.1f}x)'.format(vectorized_time, reference_time / vectorized_time))
+    print('Maximum absolute difference :', np.abs(reference - vectorized).max())
+    assert np.allclose(reference, vectorized)
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:])
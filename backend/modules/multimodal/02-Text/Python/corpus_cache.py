@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from text_normalization import (STOPWORDS, PUNCTUATION, NORMALIZATION_VERSION, CLEANING_RULES,
+                                clean_text, iter_lemmas)
+
+CORPUS_CACHE_DIR = 'Data/corpus_cache'
+
+
+class corpus_cache:
+    """
+    On-disk cache of the normalized, lemmatized tokens of each document, keyed by the hash of
+    the document content and of the preprocessing configuration. Each configuration gets its
+    own directory holding :
+        - lemmas.txt : the lemma vocabulary, one lemma per line (its line number is its id)
+        - tokens.bin : the int32 lemma ids of every cached document, concatenated
+        - index.tsv : one 'document hash, offset, length' line per cached document
+    Files are only appended to, so a single process should write to a given cache at a time.
+    """
+
+    def __init__(self, cache_dir=CORPUS_CACHE_DIR, clean=True, stopwords=STOPWORDS, punct=PUNCTUATION,
+                 lower=True, strip=True):
+        self.clean = clean
+        self.stopwords = frozenset(stopwords)
+        self.punct = frozenset(punct)
+        self.lower = lower
+        self.strip = strip
+        config = {
+            'version': NORMALIZATION_VERSION,
+            'rules': [(pattern.pattern, replacement) for pattern, replacement in CLEANING_RULES] if clean else [],
+            'stopwords': sorted(self.stopwords),
+            'punct': sorted(self.punct),
+            'lower': lower,
+            'strip': strip
+        }
+        self.config_key = hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+        self.path = os.path.join(cache_dir, self.config_key)
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Reads the lemma vocabulary, the document index and the token ids of the cache.
+        """
+        self.lemmas = []
+        self.lemma_ids = {}
+        self.index = {}
+        self.ids = np.zeros(0, dtype=np.int32)
+        if not os.path.exists(os.path.join(self.path, 'index.tsv')):
+            return
+        with open(os.path.join(self.path, 'lemmas.txt'), 'r', encoding='utf-8') as f:
+            self.lemmas = f.read().split('\n')[:-1]
+        self.ids = np.fromfile(os.path.join(self.path, 'tokens.bin'), dtype=np.int32)
+        with open(os.path.join(self.path, 'index.tsv'), 'r') as f:
+            for line in f:
+                # Skip a trailing line left incomplete by an interrupted write
+                if not line.endswith('\n'):
+                    break
+                key, offset, length = line.split('\t')
+                self.index[key] = (int(offset), int(length))
+        self.lemma_ids = {lemma: i for i, lemma in enumerate(self.lemmas)}
+
+    def key(self, document):
+        """
+        Returns the content key of a document under the current configuration.
+        """
+        return hashlib.sha1((self.config_key + document).encode('utf-8')).hexdigest()
+
+    def normalize(self, document):
+        """
+        Runs the full text normalization on one document.
+        """
+        document = clean_text(document) if self.clean else document
+        return list(iter_lemmas(document, self.stopwords, self.punct, self.lower, self.strip))
+
+    def transform(self, X):
+        """
+        Returns the list of lemmas of every document, normalizing and persisting only the
+        documents that are not cached yet.
+        """
+        keys = [self.key(document) for document in X]
+        with self.lock:
+            self.update(keys, X)
+            return [self.tokens(key) for key in keys]
+
+    def update(self, keys, X):
+        """
+        Normalizes and persists the documents whose key is not cached yet.
+        """
+        new_lemmas, new_ids, new_index = [], [], []
+        offset = len(self.ids)
+        pending = set()
+        for key, document in zip(keys, X):
+            if key in self.index or key in pending:
+                continue
+            ids = []
+            for lemma in self.normalize(document):
+                if lemma not in self.lemma_ids:
+                    self.lemma_ids[lemma] = len(self.lemmas)
+                    self.lemmas.append(lemma)
+                    new_lemmas.append(lemma)
+                ids.append(self.lemma_ids[lemma])
+            pending.add(key)
+            new_index.append((key, offset, len(ids)))
+            new_ids.extend(ids)
+            offset += len(ids)
+        if new_index:
+            self.append(new_lemmas, np.array(new_ids, dtype=np.int32), new_index)
+            self.index.update((key, (offset, length)) for key, offset, length in new_index)
+
+    def tokens(self, key):
+        """
+        Returns the lemmas of a cached document from its content key.
+        """
+        offset, length = self.index[key]
+        return [self.lemmas[i] for i in self.ids[offset:offset + length]]
+
+    def append(self, new_lemmas, new_ids, new_index):
+        """
+        Persists newly normalized documents. The index is written last, so that it never
+        references lemmas or token ids missing from disk.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'lemmas.txt'), 'a', encoding='utf-8') as f:
+            f.write(''.join(lemma + '\n' for lemma in new_lemmas))
+        with open(os.path.join(self.path, 'tokens.bin'), 'ab') as f:
+            new_ids.tofile(f)
+        with open(os.path.join(self.path, 'index.tsv'), 'a') as f:
+            f.write(''.join('{}\t{}\t{}\n'.format(*entry) for entry in new_index))
+        self.ids = np.concatenate([self.ids, new_ids])
+
+
+@lru_cache(maxsize=None)
+def open_corpus_cache(clean, stopwords, punct, lower, strip):
+    return corpus_cache(clean=clean, stopwords=stopwords, punct=punct, lower=lower, strip=strip)
+
+
+def get_corpus_cache(clean=True, stopwords=STOPWORDS, punct=PUNCTUATION, lower=True, strip=True):
+    """
+    Returns the corpus cache of a preprocessing configuration, opened once per process so that
+    a single instance appends to its files.
+    """
+    return open_corpus_cache(bool(clean), frozenset(stopwords), frozenset(punct), bool(lower), bool(strip))
@@ -0,0 +1,139 @@
+import os
+import hashlib
+import pickle
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+from nltk import tokenize
+
+from corpus_cache import get_corpus_cache
+
+STATISTICS_DIR = 'Data/corpus_statistics'
+
+
+def document_key(document):
+    """
+    Returns the content key of a document.
+    """
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()
+
+
+def row_keys(X):
+    """
+    Returns the row identity of every document of X : its index label for a pandas Series,
+    its position otherwise.
+    """
+    return list(X.index) if hasattr(X, 'index') else list(range(len(X)))
+
+
+def count_chunk(documents):
+    """
+    Single pass over a chunk of documents : returns the raw word frequencies and the
+    (characters, words) lengths of each document.
+    """
+    counts = []
+    for document in documents:
+        counts.append((Counter(tokenize.word_tokenize(document)), len(document), len(document.split())))
+    return counts
+
+
+class corpus_statistics:
+    """
+    Token frequencies, length distributions and per-label histograms of a corpus. The counts of
+    each document are persisted by row, under the normalization configuration of the corpus
+    cache: on a new corpus, only the rows whose content changed or that were never seen are
+    counted (raw words across worker processes, lemmas from the corpus cache), and the rows no
+    longer in the corpus are subtracted.
+    """
+
+    def __init__(self, X, y=None, cache=None, cache_dir=STATISTICS_DIR, chunksize=100, n_jobs=None):
+        self.cache = cache or get_corpus_cache()
+        self.path = os.path.join(cache_dir, hashlib.sha1(self.cache.config_key.encode('utf-8')).hexdigest() + '.pickle')
+        self.word_counts = Counter()
+        self.lemma_counts = Counter()
+        # Row key -> (document key, word counts, lemma counts, characters, words, lemmas, labels)
+        self.documents = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            self.word_counts = state['word_counts']
+            self.lemma_counts = state['lemma_counts']
+            self.documents = state['documents']
+
+        labels = np.asarray(y).tolist() if y is not None else [None] * len(X)
+        self.keys = row_keys(X)
+        if self.update(self.keys, list(X), labels, chunksize, n_jobs):
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(self.path, 'wb') as f:
+                pickle.dump({'word_counts': self.word_counts, 'lemma_counts': self.lemma_counts,
+                             'documents': self.documents}, f)
+
+    def remove(self, key):
+        """
+        Subtracts the counts of a stored row.
+        """
+        _, word_counts, lemma_counts = self.documents.pop(key)[:3]
+        self.word_counts.subtract(word_counts)
+        self.lemma_counts.subtract(lemma_counts)
+
+    def update(self, keys, X, labels, chunksize=100, n_jobs=None):
+        """
+        Brings the statistics to exactly the rows of X : counts the new or modified rows across
+        n_jobs processes, subtracts the removed ones, and returns whether anything changed.
+        """
+        changed = False
+        new = []
+        for key, document, label in zip(keys, X, labels):
+            stored = self.documents.get(key)
+            if stored is not None and stored[0] == document_key(document):
+                if stored[6] != label:
+                    self.documents[key] = stored[:6] + (label,)
+                    changed = True
+                continue
+            if stored is not None:
+                self.remove(key)
+            new.append((key, document, label))
+        removed = set(self.documents) - set(keys)
+        for key in removed:
+            self.remove(key)
+        if not new and not removed:
+            return changed
+
+        if new:
+            documents = [document for _, document, _ in new]
+            chunks = [documents[i:i + chunksize] for i in range(0, len(documents), chunksize)]
+            with Pool(n_jobs) as pool:
+                counts = [count for chunk_counts in pool.imap(count_chunk, chunks) for count in chunk_counts]
+            for (key, document, label), (word_counts, n_chars, n_words), lemmas in zip(new, counts, self.cache.transform(documents)):
+                lemma_counts = Counter(lemmas)
+                self.word_counts.update(word_counts)
+                self.lemma_counts.update(lemma_counts)
+                self.documents[key] = (document_key(document), word_counts, lemma_counts, n_chars, n_words, len(lemmas), label)
+        # Drop the tokens no longer in any row
+        self.word_counts = +self.word_counts
+        self.lemma_counts = +self.lemma_counts
+        return True
+
+    def lengths(self, unit='words', X=None):
+        """
+        Returns the 'chars', 'words' or 'lemmas' length of every document (of X, if given).
+        """
+        column = 3 + ['chars', 'words', 'lemmas'].index(unit)
+        keys = row_keys(X) if X is not None else self.keys
+        return np.array([self.documents[key][column] for key in keys])
+
+    def label_histograms(self, label_names, unit='chars', bins=50):
+        """
+        Returns the common bin edges and, for each label, the length histogram of each label value.
+        """
+        labelled = [key for key in self.keys if self.documents[key][6] is not None]
+        column = 3 + ['chars', 'words', 'lemmas'].index(unit)
+        lengths = np.array([self.documents[key][column] for key in labelled])
+        labels = np.array([self.documents[key][6] for key in labelled])
+        edges = np.histogram_bin_edges(lengths, bins=bins)
+        histograms = {}
+        for j, name in enumerate(label_names):
+            histograms[name] = {value: np.histogram(lengths[labels[:, j] == value], bins=edges)[0]
+                                for value in np.unique(labels[:, j])}
+        return edges, histograms
@@ -13,9 +13,12 @@ from predict import *
 from nltk import *
 
 
+# One predictor per process : the classifier and tokenizer stay warm in the model registry
+predictor = predict()
+
 def get_personality(text):
     try:
-        pred = predict().run(text, model_name = "Personality_traits_NN")
+        pred = predictor.run(text, model_name = "Personality_traits_NN")
         return pred
     except KeyError:
         return None
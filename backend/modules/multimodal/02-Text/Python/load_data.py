@@ -1,27 +1,74 @@
+import os
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import seaborn as sns
 import matplotlib.pyplot as plt
 from nltk import *
 
 class load_data:
 
-    def __init__(self, path = '/Users/raphaellederman/Desktop/Fil_Rouge_Local/Text/Data/essays.csv'):
+    labels = ['cEXT', 'cNEU', 'cAGR', 'cCON', 'cOPN']
+
+    def __init__(self, path = '/Users/raphaellederman/Desktop/Fil_Rouge_Local/Text/Data/essays.csv', cache_path = None):
         self.path = path
+        self.cache_path = cache_path if cache_path else os.path.splitext(path)[0] + '.parquet'
 
-    def run(self):
-        self.data_essays = pd.read_csv(self.path, encoding = "ISO-8859-1")
-        self.data_essays['cEXT'] = np.where(self.data_essays['cEXT']=='y', 1, 0)
-        self.data_essays['cNEU'] = np.where(self.data_essays['cNEU']=='y', 1, 0)
-        self.data_essays['cAGR'] = np.where(self.data_essays['cAGR']=='y', 1, 0)
-        self.data_essays['cCON'] = np.where(self.data_essays['cCON']=='y', 1, 0)
-        self.data_essays['cOPN'] = np.where(self.data_essays['cOPN']=='y', 1, 0)
-        self.X_essays = self.data_essays['TEXT'].tolist()
-        self.y_essays = self.data_essays[['cEXT', 'cNEU', 'cAGR', 'cCON', 'cOPN']]
-        self.labels = ['cEXT', 'cNEU', 'cAGR', 'cCON', 'cOPN']
-        return self.data_essays, self.X_essays, self.y_essays, self.labels
+    def encode_labels(self, data):
+        """
+        Encodes the 'y'/'n' trait columns as 1/0.
+        """
+        for label in self.labels:
+            data[label] = np.where(data[label]=='y', 1, 0)
+        return data
 
+    def cache_is_fresh(self):
+        """
+        The columnar cache is valid as long as it is more recent than the CSV.
+        """
+        if not os.path.exists(self.cache_path):
+            return False
+        return not os.path.exists(self.path) or os.path.getmtime(self.cache_path) >= os.path.getmtime(self.path)
 
+    def build_cache(self, chunksize = 1000):
+        """
+        Converts the CSV once into a Parquet file with the labels already encoded,
+        reading it chunk by chunk so that the corpus never has to fit in memory.
+        """
+        tmp_path = self.cache_path + '.tmp'
+        writer = None
+        try:
+            for chunk in pd.read_csv(self.path, encoding = "ISO-8859-1", chunksize = chunksize):
+                table = pa.Table.from_pandas(self.encode_labels(chunk), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                else:
+                    table = table.cast(writer.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_path, self.cache_path)
+        return self.cache_path
 
+    def get_cache(self):
+        """
+        Returns the path of an up to date columnar cache, building it if needed.
+        """
+        if not self.cache_is_fresh():
+            self.build_cache()
+        return self.cache_path
 
+    def iter_chunks(self, chunksize = 256, columns = None):
+        """
+        Yields the dataset as successive DataFrames of at most chunksize essays, for out-of-core preprocessing.
+        """
+        for batch in pq.ParquetFile(self.get_cache()).iter_batches(batch_size = chunksize, columns = columns):
+            yield batch.to_pandas()
 
+    def run(self):
+        self.data_essays = pd.read_parquet(self.get_cache())
+        self.X_essays = self.data_essays['TEXT'].tolist()
+        self.y_essays = self.data_essays[self.labels]
+        return self.data_essays, self.X_essays, self.y_essays, self.labels
@@ -0,0 +1,67 @@
+import os
+import hashlib
+import threading
+
+
+class model_registry:
+    """
+    Keeps each named model loaded once per process. A model is reloaded only when one of
+    its files changes : the (mtime, size) of every file is checked on each access, and
+    when it differs the content hash is compared before deciding to reload.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def stat(self, paths):
+        """
+        Returns a cheap fingerprint of the model files.
+        """
+        return tuple((os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths)
+
+    def digest(self, paths):
+        """
+        Returns the content hash of the model files.
+        """
+        sha = hashlib.sha1()
+        for path in paths:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(block)
+        return sha.hexdigest()
+
+    def get(self, name, paths, loader):
+        """
+        Returns the warm model registered under name, calling loader() to (re)load it
+        when it was never loaded or when its files changed on disk.
+        """
+        stat = self.stat(paths)
+        entry = self.models.get(name)
+        if entry is not None and entry['stat'] == stat:
+            return entry['model']
+
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is not None and entry['stat'] == stat:
+                return entry['model']
+            digest = self.digest(paths)
+            if entry is not None and entry['digest'] == digest:
+                entry['stat'] = stat
+                return entry['model']
+            self.models[name] = {'model': loader(), 'stat': stat, 'digest': digest}
+            return self.models[name]['model']
+
+    def invalidate(self, name=None):
+        """
+        Drops one named model, or every model if no name is given.
+        """
+        with self.lock:
+            if name is None:
+                self.models.clear()
+            else:
+                self.models.pop(name, None)
+
+
+# Process-wide registry shared by the prediction modules
+registry = model_registry()
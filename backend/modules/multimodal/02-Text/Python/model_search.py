@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+
+def sample_configs(param_grid, n_iter=None, random_state=None):
+    """
+    Returns every configuration of the grid, or a random sample of n_iter of them.
+    """
+    if n_iter is None:
+        return list(ParameterGrid(param_grid))
+    return list(ParameterSampler(param_grid, n_iter, random_state=random_state))
+
+
+def split_params(config, prefix):
+    """
+    Returns the parameters of a configuration starting with prefix, without the prefix.
+    """
+    return {key[len(prefix):]: value for key, value in config.items() if key.startswith(prefix)}
+
+
+def score_fold(estimator, X_train, y_train, X_test, y_test):
+    """
+    Fits a fresh copy of the estimator on a fold and returns its per-trait accuracy on the held-out part.
+    """
+    model = clone(estimator).fit(X_train, y_train)
+    return (np.asarray(model.predict(X_test)) == y_test).mean(axis=0)
+
+
+def cross_validate_configs(tasks, n_jobs=-1, verbose=0):
+    """
+    Runs every (estimator, fold features) task in parallel across cores and returns their scores in order.
+    Fold features are plain NumPy arrays, which joblib memory-maps for the workers instead of copying them.
+    """
+    return Parallel(n_jobs=n_jobs, verbose=verbose)(
+        delayed(score_fold)(estimator, *features) for estimator, features in tasks)
+
+
+def results_table(configs, scores, labels):
+    """
+    Returns a comparable table with one row per configuration : its parameters, the mean
+    accuracy of each trait across folds, and the overall mean and standard deviation.
+    """
+    rows = []
+    for config, config_scores in zip(configs, scores):
+        config_scores = np.asarray(config_scores)
+        row = dict(config)
+        row.update(zip(labels, config_scores.mean(axis=0)))
+        row['mean_accuracy'] = config_scores.mean()
+        row['std_accuracy'] = config_scores.mean(axis=1).std()
+        rows.append(row)
+    table = pd.DataFrame(rows).sort_values('mean_accuracy', ascending=False).reset_index(drop=True)
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table
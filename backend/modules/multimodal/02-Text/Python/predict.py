@@ -11,6 +11,7 @@ import seaborn as sns
 
 import os
 import time
+from itertools import islice
 import string
 import dill
 import pickle
@@ -20,6 +21,9 @@ from nltk import wordpunct_tokenize, WordNetLemmatizer, sent_tokenize, pos_tag
 from nltk.corpus import stopwords as sw, wordnet as wn
 from nltk.stem.snowball import SnowballStemmer
 
+from text_normalization import STOPWORDS, PUNCTUATION, clean_text, iter_lemmas, lemmatize
+from model_registry import registry
+
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FeatureUnion, make_pipeline
 from sklearn.preprocessing import LabelEncoder, FunctionTransformer
@@ -63,9 +67,8 @@ class predict:
             """
             self.lower = lower
             self.strip = strip
-            self.stopwords = set(stopwords) if stopwords else set(sw.words('english'))
-            self.punct = set(punct) if punct else set(string.punctuation)
-            self.lemmatizer = WordNetLemmatizer()
+            self.stopwords = frozenset(stopwords) if stopwords else STOPWORDS
+            self.punct = frozenset(punct) if punct else PUNCTUATION
             self.max_sentence_len = max_sentence_len
 
         def fit(self, X, y=None):
@@ -94,42 +97,9 @@ class predict:
             Uses the part of speech tags to look up the lemma in WordNet, and returns the lowercase
             version of all the words, removing stopwords and punctuation.
             """
-            lemmatized_tokens = []
-
-            # Clean the text
-            document = re.sub(r"[^A-Za-z0-9^,!.\/'+-=]", " ", document)
-            document = re.sub(r"what's", "what is ", document)
-            document = re.sub(r"\'s", " ", document)
-            document = re.sub(r"\'ve", " have ", document)
-            document = re.sub(r"can't", "cannot ", document)
-            document = re.sub(r"n't", " not ", document)
-            document = re.sub(r"i'm", "i am ", document)
-            document = re.sub(r"\'re", " are ", document)
-            document = re.sub(r"\'d", " would ", document)
-            document = re.sub(r"\'ll", " will ", document)
-            document = re.sub(r"(\d+)(k)", r"\g<1>000", document)
-
-            # Break the document into sentences
-            for sent in sent_tokenize(document):
-
-                # Break the sentence into part of speech tagged tokens
-                for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                    # Apply preprocessing to the token
-                    token = token.lower() if self.lower else token
-                    token = token.strip() if self.strip else token
-                    token = token.strip('_') if self.strip else token
-                    token = token.strip('*') if self.strip else token
-
-                    # If punctuation or stopword, ignore token and continue
-                    if token in self.stopwords or all(char in self.punct for char in token):
-                        continue
-
-                    # Lemmatize the token
-                    lemma = self.lemmatize(token, tag)
-                    lemmatized_tokens.append(lemma)
-
-            doc = ' '.join(lemmatized_tokens)
+            # Clean the text, then normalize and lemmatize its tokens
+            document = clean_text(document)
+            doc = ' '.join(iter_lemmas(document, self.stopwords, self.punct, self.lower, self.strip))
             tokenized_document = self.vectorize(np.array(doc)[np.newaxis])
             return tokenized_document
 
@@ -139,33 +109,34 @@ class predict:
             Returns a vectorized padded version of sequences.
             """
             save_path = "/Users/raphaellederman/Desktop/Fil_Rouge/Text/Data/padding.pickle"
-            with open(save_path, 'rb') as f:
-                tokenizer = pickle.load(f)
+            tokenizer = registry.get(('padding', save_path), [save_path], lambda: self.load_tokenizer(save_path))
             doc_pad = tokenizer.texts_to_sequences(doc)
             doc_pad = pad_sequences(doc_pad, padding='pre', truncating='pre', maxlen=self.max_sentence_len)
             return np.squeeze(doc_pad)
 
+        def load_tokenizer(self, save_path):
+            """
+            Loads the fitted Keras tokenizer used for padding.
+            """
+            with open(save_path, 'rb') as f:
+                return pickle.load(f)
+
         def lemmatize(self, token, tag):
             """
             Converts the Penn Treebank tag to a WordNet POS tag, then uses that
             tag to perform WordNet lemmatization.
             """
-            tag = {
-                'N': wn.NOUN,
-                'V': wn.VERB,
-                'R': wn.ADV,
-                'J': wn.ADJ
-            }.get(tag[0], wn.NOUN)
-
-            return self.lemmatizer.lemmatize(token, tag)
+            return lemmatize(token, tag)
 
 
     class MyRNNTransformer(BaseEstimator, TransformerMixin):
         """
         Transformer allowing our Keras model to be included in our pipeline
         """
-        def __init__(self, classifier):
+        def __init__(self, classifier, batch_size=256, threshold=0.2):
             self.classifier = classifier
+            self.batch_size = batch_size
+            self.threshold = threshold
 
         def fit(self, X, y):
             batch_size = 32
@@ -176,34 +147,65 @@ class predict:
             return self
 
         def transform(self, X):
-            self.pred = self.classifier.predict(X)
-            self.classes = [[0 if el < 0.2 else 1 for el in item] for item in self.pred]
+            self.pred = self.classifier.predict(X, batch_size=self.batch_size)
+            self.classes = self.predict_classes(self.pred)
             return self.pred
 
+        def predict_classes(self, pred):
+            """
+            Thresholds the trait probabilities into 0/1 classes.
+            """
+            return (np.asarray(pred) >= self.threshold).astype(int)
 
-    def run(self, X, model_name):
+
+    def load_classifier(self, model_path, weights_path):
         """
-        Returns the predictions from the pipeline including our NLTKPreprocessor and Keras classifier.
+        Rebuilds the Keras classifier from its JSON definition and h5 weights.
         """
-        def build(classifier):
-            """
-            Inner build function that builds a pipeline including a preprocessor and a classifier.
-            """
-            model = Pipeline([
-                    ('preprocessor', self.NLTKPreprocessor),
-                    ('classifier', classifier)
-                ])
-            return model
+        with open(model_path, 'r') as json_file:
+            classifier = model_from_json(json_file.read())
+        classifier.load_weights(weights_path)
+        classifier.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
+        # Build the predict function now so that the warm model can be shared by request threads
+        if hasattr(classifier, '_make_predict_function'):
+            classifier._make_predict_function()
+        return classifier
 
+
+    def build(self, model_name, batch_size=256):
+        """
+        Builds a pipeline including a preprocessor and the warm Keras classifier.
+        """
         save_path = '/Users/raphaellederman/Desktop/Fil_Rouge/Text/Models/'
-        json_file = open(save_path + model_name + '.json', 'r')
-        classifier = model_from_json(json_file.read())
-        classifier.load_weights(save_path + model_name + '.h5')
-        classifier.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
-        json_file.close()
-        model = build(self.MyRNNTransformer(classifier))
+        paths = [save_path + model_name + '.json', save_path + model_name + '.h5']
+        classifier = registry.get(('predict', model_name), paths, lambda: self.load_classifier(*paths))
+        model = Pipeline([
+                ('preprocessor', self.NLTKPreprocessor),
+                ('classifier', self.MyRNNTransformer(classifier, batch_size=batch_size))
+            ])
+        return model
+
+
+    def run(self, X, model_name):
+        """
+        Returns the predictions from the pipeline including our NLTKPreprocessor and Keras classifier.
+        """
+        model = self.build(model_name)
         y_pred = model.transform([X])
 
         return y_pred
 
 
+    def iter_predictions(self, X, model_name, chunksize=1000, batch_size=256):
+        """
+        Yields the predictions of successive chunks of documents, so that large document sets
+        (lists or iterators) are never preprocessed and padded all at once.
+        """
+        model = self.build(model_name, batch_size=batch_size)
+        documents = iter(X)
+        chunk = list(islice(documents, chunksize))
+        while chunk:
+            yield model.transform(chunk)
+            chunk = list(islice(documents, chunksize))
+
+
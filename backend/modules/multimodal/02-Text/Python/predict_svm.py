@@ -20,6 +20,9 @@ from nltk import wordpunct_tokenize, WordNetLemmatizer, sent_tokenize, pos_tag
 from nltk.corpus import stopwords as sw, wordnet as wn
 from nltk.stem.snowball import SnowballStemmer
 
+from text_normalization import STOPWORDS, PUNCTUATION, clean_text, iter_lemmas, lemmatize
+from model_registry import registry
+
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FeatureUnion, make_pipeline
 from sklearn.preprocessing import LabelEncoder, FunctionTransformer
@@ -63,9 +66,8 @@ class predict_svm:
             """
             self.lower = lower
             self.strip = strip
-            self.stopwords = set(stopwords) if stopwords else set(sw.words('english'))
-            self.punct = set(punct) if punct else set(string.punctuation)
-            self.lemmatizer = WordNetLemmatizer()
+            self.stopwords = frozenset(stopwords) if stopwords else STOPWORDS
+            self.punct = frozenset(punct) if punct else PUNCTUATION
             self.max_sentence_len = max_sentence_len
 
         def fit(self, X, y=None):
@@ -94,42 +96,9 @@ class predict_svm:
             Uses the part of speech tags to look up the lemma in WordNet, and returns the lowercase
             version of all the words, removing stopwords and punctuation.
             """
-            lemmatized_tokens = []
-
-            # Clean the text
-            document = re.sub(r"[^A-Za-z0-9^,!.\/'+-=]", " ", document)
-            document = re.sub(r"what's", "what is ", document)
-            document = re.sub(r"\'s", " ", document)
-            document = re.sub(r"\'ve", " have ", document)
-            document = re.sub(r"can't", "cannot ", document)
-            document = re.sub(r"n't", " not ", document)
-            document = re.sub(r"i'm", "i am ", document)
-            document = re.sub(r"\'re", " are ", document)
-            document = re.sub(r"\'d", " would ", document)
-            document = re.sub(r"\'ll", " will ", document)
-            document = re.sub(r"(\d+)(k)", r"\g<1>000", document)
-
-            # Break the document into sentences
-            for sent in sent_tokenize(document):
-
-                # Break the sentence into part of speech tagged tokens
-                for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                    # Apply preprocessing to the token
-                    token = token.lower() if self.lower else token
-                    token = token.strip() if self.strip else token
-                    token = token.strip('_') if self.strip else token
-                    token = token.strip('*') if self.strip else token
-
-                    # If punctuation or stopword, ignore token and continue
-                    if token in self.stopwords or all(char in self.punct for char in token):
-                        continue
-
-                    # Lemmatize the token
-                    lemma = self.lemmatize(token, tag)
-                    lemmatized_tokens.append(lemma)
-
-            doc = ' '.join(lemmatized_tokens)
+            # Clean the text, then normalize and lemmatize its tokens
+            document = clean_text(document)
+            doc = ' '.join(iter_lemmas(document, self.stopwords, self.punct, self.lower, self.strip))
             tokenized_document = self.vectorize(np.array(doc)[np.newaxis])
             return tokenized_document
 
@@ -139,25 +108,24 @@ class predict_svm:
             Returns a vectorized padded version of sequences.
             """
             save_path = "Data/padding.pickle"
-            with open(save_path, 'rb') as f:
-                tokenizer = pickle.load(f)
+            tokenizer = registry.get(('padding', save_path), [save_path], lambda: self.load_tokenizer(save_path))
             doc_pad = tokenizer.texts_to_sequences(doc)
             doc_pad = pad_sequences(doc_pad, padding='pre', truncating='pre', maxlen=self.max_sentence_len)
             return np.squeeze(doc_pad)
 
+        def load_tokenizer(self, save_path):
+            """
+            Loads the fitted Keras tokenizer used for padding.
+            """
+            with open(save_path, 'rb') as f:
+                return pickle.load(f)
+
         def lemmatize(self, token, tag):
             """
             Converts the Penn Treebank tag to a WordNet POS tag, then uses that
             tag to perform WordNet lemmatization.
             """
-            tag = {
-                'N': wn.NOUN,
-                'V': wn.VERB,
-                'R': wn.ADV,
-                'J': wn.ADJ
-            }.get(tag[0], wn.NOUN)
-
-            return self.lemmatizer.lemmatize(token, tag)
+            return lemmatize(token, tag)
 
 
     class MyRNNTransformer(BaseEstimator, TransformerMixin):
@@ -208,14 +176,15 @@ class predict_svm:
 
     def multiclass_accuracy(self,predictions, target):
         "Returns the multiclass accuracy of the classifier's predictions"
-        score = []
-        for j in range(0, 5):
-            count = 0
-            for i in range(len(predictions)):
-                if predictions[i][j] == target[i][j]:
-                    count += 1
-            score.append(count / len(predictions))
-        return score
+        return (np.asarray(predictions) == np.asarray(target)).mean(axis=0).tolist()
+
+
+    def load_model(self, model_path):
+        """
+        Deserializes the complete pipeline saved by train_svm.
+        """
+        with open(model_path, 'rb') as f:
+            return dill.load(f)
 
 
     def run(self, X, model_name):
@@ -237,7 +206,7 @@ class predict_svm:
             return model
 
         save_path = "Models/"
-        with open(save_path + model_name, 'rb') as f:
-            model = dill.load(f)
+        model = registry.get(('predict_svm', model_name), [save_path + model_name],
+                             lambda: self.load_model(save_path + model_name))
         y_pred = model.predict(X)
         return y_pred
\ No newline at end of file
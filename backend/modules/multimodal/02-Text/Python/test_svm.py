@@ -20,6 +20,9 @@ from nltk import wordpunct_tokenize, WordNetLemmatizer, sent_tokenize, pos_tag
 from nltk.corpus import stopwords as sw, wordnet as wn
 from nltk.stem.snowball import SnowballStemmer
 
+from text_normalization import STOPWORDS, PUNCTUATION, lemmatize, clean_text, iter_lemmas
+from corpus_cache import get_corpus_cache
+
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FeatureUnion, make_pipeline
 from sklearn.preprocessing import LabelEncoder, FunctionTransformer
@@ -48,7 +51,7 @@ class test_svm:
 
     def __init__(self):
         self.max_sentence_len = 300
-        self.NLTKPreprocessor = self.NLTKPreprocessor()
+        self.NLTKPreprocessor = self.NLTKPreprocessor(cache=True)
         #self.MyRNNTransformer = self.MyRNNTransformer()
 
 
@@ -57,16 +60,19 @@ class test_svm:
         Transforms input data by using NLTK tokenization, POS tagging, lemmatization and vectorization.
         """
 
-        def __init__(self, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True):
+        cache = False
+
+        def __init__(self, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True, cache=False):
             """
             Instantiates the preprocessor.
             """
             self.lower = lower
             self.strip = strip
-            self.stopwords = set(stopwords) if stopwords else set(sw.words('english'))
-            self.punct = set(punct) if punct else set(string.punctuation)
-            self.lemmatizer = WordNetLemmatizer()
+            self.stopwords = frozenset(stopwords) if stopwords else STOPWORDS
+            self.punct = frozenset(punct) if punct else PUNCTUATION
             self.max_sentence_len = max_sentence_len
+            # Only the training, testing and visualization scripts persist their documents to the corpus cache
+            self.cache = cache
 
         def fit(self, X, y=None):
             """
@@ -84,6 +90,9 @@ class test_svm:
             """
             Actually runs the preprocessing on each document.
             """
+            # Normalize the documents missing from the corpus cache in a single pass
+            if self.cache:
+                self.corpus_cache().transform(X)
             output = np.array([(self.tokenize(doc)) for doc in X])
             return output
 
@@ -94,46 +103,31 @@ class test_svm:
             Uses the part of speech tags to look up the lemma in WordNet, and returns the lowercase
             version of all the words, removing stopwords and punctuation.
             """
-            lemmatized_tokens = []
-
-            # Clean the text
-            document = re.sub(r"[^A-Za-z0-9^,!.\/'+-=]", " ", document)
-            document = re.sub(r"what's", "what is ", document)
-            document = re.sub(r"\'s", " ", document)
-            document = re.sub(r"\'ve", " have ", document)
-            document = re.sub(r"can't", "cannot ", document)
-            document = re.sub(r"n't", " not ", document)
-            document = re.sub(r"i'm", "i am ", document)
-            document = re.sub(r"\'re", " are ", document)
-            document = re.sub(r"\'d", " would ", document)
-            document = re.sub(r"\'ll", " will ", document)
-            document = re.sub(r"(\d+)(k)", r"\g<1>000", document)
-
-            # Break the document into sentences
-            for sent in sent_tokenize(document):
-
-                # Break the sentence into part of speech tagged tokens
-                for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                    # Apply preprocessing to the token
-                    token = token.lower() if self.lower else token
-                    token = token.strip() if self.strip else token
-                    token = token.strip('_') if self.strip else token
-                    token = token.strip('*') if self.strip else token
-
-                    # If punctuation or stopword, ignore token and continue
-                    if token in self.stopwords or all(char in self.punct for char in token):
-                        continue
-
-                    # Lemmatize the token
-                    lemma = self.lemmatize(token, tag)
-                    lemmatized_tokens.append(lemma)
-
-            doc = ' '.join(lemmatized_tokens)
+            if self.cache:
+                # Reuse the normalized tokens of the document from the corpus cache
+                doc = ' '.join(self.corpus_cache().transform([document])[0])
+            else:
+                # Clean the text, then normalize and lemmatize its tokens
+                doc = ' '.join(iter_lemmas(clean_text(document), self.stopwords, self.punct, self.lower, self.strip))
             tokenized_document = self.vectorize(np.array(doc)[np.newaxis])
             return tokenized_document
 
 
+        def __getstate__(self):
+            """
+            Pickles the preprocessor without the corpus cache option, so that the saved models never
+            write the documents they score to the cache.
+            """
+            state = dict(super().__getstate__())
+            state.pop('cache', None)
+            return state
+
+        def corpus_cache(self):
+            """
+            Returns the preprocessed-corpus cache matching the configuration of the preprocessor.
+            """
+            return get_corpus_cache(True, self.stopwords, self.punct, self.lower, self.strip)
+
         def vectorize(self, doc):
             """
             Returns a vectorized padded version of sequences.
@@ -150,14 +144,7 @@ class test_svm:
             Converts the Penn Treebank tag to a WordNet POS tag, then uses that
             tag to perform WordNet lemmatization.
             """
-            tag = {
-                'N': wn.NOUN,
-                'V': wn.VERB,
-                'R': wn.ADV,
-                'J': wn.ADJ
-            }.get(tag[0], wn.NOUN)
-
-            return self.lemmatizer.lemmatize(token, tag)
+            return lemmatize(token, tag)
 
 
     class MyRNNTransformer(BaseEstimator, TransformerMixin):
@@ -208,14 +195,7 @@ class test_svm:
 
     def multiclass_accuracy(self,predictions, target):
         "Returns the multiclass accuracy of the classifier's predictions"
-        score = []
-        for j in range(0, 5):
-            count = 0
-            for i in range(len(predictions)):
-                if predictions[i][j] == target[i][j]:
-                    count += 1
-            score.append(count / len(predictions))
-        return score
+        return (np.asarray(predictions) == np.asarray(target)).mean(axis=0).tolist()
 
 
     def run(self, X, y, model_name):
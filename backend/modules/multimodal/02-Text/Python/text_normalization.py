@@ -0,0 +1,117 @@
+import re
+import string
+from functools import lru_cache
+
+from nltk import wordpunct_tokenize, WordNetLemmatizer, sent_tokenize
+from nltk.corpus import stopwords as sw, wordnet as wn
+from nltk.tag.perceptron import PerceptronTagger
+
+# Shared, precomputed lookup tables used by every preprocessor of the text pipeline
+STOPWORDS = frozenset(sw.words('english'))
+PUNCTUATION = frozenset(string.punctuation)
+LEMMATIZER = WordNetLemmatizer()
+LEMMA_CACHE_SIZE = 2 ** 17
+
+# Bump whenever the normalization rules change, to invalidate the preprocessed-corpus caches
+NORMALIZATION_VERSION = 1
+
+PENN_TO_WORDNET = {
+    'N': wn.NOUN,
+    'V': wn.VERB,
+    'R': wn.ADV,
+    'J': wn.ADJ
+}
+
+CLEANING_RULES = [
+    (re.compile(r"[^A-Za-z0-9^,!.\/'+-=]"), " "),
+    (re.compile(r"what's"), "what is "),
+    (re.compile(r"\'s"), " "),
+    (re.compile(r"\'ve"), " have "),
+    (re.compile(r"can't"), "cannot "),
+    (re.compile(r"n't"), " not "),
+    (re.compile(r"i'm"), "i am "),
+    (re.compile(r"\'re"), " are "),
+    (re.compile(r"\'d"), " would "),
+    (re.compile(r"\'ll"), " will "),
+    (re.compile(r"(\d+)(k)"), r"\g<1>000"),
+]
+
+
+@lru_cache(maxsize=1)
+def get_tagger():
+    """
+    Returns a single perceptron POS tagger per process (nltk.pos_tag reloads it on every call).
+    """
+    return PerceptronTagger()
+
+
+def wordnet_pos(tag):
+    """
+    Converts a Penn Treebank tag to a WordNet POS tag.
+    """
+    return PENN_TO_WORDNET.get(tag[0], wn.NOUN)
+
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize_wordnet(token, pos):
+    """
+    Memoized WordNet lemmatization keyed by (token, WordNet POS).
+    """
+    return LEMMATIZER.lemmatize(token, pos)
+
+
+def lemmatize(token, tag):
+    """
+    Converts the Penn Treebank tag to a WordNet POS tag, then uses that
+    tag to perform (memoized) WordNet lemmatization.
+    """
+    return lemmatize_wordnet(token, wordnet_pos(tag))
+
+
+def clean_text(document):
+    """
+    Standardizes formulations of a raw document using regular expressions.
+    """
+    for pattern, replacement in CLEANING_RULES:
+        document = pattern.sub(replacement, document)
+    return document
+
+
+def is_ignored(token, stopwords=STOPWORDS, punct=PUNCTUATION):
+    """
+    Returns True if the token is a stopword or made of punctuation only.
+    """
+    return token in stopwords or all(char in punct for char in token)
+
+
+def iter_lemmas(text, stopwords=STOPWORDS, punct=PUNCTUATION, lower=True, strip=True):
+    """
+    Yields the normalized, lemmatized tokens of a text by applying segmentation,
+    tokenization and part of speech tagging, removing stopwords and punctuation.
+    """
+    tagger = get_tagger()
+
+    # Break the document into sentences
+    for sent in sent_tokenize(text):
+
+        # Break the sentence into part of speech tagged tokens
+        for token, tag in tagger.tag(wordpunct_tokenize(sent)):
+
+            # Apply preprocessing to the token
+            token = token.lower() if lower else token
+            token = token.strip() if strip else token
+            token = token.strip('_') if strip else token
+            token = token.strip('*') if strip else token
+
+            # If punctuation or stopword, ignore token and continue
+            if is_ignored(token, stopwords, punct):
+                continue
+
+            yield lemmatize(token, tag)
+
+
+def preprocess_corpus(X_corpus):
+    """
+    Returns a preprocessed version of a full corpus (ie. tokenization and lemmatization using POS taggs)
+    """
+    return ' '.join(iter_lemmas(' '.join(X_corpus)))
@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 import wget
 
 import os
+import glob
 import time
 import string
 import dill
@@ -22,6 +23,11 @@ from nltk import wordpunct_tokenize, WordNetLemmatizer, sent_tokenize, pos_tag
 from nltk.corpus import stopwords as sw, wordnet as wn
 from nltk.stem.snowball import SnowballStemmer
 
+from text_normalization import STOPWORDS, PUNCTUATION, lemmatize, clean_text, iter_lemmas
+from corpus_cache import get_corpus_cache
+from word_vectors import load_word_vectors
+from model_registry import registry
+
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FeatureUnion, make_pipeline
 from sklearn.preprocessing import LabelEncoder, FunctionTransformer
@@ -39,11 +45,13 @@ import tensorflow as tf
 
 from keras.preprocessing.text import Tokenizer
 from keras.preprocessing.sequence import pad_sequences
-from keras.models import Sequential, Model, model_from_json
+from keras.models import Sequential, Model, model_from_json, load_model
 from keras.layers.normalization import BatchNormalization
 from keras.layers.embeddings import Embedding
 from keras.layers import Dense, LSTM, SpatialDropout1D, Activation, Conv1D, MaxPooling1D, Input, concatenate
 from keras.utils.np_utils import to_categorical
+from keras.utils import Sequence
+from keras.callbacks import ModelCheckpoint, EarlyStopping
 
 
 class train:
@@ -59,7 +67,7 @@ class train:
         self.conv_nfilters = 128
         self.conv_kernel_size = 8
         self.max_pool_size = 2
-        self.NLTKPreprocessor = self.NLTKPreprocessor(corpus)
+        self.NLTKPreprocessor = self.NLTKPreprocessor(corpus, cache=True)
         #self.MyRNNTransformer = self.MyRNNTransformer()
 
 
@@ -68,17 +76,22 @@ class train:
         Transforms input data by using NLTK tokenization, POS tagging, lemmatization and vectorization.
         """
 
-        def __init__(self, corpus, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True):
+        cache = False
+        # Fitted Keras tokenizer of the model the preprocessor feeds
+        tokenizer_path = "Data/padding.pickle"
+
+        def __init__(self, corpus, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True, cache=False):
             """
             Instantiates the preprocessor.
             """
             self.lower = lower
             self.strip = strip
-            self.stopwords = set(stopwords) if stopwords else set(sw.words('english'))
-            self.punct = set(punct) if punct else set(string.punctuation)
-            self.lemmatizer = WordNetLemmatizer()
+            self.stopwords = frozenset(stopwords) if stopwords else STOPWORDS
+            self.punct = frozenset(punct) if punct else PUNCTUATION
             self.corpus = corpus
             self.max_sentence_len = max_sentence_len
+            # Only the training, testing and visualization scripts persist their documents to the corpus cache
+            self.cache = cache
 
         def fit(self, X, y=None):
             """
@@ -96,6 +109,9 @@ class train:
             """
             Actually runs the preprocessing on each document.
             """
+            # Normalize the documents missing from the corpus cache in a single pass
+            if self.cache:
+                self.corpus_cache().transform(X)
             output = np.array([(self.tokenize(doc)) for doc in X])
             return output
 
@@ -106,70 +122,54 @@ class train:
             Uses the part of speech tags to look up the lemma in WordNet, and returns the lowercase
             version of all the words, removing stopwords and punctuation.
             """
-            lemmatized_tokens = []
-
-            # Clean the text
-            document = re.sub(r"[^A-Za-z0-9^,!.\/'+-=]", " ", document)
-            document = re.sub(r"what's", "what is ", document)
-            document = re.sub(r"\'s", " ", document)
-            document = re.sub(r"\'ve", " have ", document)
-            document = re.sub(r"can't", "cannot ", document)
-            document = re.sub(r"n't", " not ", document)
-            document = re.sub(r"i'm", "i am ", document)
-            document = re.sub(r"\'re", " are ", document)
-            document = re.sub(r"\'d", " would ", document)
-            document = re.sub(r"\'ll", " will ", document)
-            document = re.sub(r"(\d+)(k)", r"\g<1>000", document)
-
-            # Break the document into sentences
-            for sent in sent_tokenize(document):
-
-                # Break the sentence into part of speech tagged tokens
-                for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                    # Apply preprocessing to the token
-                    token = token.lower() if self.lower else token
-                    token = token.strip() if self.strip else token
-                    token = token.strip('_') if self.strip else token
-                    token = token.strip('*') if self.strip else token
-
-                    # If punctuation or stopword, ignore token and continue
-                    if token in self.stopwords or all(char in self.punct for char in token):
-                        continue
-
-                    # Lemmatize the token
-                    lemma = self.lemmatize(token, tag)
-                    lemmatized_tokens.append(lemma)
-
-            doc = ' '.join(lemmatized_tokens)
+            if self.cache:
+                # Reuse the normalized tokens of the document from the corpus cache
+                doc = ' '.join(self.corpus_cache().transform([document])[0])
+            else:
+                # Clean the text, then normalize and lemmatize its tokens
+                doc = ' '.join(iter_lemmas(clean_text(document), self.stopwords, self.punct, self.lower, self.strip))
             tokenized_document = self.vectorize(np.array(doc)[np.newaxis])
             return tokenized_document
 
 
+        def __getstate__(self):
+            """
+            Pickles the preprocessor without the corpus cache option, so that the saved models never
+            write the documents they score to the cache.
+            """
+            state = dict(super().__getstate__())
+            state.pop('cache', None)
+            return state
+
+        def corpus_cache(self):
+            """
+            Returns the preprocessed-corpus cache matching the configuration of the preprocessor.
+            """
+            return get_corpus_cache(True, self.stopwords, self.punct, self.lower, self.strip)
+
         def vectorize(self, doc):
             """
             Returns a vectorized padded version of sequences.
             """
-            save_path = "Data/padding.pickle"
-            with open(save_path, 'rb') as f:
-                tokenizer = pickle.load(f)
+            save_path = self.tokenizer_path
+            tokenizer = registry.get(('padding', save_path), [save_path], lambda: self.load_tokenizer(save_path))
             doc_pad = tokenizer.texts_to_sequences(doc)
             doc_pad = pad_sequences(doc_pad, padding='pre', truncating='pre', maxlen=self.max_sentence_len)
             return np.squeeze(doc_pad)
 
+        def load_tokenizer(self, save_path):
+            """
+            Loads the fitted Keras tokenizer used for padding.
+            """
+            with open(save_path, 'rb') as f:
+                return pickle.load(f)
+
         def lemmatize(self, token, tag):
             """
             Converts the Penn Treebank tag to a WordNet POS tag, then uses that
             tag to perform WordNet lemmatization.
             """
-            tag = {
-                'N': wn.NOUN,
-                'V': wn.VERB,
-                'R': wn.ADV,
-                'J': wn.ADJ
-            }.get(tag[0], wn.NOUN)
-
-            return self.lemmatizer.lemmatize(token, tag)
+            return lemmatize(token, tag)
 
 
     class MyRNNTransformer(BaseEstimator, TransformerMixin):
@@ -193,64 +193,81 @@ class train:
             return self.classes
 
 
-    def multiclass_accuracy(self,predictions, target):
-        "Returns the multiclass accuracy of the classifier's predictions"
-        score = []
-        for j in range(0, 5):
-            count = 0
-            for i in range(len(predictions)):
-                if predictions[i][j] == target[i][j]:
-                    count += 1
-            score.append(count / len(predictions))
-        return score
+    class ResumableEarlyStopping(EarlyStopping):
+        """
+        Early stopping whose best value and patience count are saved after every epoch, and
+        restored from a previous state when training resumes.
+        """
 
+        def __init__(self, state_path, state=None, **kwargs):
+            super().__init__(**kwargs)
+            self.state_path = state_path
+            self.state = state
 
-    def load_google_vec(self):
-        url = 'https://s3.amazonaws.com/dl4j-distribution/GoogleNews-vectors-negative300.bin.gz'
-        #wget.download(url, 'Data/GoogleNews-vectors.bin.gz')
-        return KeyedVectors.load_word2vec_format(
-            'Data/GoogleNews-vectors.bin.gz',
-            binary=True)
+        def on_train_begin(self, logs=None):
+            super().on_train_begin(logs)
+            if self.state:
+                self.best = self.state['best']
+                self.wait = self.state['wait']
 
-    def lemmatize_token(self, token, tag):
-        tag = {
-            'N': wn.NOUN,
-            'V': wn.VERB,
-            'R': wn.ADV,
-            'J': wn.ADJ
-        }.get(tag[0], wn.NOUN)
-        return WordNetLemmatizer().lemmatize(token, tag)
+        def on_epoch_end(self, epoch, logs=None):
+            super().on_epoch_end(epoch, logs)
+            with open(self.state_path, 'wb') as f:
+                pickle.dump({'best': self.best, 'wait': self.wait}, f)
 
 
-    def get_preprocessed_corpus(self, X_corpus):
+    class PaddedBatchSequence(Sequence):
         """
-        Returns a preprocessed version of a full corpus (ie. tokenization and lemmatization using POS taggs)
+        Streams batches of padded sequences, encoding only the lemmas of the documents of the
+        requested batch with the fitted tokenizer, so that the padded corpus is never
+        materialized as a whole.
         """
-        X = ' '.join(X_corpus)
-        lemmatized_tokens = []
+        def __init__(self, tokenizer, cache, X, y, max_sentence_len=300, batch_size=32, shuffle=True):
+            self.tokenizer = tokenizer
+            self.cache = cache
+            self.X = X
+            self.max_sentence_len = max_sentence_len
+            self.y = np.asarray(y)
+            self.batch_size = batch_size
+            self.shuffle = shuffle
+            self.indices = np.arange(len(X))
+            self.on_epoch_end()
+
+        def __len__(self):
+            return int(np.ceil(len(self.indices) / self.batch_size))
+
+        def __getitem__(self, index):
+            batch = self.indices[index * self.batch_size:(index + 1) * self.batch_size]
+            texts = [' '.join(lemmas) for lemmas in self.cache.transform([self.X[i] for i in batch])]
+            X_batch = pad_sequences(self.tokenizer.texts_to_sequences(texts), padding='pre', truncating='pre',
+                                    maxlen=self.max_sentence_len)
+            return X_batch, self.y[batch]
+
+        def on_epoch_end(self):
+            if self.shuffle:
+                np.random.shuffle(self.indices)
 
-        # Break the document into sentences
-        for sent in sent_tokenize(X):
 
-            # Break the sentence into part of speech tagged tokens
-            for token, tag in pos_tag(wordpunct_tokenize(sent)):
+    def multiclass_accuracy(self,predictions, target):
+        "Returns the multiclass accuracy of the classifier's predictions"
+        return (np.asarray(predictions) == np.asarray(target)).mean(axis=0).tolist()
 
-                # Apply preprocessing to the token
-                token = token.lower()
-                token = token.strip()
-                token = token.strip('_')
-                token = token.strip('*')
 
-                # If punctuation or stopword, ignore token and continue
-                if token in set(sw.words('english')) or all(char in set(string.punctuation) for char in token):
-                    continue
+    def load_google_vec(self):
+        """
+        Returns the memory-mapped Word2Vec store (converted from the GoogleNews binary on first use).
+        """
+        return load_word_vectors()
+
+    def lemmatize_token(self, token, tag):
+        return lemmatize(token, tag)
 
-                # Lemmatize the token and yield
-                lemma = self.lemmatize_token(token, tag)
-                lemmatized_tokens.append(lemma)
 
-        doc = ' '.join(lemmatized_tokens)
-        return doc
+    def get_preprocessed_corpus(self, X_corpus):
+        """
+        Returns a preprocessed version of a full corpus (ie. tokenization and lemmatization using POS taggs)
+        """
+        return ' '.join(' '.join(tokens) for tokens in get_corpus_cache(clean=False).transform(X_corpus))
 
 
     def prepare_embedding(self, X):
@@ -274,42 +291,38 @@ class train:
         train_word_index = tokenizer.word_index
 
         # Construct the embedding weights matrix and word-vector dictionnary
-        train_embedding_weights = np.zeros((len(train_word_index) + 1, self.embed_dim))
-        for word, index in train_word_index.items():
-            train_embedding_weights[index, :] = word2vec[word] if word in word2vec else np.random.rand(self.embed_dim)
+        train_embedding_weights = self.embedding_weights(train_word_index, word2vec)
         word_vector_dict = dict(zip(pd.Series(list(train_word_index.keys())),
                                     pd.Series(list(train_word_index.keys())).apply(
                                         lambda x: train_embedding_weights[train_word_index[x]])))
         return train_embedding_weights, train_word_index, word_vector_dict
 
 
-    def run(self, X, y, model_name=None, pretrained_weights_path = None, pretrained_model_path = None, verbose=True):
+    def embedding_weights(self, word_index, word2vec):
         """
-        Builds a classifer for the given list of documents and targets
-
+        Returns the embedding weights matrix whose row i is the word vector of the word of index i.
         """
+        weights = np.zeros((len(word_index) + 1, self.embed_dim))
+        for word, index in word_index.items():
+            weights[index, :] = word2vec[word] if word in word2vec else np.random.rand(self.embed_dim)
+        return weights
 
-        def build(classifier, X, y, embedding_dict, corpus):
-            """
-            Inner build function that builds a pipeline including a preprocessor and a classifier.
-            """
-            model = Pipeline([
-                ('preprocessor', self.NLTKPreprocessor),
-                ('classifier', classifier)
-            ])
-            return model.fit(X, y)
-
-        # Label encode the targets
-        y_trans = y
 
-        # Prepare the embedding
-        train_embedding_weights, train_word_index, wv_dict = self.prepare_embedding(X)
+    def fit_tokenizer(self, X, cache, chunksize=1000):
+        """
+        Fits a Keras tokenizer on the lemmas of the documents, read from the corpus cache one
+        chunk of documents at a time.
+        """
+        tokenizer = Tokenizer(num_words=self.max_features)
+        for i in range(0, len(X), chunksize):
+            tokenizer.fit_on_texts([' '.join(lemmas) for lemmas in cache.transform(X[i:i + chunksize])])
+        return tokenizer
 
-        # Begin evaluation
-        if verbose: print("Building for evaluation")
-        indices = range(len(y))
 
-        # Keras model definition
+    def build_classifier(self, train_word_index, train_embedding_weights):
+        """
+        Returns the compiled CNN-LSTM classifier initialized with the embedding weights.
+        """
         Input_words = Input(shape=(300,), name='input1')
         x = Embedding(len(train_word_index) + 1, self.embed_dim, weights=[train_embedding_weights],
                       input_length=self.max_sentence_len, trainable=True)(Input_words)
@@ -333,6 +346,48 @@ class train:
         out = Dense(5, activation='softmax')(x)
         classifier = Model(inputs=Input_words, outputs=[out])
         classifier.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
+        return classifier
+
+
+    def save_model(self, classifier, model_name):
+        """
+        Writes the classifier weights (h5) and architecture (json) to the Models folder.
+        """
+        outpath = 'Models/'
+        classifier.save_weights(outpath + model_name + '.h5')
+        with open(outpath + model_name + '.json', 'w') as json_file:
+            json_file.write(classifier.to_json())
+        print("Model written out to {}".format(model_name))
+
+
+    def run(self, X, y, model_name=None, pretrained_weights_path = None, pretrained_model_path = None, verbose=True):
+        """
+        Builds a classifer for the given list of documents and targets
+
+        """
+
+        def build(classifier, X, y, embedding_dict, corpus):
+            """
+            Inner build function that builds a pipeline including a preprocessor and a classifier.
+            """
+            model = Pipeline([
+                ('preprocessor', self.NLTKPreprocessor),
+                ('classifier', classifier)
+            ])
+            return model.fit(X, y)
+
+        # Label encode the targets
+        y_trans = y
+
+        # Prepare the embedding
+        train_embedding_weights, train_word_index, wv_dict = self.prepare_embedding(X)
+
+        # Begin evaluation
+        if verbose: print("Building for evaluation")
+        indices = range(len(y))
+
+        # Keras model definition
+        classifier = self.build_classifier(train_word_index, train_embedding_weights)
         print(classifier.summary())
 
         # Loading pretrained model for transfer learning
@@ -351,13 +406,107 @@ class train:
 
         # Save the model
         if model_name:
-            outpath = 'Models/'
-            classifier.save_weights(outpath + model_name + '.h5')
-            with open(outpath + model_name + '.json', 'w') as json_file:
-                json_file.write(classifier.to_json())
-            print("Model written out to {}".format(model_name))
+            self.save_model(classifier, model_name)
         else:
             print('Please provide model name for saving')
         
         return model
 
+
+    def latest_checkpoint(self, checkpoint_dir, model_name):
+        """
+        Returns the path and epoch of the most recent per-epoch checkpoint of a model, if any.
+        """
+        checkpoints = glob.glob(os.path.join(checkpoint_dir, model_name + '-[0-9]*.h5'))
+        if not checkpoints:
+            return None, 0
+        epochs = [int(os.path.basename(path)[len(model_name) + 1:-3]) for path in checkpoints]
+        return checkpoints[int(np.argmax(epochs))], max(epochs)
+
+
+    def run_streaming(self, X, y, model_name='Personality_traits_NN', batch_size=32, epochs=135,
+                      validation_split=0.1, monitor='val_loss', patience=10, checkpoint_dir='Models/checkpoints/',
+                      resume=True, max_queue_size=10, workers=1, verbose=True):
+        """
+        Trains the CNN-LSTM classifier on padded batches streamed from the documents, with
+        background prefetching. The tokenizer is fitted once and saved next to the model, the
+        full model (with its optimizer state) is checkpointed after every epoch, training resumes
+        from the last checkpoint, and stops early when the monitored validation metric stops
+        improving. The best weights are restored before saving the model.
+        """
+        X = list(X)
+        cache = self.NLTKPreprocessor.corpus_cache()
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        checkpoint_path, initial_epoch = self.latest_checkpoint(checkpoint_dir, model_name) if resume else (None, 0)
+
+        # The sequence ids must match the embedding rows, so a resumed model keeps its tokenizer
+        tokenizer_path = 'Models/' + model_name + '-tokenizer.pickle'
+        if checkpoint_path and os.path.exists(tokenizer_path):
+            with open(tokenizer_path, 'rb') as f:
+                tokenizer = pickle.load(f)
+        else:
+            checkpoint_path, initial_epoch = None, 0
+            tokenizer = self.fit_tokenizer(X, cache)
+            with open(tokenizer_path, 'wb') as f:
+                pickle.dump(tokenizer, f)
+        self.NLTKPreprocessor.tokenizer_path = tokenizer_path
+
+        # Resume from the last checkpoint, with the optimizer state, or build the classifier
+        if checkpoint_path:
+            classifier = load_model(checkpoint_path)
+            if verbose: print("Resuming training from {}".format(checkpoint_path))
+        else:
+            train_embedding_weights = self.embedding_weights(tokenizer.word_index, self.load_google_vec())
+            classifier = self.build_classifier(tokenizer.word_index, train_embedding_weights)
+        if verbose: print(classifier.summary())
+
+        # Hold out a validation set of documents for early stopping, the same one when resuming
+        split_path = os.path.join(checkpoint_dir, model_name + '-split.pickle')
+        state_path = os.path.join(checkpoint_dir, model_name + '-state.pickle')
+        indices, n_val, state = None, int(len(X) * validation_split), None
+        if checkpoint_path and os.path.exists(split_path):
+            with open(split_path, 'rb') as f:
+                split = pickle.load(f)
+            if len(split['indices']) == len(X) and split['n_val'] == n_val:
+                indices = split['indices']
+                if os.path.exists(state_path):
+                    with open(state_path, 'rb') as f:
+                        state = pickle.load(f)
+            else:
+                print("The documents changed since the last checkpoint, holding out a new validation set")
+        if indices is None:
+            indices = np.random.permutation(len(X))
+            with open(split_path, 'wb') as f:
+                pickle.dump({'indices': indices, 'n_val': n_val}, f)
+        y = np.asarray(y)
+        train_batches = self.PaddedBatchSequence(tokenizer, cache, [X[i] for i in indices[n_val:]], y[indices[n_val:]],
+                                                 self.max_sentence_len, batch_size=batch_size)
+        val_batches = self.PaddedBatchSequence(tokenizer, cache, [X[i] for i in indices[:n_val]], y[indices[:n_val]],
+                                               self.max_sentence_len, batch_size=batch_size, shuffle=False)
+
+        # The best value and patience count of the previous run carry over, so that a worse epoch
+        # does not overwrite the best weights
+        best_path = os.path.join(checkpoint_dir, model_name + '-best.h5')
+        best_checkpoint = ModelCheckpoint(best_path, monitor=monitor, save_best_only=True, save_weights_only=True)
+        if state:
+            best_checkpoint.best = state['best']
+        callbacks = [
+            ModelCheckpoint(os.path.join(checkpoint_dir, model_name + '-{epoch:03d}.h5'), save_weights_only=False),
+            best_checkpoint,
+            self.ResumableEarlyStopping(state_path, state, monitor=monitor, patience=patience, verbose=1)
+        ]
+        fit = getattr(classifier, 'fit_generator', classifier.fit)
+        fit(train_batches, epochs=epochs, initial_epoch=initial_epoch, validation_data=val_batches if n_val else None,
+            callbacks=callbacks if n_val else callbacks[:1], max_queue_size=max_queue_size, workers=workers,
+            verbose=2 if verbose else 0)
+
+        # Restore the best weights and save the model
+        if n_val and os.path.exists(best_path):
+            classifier.load_weights(best_path)
+        self.save_model(classifier, model_name)
+        print("Tokenizer written out to {}".format(tokenizer_path))
+
+        return Pipeline([
+            ('preprocessor', self.NLTKPreprocessor),
+            ('classifier', self.MyRNNTransformer(classifier))
+        ])
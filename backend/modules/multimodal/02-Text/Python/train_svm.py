@@ -2,13 +2,13 @@ from gensim.models import KeyedVectors
 from gensim.models import word2vec
 
 import numpy as np
+from scipy import sparse
 import pandas as pd
 import re
 import datetime
 from operator import itemgetter
 from random import randint
 import seaborn as sns
-import wget
 
 import os
 import time
@@ -21,6 +21,11 @@ from nltk import wordpunct_tokenize, WordNetLemmatizer, sent_tokenize, pos_tag
 from nltk.corpus import stopwords as sw, wordnet as wn
 from nltk.stem.snowball import SnowballStemmer
 
+from text_normalization import STOPWORDS, PUNCTUATION, lemmatize, clean_text, iter_lemmas
+from corpus_cache import get_corpus_cache
+from word_vectors import load_word_vectors
+from model_search import sample_configs, split_params, cross_validate_configs, results_table
+
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FeatureUnion, make_pipeline
 from sklearn.preprocessing import LabelEncoder, FunctionTransformer
@@ -33,6 +38,7 @@ from sklearn.feature_extraction.text import TfidfVectorizer, TfidfTransformer, C
 from sklearn.model_selection import GridSearchCV, train_test_split as tts
 from sklearn.manifold import TSNE
 from sklearn.multiclass import OneVsRestClassifier
+from sklearn.model_selection import KFold
 
 import tensorflow as tf
 
@@ -50,7 +56,7 @@ class train_svm:
         self.max_sentence_len = 300
         self.max_features = 300
         self.embed_dim = 300
-        self.NLTKPreprocessor = self.NLTKPreprocessor(corpus)
+        self.NLTKPreprocessor = self.NLTKPreprocessor(corpus, cache=True)
         #self.MyRNNTransformer = self.MyRNNTransformer()
 
 
@@ -59,17 +65,20 @@ class train_svm:
         Transforms input data by using NLTK tokenization, POS tagging, lemmatization and vectorization.
         """
 
-        def __init__(self, corpus, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True):
+        cache = False
+
+        def __init__(self, corpus, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True, cache=False):
             """
             Instantiates the preprocessor.
             """
             self.lower = lower
             self.strip = strip
-            self.stopwords = set(stopwords) if stopwords else set(sw.words('english'))
-            self.punct = set(punct) if punct else set(string.punctuation)
-            self.lemmatizer = WordNetLemmatizer()
+            self.stopwords = frozenset(stopwords) if stopwords else STOPWORDS
+            self.punct = frozenset(punct) if punct else PUNCTUATION
             self.corpus = corpus
             self.max_sentence_len = max_sentence_len
+            # Only the training, testing and visualization scripts persist their documents to the corpus cache
+            self.cache = cache
 
         def fit(self, X, y=None):
             """
@@ -87,6 +96,9 @@ class train_svm:
             """
             Actually runs the preprocessing on each document.
             """
+            # Normalize the documents missing from the corpus cache in a single pass
+            if self.cache:
+                self.corpus_cache().transform(X)
             output = np.array([(self.tokenize(doc)) for doc in X])
             return output
 
@@ -97,46 +109,31 @@ class train_svm:
             Uses the part of speech tags to look up the lemma in WordNet, and returns the lowercase
             version of all the words, removing stopwords and punctuation.
             """
-            lemmatized_tokens = []
-
-            # Clean the text
-            document = re.sub(r"[^A-Za-z0-9^,!.\/'+-=]", " ", document)
-            document = re.sub(r"what's", "what is ", document)
-            document = re.sub(r"\'s", " ", document)
-            document = re.sub(r"\'ve", " have ", document)
-            document = re.sub(r"can't", "cannot ", document)
-            document = re.sub(r"n't", " not ", document)
-            document = re.sub(r"i'm", "i am ", document)
-            document = re.sub(r"\'re", " are ", document)
-            document = re.sub(r"\'d", " would ", document)
-            document = re.sub(r"\'ll", " will ", document)
-            document = re.sub(r"(\d+)(k)", r"\g<1>000", document)
-
-            # Break the document into sentences
-            for sent in sent_tokenize(document):
-
-                # Break the sentence into part of speech tagged tokens
-                for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                    # Apply preprocessing to the token
-                    token = token.lower() if self.lower else token
-                    token = token.strip() if self.strip else token
-                    token = token.strip('_') if self.strip else token
-                    token = token.strip('*') if self.strip else token
-
-                    # If punctuation or stopword, ignore token and continue
-                    if token in self.stopwords or all(char in self.punct for char in token):
-                        continue
-
-                    # Lemmatize the token
-                    lemma = self.lemmatize(token, tag)
-                    lemmatized_tokens.append(lemma)
-
-            doc = ' '.join(lemmatized_tokens)
+            if self.cache:
+                # Reuse the normalized tokens of the document from the corpus cache
+                doc = ' '.join(self.corpus_cache().transform([document])[0])
+            else:
+                # Clean the text, then normalize and lemmatize its tokens
+                doc = ' '.join(iter_lemmas(clean_text(document), self.stopwords, self.punct, self.lower, self.strip))
             tokenized_document = self.vectorize(np.array(doc)[np.newaxis])
             return tokenized_document
 
 
+        def __getstate__(self):
+            """
+            Pickles the preprocessor without the corpus cache option, so that the saved models never
+            write the documents they score to the cache.
+            """
+            state = dict(super().__getstate__())
+            state.pop('cache', None)
+            return state
+
+        def corpus_cache(self):
+            """
+            Returns the preprocessed-corpus cache matching the configuration of the preprocessor.
+            """
+            return get_corpus_cache(True, self.stopwords, self.punct, self.lower, self.strip)
+
         def vectorize(self, doc):
             """
             Returns a vectorized padded version of sequences.
@@ -153,14 +150,7 @@ class train_svm:
             Converts the Penn Treebank tag to a WordNet POS tag, then uses that
             tag to perform WordNet lemmatization.
             """
-            tag = {
-                'N': wn.NOUN,
-                'V': wn.VERB,
-                'R': wn.ADV,
-                'J': wn.ADJ
-            }.get(tag[0], wn.NOUN)
-
-            return self.lemmatizer.lemmatize(token, tag)
+            return lemmatize(token, tag)
 
 
     class MyRNNTransformer(BaseEstimator, TransformerMixin):
@@ -185,10 +175,18 @@ class train_svm:
 
 
     class TfidfEmbeddingVectorizer(object):
-        def __init__(self, word2vec):
+        """
+        Averages the IDF-weighted word vectors of each document. Tokens are mapped to integer
+        ids once, so that all document embeddings are computed as a single sparse (documents x
+        vocabulary) weight matrix times dense (vocabulary x dim) embedding matrix product.
+        """
+        def __init__(self, word2vec, use_idf=True):
             self.word2vec = word2vec
+            self.use_idf = use_idf
             self.word2weight = None
-            self.dim = len(word2vec.values())
+            self.vocabulary = {word: index for index, word in enumerate(word2vec)}
+            self.embeddings = np.array([word2vec[word] for word in self.vocabulary])
+            self.dim = self.embeddings.shape[1] if len(self.vocabulary) else 0
 
         def fit(self, X, y):
             tfidf = TfidfVectorizer(analyzer=lambda x: x)
@@ -200,16 +198,30 @@ class train_svm:
             self.word2weight = defaultdict(
                 lambda: max_idf,
                 [(w, tfidf.idf_[i]) for w, i in tfidf.vocabulary_.items()])
+            self.idf = np.array([self.word2weight[word] for word in self.vocabulary])
+            # Without IDF weighting, documents are embedded as the plain mean of their word vectors
+            if not self.use_idf:
+                self.idf = np.ones(len(self.vocabulary))
 
             return self
 
+        def weight_matrix(self, X):
+            """
+            Returns the sparse (documents x vocabulary) matrix whose rows hold the IDF weight of
+            every in-vocabulary occurrence divided by the number of such occurrences.
+            """
+            lengths = np.fromiter((len(words) for words in X), dtype=np.int64, count=len(X))
+            ids = np.fromiter((self.vocabulary.get(w, -1) for words in X for w in words),
+                              dtype=np.int64, count=lengths.sum())
+            docs = np.repeat(np.arange(len(X)), lengths)
+            known = ids >= 0
+            ids, docs = ids[known], docs[known]
+            counts = np.bincount(docs, minlength=len(X))
+            weights = self.idf[ids] / counts[docs]
+            return sparse.csr_matrix((weights, (docs, ids)), shape=(len(X), len(self.vocabulary)))
+
         def transform(self, X):
-            return np.array([
-                np.mean([self.word2vec[w] * self.word2weight[w]
-                         for w in words if w in self.word2vec] or
-                        [np.zeros(self.dim)], axis=0)
-                for words in X
-            ])
+            return np.asarray(self.weight_matrix(X) @ self.embeddings)
 
 
     def identity(self, arg):
@@ -237,52 +249,21 @@ class train_svm:
         return len(text)
 
     def load_google_vec(self):
-        url = 'https://s3.amazonaws.com/dl4j-distribution/GoogleNews-vectors-negative300.bin.gz'
-        wget.download(url, 'Data/GoogleNews-vectors.bin.gz')
-        return KeyedVectors.load_word2vec_format(
-            'Data/GoogleNews-vectors.bin.gz',
-            binary=True)
+        """
+        Returns the memory-mapped Word2Vec store (converted from the GoogleNews binary on first use).
+        """
+        return load_word_vectors()
 
 
     def lemmatize_token(self, token, tag):
-        tag = {
-            'N': wn.NOUN,
-            'V': wn.VERB,
-            'R': wn.ADV,
-            'J': wn.ADJ
-        }.get(tag[0], wn.NOUN)
-        return WordNetLemmatizer().lemmatize(token, tag)
+        return lemmatize(token, tag)
 
 
     def get_preprocessed_corpus(self, X_corpus):
         """
         Returns a preprocessed version of a full corpus (ie. tokenization and lemmatization using POS taggs)
         """
-        X = ' '.join(X_corpus)
-        lemmatized_tokens = []
-
-        # Break the document into sentences
-        for sent in sent_tokenize(X):
-
-            # Break the sentence into part of speech tagged tokens
-            for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                # Apply preprocessing to the token
-                token = token.lower()
-                token = token.strip()
-                token = token.strip('_')
-                token = token.strip('*')
-
-                # If punctuation or stopword, ignore token and continue
-                if token in set(sw.words('english')) or all(char in set(string.punctuation) for char in token):
-                    continue
-
-                # Lemmatize the token and yield
-                lemma = self.lemmatize_token(token, tag)
-                lemmatized_tokens.append(lemma)
-
-        doc = ' '.join(lemmatized_tokens)
-        return doc
+        return ' '.join(' '.join(tokens) for tokens in get_corpus_cache(clean=False).transform(X_corpus))
 
 
     def prepare_embedding(self, X):
@@ -318,14 +299,7 @@ class train_svm:
 
     def multiclass_accuracy(self,predictions, target):
         "Returns the multiclass accuracy of the classifier's predictions"
-        score = []
-        for j in range(0, 5):
-            count = 0
-            for i in range(len(predictions)):
-                if predictions[i][j] == target[i][j]:
-                    count += 1
-            score.append(count / len(predictions))
-        return score
+        return (np.asarray(predictions) == np.asarray(target)).mean(axis=0).tolist()
 
 
     def run(self,X, y, classifier=SGDClassifier, model_name=None,
@@ -362,3 +336,57 @@ class train_svm:
             print("Model written out to {}".format(model_name))
 
         return model
+
+
+    def search(self, X, y, param_grid, classifier=SGDClassifier, n_iter=None, n_splits=5, n_jobs=-1,
+               random_state=None, results_path=None, verbose=True):
+        """
+        Evaluates a grid (or a random sample of n_iter settings) of classifier parameters, prefixed
+        by 'clf__', and TfidfEmbeddingVectorizer parameters, prefixed by 'vect__', with k-fold
+        cross-validation. The embedding features are computed once per fold and vectorizer
+        setting, then every (config, fold) fit runs in parallel across cores.
+        Returns the results table sorted by mean accuracy.
+        """
+        configs = sample_configs(param_grid, n_iter, random_state)
+        labels = list(y.columns) if hasattr(y, 'columns') else list(range(np.shape(y)[1]))
+
+        # Preprocess the corpus and prepare the embedding once for the whole search
+        train_embedding_weights, train_word_index, wv_dict = self.prepare_embedding(X)
+        # The vectorizer looks up the lemmas of each document in wv_dict, built from the same corpus cache
+        X_prep = np.empty(len(X), dtype=object)
+        for i, lemmas in enumerate(get_corpus_cache(clean=False).transform(X)):
+            X_prep[i] = lemmas
+        y_array = np.asarray(y)
+        folds = list(KFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(X_prep))
+
+        # Compute the embedding features of each fold for every distinct vectorizer setting
+        features = {}
+        for config in configs:
+            vect_params = split_params(config, 'vect__')
+            key = tuple(sorted(vect_params.items()))
+            if key in features:
+                continue
+            if verbose: print("Computing fold features for vectorizer setting {}".format(vect_params or 'default'))
+            features[key] = []
+            for train_index, test_index in folds:
+                vectorizer = self.TfidfEmbeddingVectorizer(wv_dict, **vect_params).fit(X_prep[train_index], y_array[train_index])
+                X_train = vectorizer.transform(X_prep[train_index])
+                # All-zero features mean that no token was found in the word vectors, the scores would be meaningless
+                if not np.any(X_train):
+                    raise ValueError("The embedding features of a fold are all zero: no document token is in the word vectors")
+                features[key].append((X_train, y_array[train_index],
+                                      vectorizer.transform(X_prep[test_index]), y_array[test_index]))
+
+        # Fit and score every configuration on every fold in parallel
+        tasks = [(OneVsRestClassifier(classifier(**split_params(config, 'clf__'))),
+                  features[tuple(sorted(split_params(config, 'vect__').items()))][i])
+                 for config in configs for i in range(len(folds))]
+        if verbose: print("Evaluating {} configurations on {} folds".format(len(configs), len(folds)))
+        scores = cross_validate_configs(tasks, n_jobs=n_jobs, verbose=10 if verbose else 0)
+        scores = [scores[i * len(folds):(i + 1) * len(folds)] for i in range(len(configs))]
+
+        table = results_table(configs, scores, labels)
+        if results_path:
+            table.to_csv(results_path, index=False)
+            print("Search results written out to {}".format(results_path))
+        return table
@@ -1,5 +1,5 @@
-from Text.Python.load_data import *
-from Text.Python.train import *
+from load_data import *
+from train import *
 
 from nltk.corpus import movie_reviews as reviews
 from sklearn.datasets import fetch_20newsgroups
@@ -17,6 +17,9 @@ import matplotlib.pyplot as plt
 import random
 
 import os
+import json
+import hashlib
+import inspect
 import time
 import string
 import pickle
@@ -26,6 +29,11 @@ from nltk import wordpunct_tokenize, WordNetLemmatizer, sent_tokenize, pos_tag
 from nltk.corpus import stopwords as sw, wordnet as wn
 from nltk.stem.snowball import SnowballStemmer
 
+from text_normalization import STOPWORDS, PUNCTUATION, lemmatize, clean_text, iter_lemmas
+from corpus_cache import get_corpus_cache
+from word_vectors import load_word_vectors
+from corpus_statistics import corpus_statistics
+
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.pipeline import Pipeline, FeatureUnion, make_pipeline
 from sklearn.preprocessing import LabelEncoder, FunctionTransformer
@@ -37,8 +45,15 @@ from sklearn.metrics import precision_score, accuracy_score, confusion_matrix, c
 from sklearn.feature_extraction.text import TfidfVectorizer, TfidfTransformer, CountVectorizer
 from sklearn.model_selection import GridSearchCV, train_test_split as tts
 from sklearn.manifold import TSNE
+from sklearn.decomposition import PCA
 from sklearn.multiclass import OneVsRestClassifier
 
+# Optional FFT-accelerated t-SNE, scikit-learn's Barnes-Hut t-SNE is used otherwise
+try:
+    from openTSNE import TSNE as FastTSNE
+except ImportError:
+    FastTSNE = None
+
 import tensorflow as tf
 
 from keras.preprocessing.text import Tokenizer
@@ -70,104 +85,137 @@ class visualize:
             sns.boxplot(x=label, y='text length', data=self.data)
         plt.show()
 
+    def statistics(self):
+        # Corpus statistics of exactly these essays, computed once and reusing the cached lemmas
+        if not hasattr(self, 'stats'):
+            self.stats = corpus_statistics(self.X, self.data[self.labels_list], cache=get_corpus_cache())
+        return self.stats
+
     def most_frequent_words(self):
         # Visualization of the most frequent words
-        complete_corpus = ' '.join(self.X)
-        words = tokenize.word_tokenize(complete_corpus)
-        fdist = FreqDist(words)
+        fdist = FreqDist(self.statistics().word_counts)
         print("List of 100 most frequent words/counts")
         print(fdist.most_common(100))
         fdist.plot(40)
 
     def most_frequent_words_preprocessed(self):
         # Visualization of the most frequent words
-        if not hasattr(self, 'X_preprocess'):
-            preprocessor = train(corpus = self.X).NLTKPreprocessor
-            self.X_preprocess = prep.transform(self.X).tolist()
-        complete_corpus = ' '.join(self.X_preprocess)
-        words = tokenize.word_tokenize(complete_corpus)
-        fdist = FreqDist(words)
+        fdist = FreqDist(self.statistics().lemma_counts)
         print("List of 100 most frequent words/counts")
         print(fdist.most_common(100))
         fdist.plot(40)
 
     def get_corpus_statistics(self):
         # Retrieve some info on the text data
-        numWords = []
-        for text in self.X:
-                counter = len(text.split())
-                numWords.append(counter)  
+        numWords = self.statistics().lengths('words', self.X)
         numFiles = len(numWords)
         print('The total number of essays is', numFiles)
-        print('The total number of words in all essays is', sum(numWords))
-        print('The average number of words in each essay is', sum(numWords)/len(numWords))
+        print('The total number of words in all essays is', numWords.sum())
+        print('The average number of words in each essay is', numWords.mean())
 
     def get_preprocessed_corpus_statistics(self):
         # Retrieve some info on the preprocessed text data
-        if not hasattr(self, 'X_preprocess'):
-            preprocessor = train(corpus = self.X).NLTKPreprocessor
-            self.X_preprocess = prep.transform(self.X).tolist()
-        len_list = [np.count_nonzero(self.X_preprocess[i]) for i in range(len(self.X))]
+        len_list = self.statistics().lengths('lemmas', self.X)
         print('The average number of words in each preprocessed essay is', np.mean(len_list))
         print('The standard deviation of the number of words in each preprocessed essay is', np.std(len_list))
         print('The average number of words in each preprocessed essay plus 2 standard deviations is', np.mean(len_list) + 2 * np.std(len_list))
 
 class tsne:
     
-    def __init__(self, X, max_features = 30000, max_sentence_len = 300, embed_dim = 300,  n_elements = 100):
+    def __init__(self, X, max_features = 30000, max_sentence_len = 300, embed_dim = 300,  n_elements = 100,
+                 cache_dir = 'Data/tsne_cache', pca_components = 50, perplexity = 40, n_iter = 2500, n_jobs = -1):
         self.X = X
         self.max_features =max_features
         self.max_sentence_len = max_sentence_len
         self.embed_dim = embed_dim
         self.n_elements = n_elements
-        self.vectors, self.words, self.dic =  self.prepare_embedding(self.X)
+        self.cache_dir = cache_dir
+        self.pca_components = pca_components
+        self.perplexity = perplexity
+        self.n_iter = n_iter
+        self.n_jobs = n_jobs
+        self.vectors, self.words = self.load_embedding()
+
+    def cache_key(self):
+        """
+        Returns a key identifying the corpus and the embedding settings.
+        """
+        if hasattr(self, 'key'):
+            return self.key
+        sha = hashlib.sha1(json.dumps([self.max_features, self.max_sentence_len, self.embed_dim]).encode('utf-8'))
+        for document in self.X:
+            sha.update(document.encode('utf-8'))
+        self.key = sha.hexdigest()
+        return self.key
+
+    def load_embedding(self):
+        """
+        Returns the embedding matrix and the words of its rows (row 0 is the padding index), from
+        the cache if this corpus was already prepared, otherwise preparing and caching them.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, 'embedding_' + self.cache_key() + '.npz')
+        if os.path.exists(path):
+            cached = np.load(path)
+            return cached['vectors'], cached['words'].tolist()
+        vectors, word_index, _ = self.prepare_embedding(self.X)
+        words = [''] * len(vectors)
+        for word, index in word_index.items():
+            words[index] = word
+        np.savez(path, vectors=vectors.astype(np.float32), words=np.array(words))
+        return vectors.astype(np.float32), words
+
+    def coordinates(self):
+        """
+        Returns the 2-D t-SNE coordinates of the whole vocabulary, computed once after an optional
+        PCA reduction with a multithreaded FFT (openTSNE) or Barnes-Hut (scikit-learn) t-SNE, and
+        saved so that re-plotting never recomputes them.
+        """
+        if hasattr(self, 'coords'):
+            return self.coords
+        # The coordinates depend on the t-SNE implementation and settings as well as on the embedding
+        settings = {'backend': 'opentsne' if FastTSNE is not None else 'sklearn', 'pca_components': self.pca_components,
+                    'perplexity': self.perplexity, 'n_iter': self.n_iter, 'init': 'pca', 'random_state': 23}
+        settings_key = hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+        path = os.path.join(self.cache_dir, 'coords_{}_{}.npy'.format(self.cache_key(), settings_key))
+        if os.path.exists(path):
+            self.coords = np.load(path)
+            return self.coords
+
+        vectors = self.vectors[1:]
+        if self.pca_components and self.pca_components < vectors.shape[1]:
+            vectors = PCA(n_components=self.pca_components, random_state=23).fit_transform(vectors)
+        if FastTSNE is not None:
+            # n_iter counts the 250 early exaggeration iterations, as in scikit-learn
+            embedding = FastTSNE(perplexity=self.perplexity, n_components=2, initialization='pca', n_jobs=self.n_jobs,
+                                 early_exaggeration_iter=250, n_iter=self.n_iter - 250,
+                                 negative_gradient_method='fft', random_state=23).fit(vectors)
+            coords = np.asarray(embedding)
+        else:
+            # The number of iterations was renamed max_iter in recent scikit-learn versions
+            n_iter = {'max_iter' if 'max_iter' in inspect.signature(TSNE).parameters else 'n_iter': self.n_iter}
+            coords = TSNE(perplexity=self.perplexity, n_components=2, init='pca', method='barnes_hut', n_jobs=self.n_jobs,
+                          random_state=23, **n_iter).fit_transform(vectors)
+        # Keep the padding row so that coordinates share the indices of the embedding matrix
+        self.coords = np.vstack([np.zeros((1, 2)), coords])
+        np.save(path, self.coords)
+        return self.coords
 
     def load_google_vec(self):
-        url = 'https://s3.amazonaws.com/dl4j-distribution/GoogleNews-vectors-negative300.bin.gz'
-        #wget.download(url, 'Data/GoogleNews-vectors.bin.gz')
-        return KeyedVectors.load_word2vec_format(
-            'Data/GoogleNews-vectors.bin.gz',
-            binary=True)
+        """
+        Returns the memory-mapped Word2Vec store (converted from the GoogleNews binary on first use).
+        """
+        return load_word_vectors()
 
     def lemmatize_token(self, token, tag):
-        tag = {
-            'N': wn.NOUN,
-            'V': wn.VERB,
-            'R': wn.ADV,
-            'J': wn.ADJ
-        }.get(tag[0], wn.NOUN)
-        return WordNetLemmatizer().lemmatize(token, tag)
+        return lemmatize(token, tag)
 
 
     def get_preprocessed_corpus(self, X_corpus):
         """
         Returns a preprocessed version of a full corpus (ie. tokenization and lemmatization using POS taggs)
         """
-        X = ' '.join(X_corpus)
-        lemmatized_tokens = []
-
-        # Break the document into sentences
-        for sent in sent_tokenize(X):
-
-            # Break the sentence into part of speech tagged tokens
-            for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                # Apply preprocessing to the token
-                token = token.lower()
-                token = token.strip()
-                token = token.strip('_')
-                token = token.strip('*')
-
-                # If punctuation or stopword, ignore token and continue
-                if token in set(sw.words('english')) or all(char in set(string.punctuation) for char in token):
-                    continue
-
-                # Lemmatize the token and yield
-                lemma = self.lemmatize_token(token, tag)
-                lemmatized_tokens.append(lemma)
-
-        doc = ' '.join(lemmatized_tokens)
-        return doc
+        return ' '.join(' '.join(tokens) for tokens in get_corpus_cache(clean=False).transform(X_corpus))
 
 
     def prepare_embedding(self, X):
@@ -200,33 +248,16 @@ class tsne:
         return train_embedding_weights, train_word_index, word_vector_dict
 
 
-    def plot(self):
-        labels = []
-        tokens = []
-
-        l_bound = 0
-        u_bound = len(self.words)
-        step = int(len(self.words)/self.n_elements)
-
-        #for index in range(l_bound,u_bound, step):
-        for index in random.sample(range(l_bound,u_bound), self.n_elements):
-            tokens.append(self.vectors[index])
-            labels.append(self.words[index])
-
-        tsne_model = TSNE(perplexity=40, n_components=2, init='pca', n_iter=2500, random_state=23)
-        new_values = tsne_model.fit_transform(tokens)
-
-        xx = []
-        yy = []
-        for value in new_values:
-            xx.append(value[0])
-            yy.append(value[1])
+    def plot(self, n_elements = None):
+        coords = self.coordinates()
+        n_elements = n_elements if n_elements else self.n_elements
+        indices = random.sample(range(1, len(self.words)), min(n_elements, len(self.words) - 1))
 
         plt.figure(figsize=(16, 16))
-        for i in range(len(xx)):
-            plt.scatter(xx[i],yy[i])
-            plt.annotate(labels[i],
-                         xy=(xx[i], yy[i]),
+        plt.scatter(coords[indices, 0], coords[indices, 1])
+        for index in indices:
+            plt.annotate(self.words[index],
+                         xy=(coords[index, 0], coords[index, 1]),
                          xytext=(5, 2),
                          textcoords='offset points',
                          ha='right',
@@ -239,17 +270,20 @@ class NLTKPreprocessor(BaseEstimator, TransformerMixin):
     Transforms input data by using NLTK tokenization, POS tagging, lemmatization and vectorization.
     """
 
-    def __init__(self, corpus, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True):
+    cache = False
+
+    def __init__(self, corpus, max_sentence_len = 300, stopwords=None, punct=None, lower=True, strip=True, cache=False):
         """
         Instantiates the preprocessor.
         """
         self.lower = lower
         self.strip = strip
-        self.stopwords = set(stopwords) if stopwords else set(sw.words('english'))
-        self.punct = set(punct) if punct else set(string.punctuation)
-        self.lemmatizer = WordNetLemmatizer()
+        self.stopwords = frozenset(stopwords) if stopwords else STOPWORDS
+        self.punct = frozenset(punct) if punct else PUNCTUATION
         self.corpus = corpus
         self.max_sentence_len = max_sentence_len
+        # Only the training, testing and visualization scripts persist their documents to the corpus cache
+        self.cache = cache
 
     def fit(self, X, y=None):
         """
@@ -267,6 +301,9 @@ class NLTKPreprocessor(BaseEstimator, TransformerMixin):
         """
         Actually runs the preprocessing on each document.
         """
+        # Normalize the documents missing from the corpus cache in a single pass
+        if self.cache:
+            self.corpus_cache().transform(X)
         output = np.array([(self.tokenize(doc)) for doc in X])
         return output
 
@@ -277,46 +314,31 @@ class NLTKPreprocessor(BaseEstimator, TransformerMixin):
         Uses the part of speech tags to look up the lemma in WordNet, and returns the lowercase
         version of all the words, removing stopwords and punctuation.
         """
-        lemmatized_tokens = []
-
-        # Clean the text
-        document = re.sub(r"[^A-Za-z0-9^,!.\/'+-=]", " ", document)
-        document = re.sub(r"what's", "what is ", document)
-        document = re.sub(r"\'s", " ", document)
-        document = re.sub(r"\'ve", " have ", document)
-        document = re.sub(r"can't", "cannot ", document)
-        document = re.sub(r"n't", " not ", document)
-        document = re.sub(r"i'm", "i am ", document)
-        document = re.sub(r"\'re", " are ", document)
-        document = re.sub(r"\'d", " would ", document)
-        document = re.sub(r"\'ll", " will ", document)
-        document = re.sub(r"(\d+)(k)", r"\g<1>000", document)
-
-        # Break the document into sentences
-        for sent in sent_tokenize(document):
-
-            # Break the sentence into part of speech tagged tokens
-            for token, tag in pos_tag(wordpunct_tokenize(sent)):
-
-                # Apply preprocessing to the token
-                token = token.lower() if self.lower else token
-                token = token.strip() if self.strip else token
-                token = token.strip('_') if self.strip else token
-                token = token.strip('*') if self.strip else token
-
-                # If punctuation or stopword, ignore token and continue
-                if token in self.stopwords or all(char in self.punct for char in token):
-                    continue
-
-                # Lemmatize the token
-                lemma = self.lemmatize(token, tag)
-                lemmatized_tokens.append(lemma)
-
-        doc = ' '.join(lemmatized_tokens)
+        if self.cache:
+            # Reuse the normalized tokens of the document from the corpus cache
+            doc = ' '.join(self.corpus_cache().transform([document])[0])
+        else:
+            # Clean the text, then normalize and lemmatize its tokens
+            doc = ' '.join(iter_lemmas(clean_text(document), self.stopwords, self.punct, self.lower, self.strip))
         tokenized_document = self.vectorize(np.array(doc)[np.newaxis])
         return tokenized_document
 
 
+    def __getstate__(self):
+        """
+        Pickles the preprocessor without the corpus cache option, so that the saved models never
+        write the documents they score to the cache.
+        """
+        state = dict(super().__getstate__())
+        state.pop('cache', None)
+        return state
+
+    def corpus_cache(self):
+        """
+        Returns the preprocessed-corpus cache matching the configuration of the preprocessor.
+        """
+        return get_corpus_cache(True, self.stopwords, self.punct, self.lower, self.strip)
+
     def vectorize(self, doc):
         """
         Returns a vectorized padded version of sequences.
@@ -333,11 +355,4 @@ class NLTKPreprocessor(BaseEstimator, TransformerMixin):
         Converts the Penn Treebank tag to a WordNet POS tag, then uses that
         tag to perform WordNet lemmatization.
         """
-        tag = {
-            'N': wn.NOUN,
-            'V': wn.VERB,
-            'R': wn.ADV,
-            'J': wn.ADJ
-        }.get(tag[0], wn.NOUN)
-
-        return self.lemmatizer.lemmatize(token, tag)
+        return lemmatize(token, tag)
@@ -0,0 +1,70 @@
+import os
+import sys
+
+from gensim.models import KeyedVectors
+
+GOOGLE_VEC_URL = 'https://s3.amazonaws.com/dl4j-distribution/GoogleNews-vectors-negative300.bin.gz'
+GOOGLE_VEC_PATH = 'Data/GoogleNews-vectors.bin.gz'
+VECTOR_STORE_PATH = 'Data/GoogleNews-vectors.kv'
+
+# Vector stores already opened by this process, keyed by path
+_stores = {}
+
+
+def download_google_vec(source_path=GOOGLE_VEC_PATH):
+    """
+    Downloads the compressed GoogleNews vectors if they are not already on disk.
+    """
+    if not os.path.exists(source_path):
+        import wget
+        wget.download(GOOGLE_VEC_URL, source_path)
+    return source_path
+
+
+def prune_vectors(word2vec, vocabulary):
+    """
+    Returns a new KeyedVectors restricted to the words of the vocabulary found in word2vec.
+    """
+    words = [word for word in dict.fromkeys(vocabulary) if word in word2vec]
+    pruned = KeyedVectors(word2vec.vector_size)
+    add = getattr(pruned, 'add_vectors', None) or pruned.add
+    add(words, word2vec[words])
+    return pruned
+
+
+def build_vector_store(source_path=GOOGLE_VEC_PATH, store_path=VECTOR_STORE_PATH, vocabulary=None):
+    """
+    One-time conversion of the word2vec binary into an uncompressed store whose
+    vector matrix is saved as a separate .npy file, so that it can be memory-mapped.
+    If a vocabulary is given, only the vectors of those words are kept.
+    """
+    word2vec = KeyedVectors.load_word2vec_format(download_google_vec(source_path), binary=True)
+    if vocabulary is not None:
+        word2vec = prune_vectors(word2vec, vocabulary)
+    word2vec.save(store_path, sep_limit=0)
+    _stores.pop(store_path, None)
+    return store_path
+
+
+def load_word_vectors(store_path=VECTOR_STORE_PATH, source_path=GOOGLE_VEC_PATH):
+    """
+    Returns the word vectors memory-mapped read-only from the converted store, building
+    the store first if needed. Pages are shared by every process opening the same store.
+    """
+    if store_path not in _stores:
+        if not os.path.exists(store_path):
+            build_vector_store(source_path, store_path)
+        _stores[store_path] = KeyedVectors.load(store_path, mmap='r')
+    return _stores[store_path]
+
+
+if __name__ == '__main__':
+    # Usage : python word_vectors.py [store_path] [essays.csv to prune the store to its vocabulary]
+    store_path = sys.argv[1] if len(sys.argv) > 1 else VECTOR_STORE_PATH
+    vocabulary = None
+    if len(sys.argv) > 2:
+        from load_data import load_data
+        from text_normalization import preprocess_corpus
+        _, X, _, _ = load_data(sys.argv[2]).run()
+        vocabulary = preprocess_corpus(X).split()
+    print("Vector store written out to {}".format(build_vector_store(store_path=store_path, vocabulary=vocabulary)))
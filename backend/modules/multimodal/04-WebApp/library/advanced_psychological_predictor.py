@@ -5,6 +5,11 @@ from tensorflow.keras.layers import Input, Dense, Concatenate, Dropout, BatchNor
 from tensorflow.keras.optimizers import Adam
 import joblib
 import pickle
+import os
+import threading
+
+# Prebuilt fusion network, saved on first start and loaded as an inference artifact afterwards
+FUSION_MODEL_PATH = 'Models/advanced_fusion_model.h5'
 
 class AdvancedPsychologicalStatePredictor:
     """
@@ -16,12 +21,17 @@ class AdvancedPsychologicalStatePredictor:
     """
     
     def __init__(self):
-        self.face_model = None
-        self.voice_model = None
-        self.text_model = None
-        
-        # Load individual models
-        self.load_models()
+        # Models are loaded on first use, each on its own background thread
+        self.model_loaders = {
+            'face': self.load_face_model,
+            'voice': self.load_voice_model,
+            'text': self.load_text_model,
+            'fusion': self.load_fusion_model
+        }
+        self.models = {}
+        self.model_status = {modality: 'not_loaded' for modality in self.model_loaders}
+        self.model_threads = {}
+        self.model_lock = threading.Lock()
         
         # Psychological states with deception detection
         self.psychological_states = {
@@ -37,34 +47,79 @@ class AdvancedPsychologicalStatePredictor:
             9: 'Confident_Authentic'
         }
         
-        # Build advanced fusion model
-        self.build_advanced_fusion_model()
+        self.deception_types = ['Genuine', 'Acted', 'Deceptive']
+        # Acted states that become genuine when the modalities are consistent
+        self.genuine_states = np.arange(len(self.psychological_states))
+        self.genuine_states[[4, 5, 6]] = [0, 1, 2]
+        
+    def preload(self, *modalities):
+        """Start loading models on background threads, without waiting for them"""
+        threads = []
+        with self.model_lock:
+            for modality in modalities or self.model_loaders:
+                if modality not in self.model_threads:
+                    self.model_status[modality] = 'loading'
+                    thread = threading.Thread(target=self._load_model, args=(modality,), daemon=True)
+                    self.model_threads[modality] = thread
+                    thread.start()
+                threads.append(self.model_threads[modality])
+        return threads
+    
+    def _load_model(self, modality):
+        try:
+            self.models[modality], self.model_status[modality] = self.model_loaders[modality]()
+        except Exception as e:
+            print(f"Could not load {modality} model: {e}")
+            # Forget the failed load, so that the next request for this model retries it
+            with self.model_lock:
+                self.models[modality], self.model_status[modality] = None, 'error'
+                self.model_threads.pop(modality, None)
+    
+    def get_model(self, modality):
+        """Return a model, loading it on first use and waiting for it to be ready"""
+        self.preload(modality)[0].join()
+        return self.models[modality]
+    
+    def get_status(self):
+        """Return the loading status of every model, and whether all of them are loaded"""
+        status = dict(self.model_status)
+        status['ready'] = all(state not in ('not_loaded', 'loading') for state in self.model_status.values())
+        return status
     
     def load_models(self):
-        """Load the individual emotion recognition models"""
+        """Load all the models and wait for them to be ready"""
+        for thread in self.preload():
+            thread.join()
+    
+    def load_face_model(self):
+        """Load the face emotion model, falling back to a working model"""
         try:
-            # Load face emotion model
-            self.face_model = tf.keras.models.load_model('Models/face emotion.h5', compile=False)
+            model = tf.keras.models.load_model('Models/face emotion.h5', compile=False)
             print("✓ Face emotion model loaded")
+            return model, 'ready'
         except Exception as e:
             print(f"Could not load face model: {e}")
-            self.face_model = self.create_working_face_model()
-        
+            return self.create_working_face_model(), 'fallback'
+    
+    def load_voice_model(self):
+        """Load the voice emotion model, falling back to a working model"""
         try:
-            # Load voice emotion model
-            self.voice_model = tf.keras.models.load_model('Models/Emotion_Voice_Detection_Model.h5', compile=False)
+            model = tf.keras.models.load_model('Models/Emotion_Voice_Detection_Model.h5', compile=False)
             print("✓ Voice emotion model loaded")
+            return model, 'ready'
         except Exception as e:
             print(f"Could not load voice model: {e}")
-            self.voice_model = self.create_working_voice_model()
-        
+            return self.create_working_voice_model(), 'fallback'
+    
+    def load_text_model(self):
+        """Load the text emotion pipeline"""
         try:
-            # Load text emotion model
-            self.text_model = joblib.load('Models/emotion_classifier_pipe_lr.pkl')
+            model = joblib.load('Models/emotion_classifier_pipe_lr.pkl')
             print("✓ Text emotion model loaded")
+            return model, 'ready'
         except Exception as e:
             print(f"Could not load text model: {e}")
-            self.text_model = None
+            return None, 'unavailable'
     
     def create_working_face_model(self):
         """Create a working face model for 48x48 grayscale input"""
@@ -145,6 +200,29 @@ class AdvancedPsychologicalStatePredictor:
         
         print("✓ Advanced multimodal fusion model built")
     
+    def load_fusion_model(self, model_path=FUSION_MODEL_PATH):
+        """Load the prebuilt fusion model, building and saving it if it does not exist yet"""
+        try:
+            self.fusion_model = tf.keras.models.load_model(model_path, compile=False)
+            print("✓ Advanced multimodal fusion model loaded")
+        except Exception as e:
+            print(f"Could not load fusion model: {e}")
+            self.build_advanced_fusion_model()
+            try:
+                os.makedirs(os.path.dirname(model_path), exist_ok=True)
+                self.fusion_model.save(model_path, include_optimizer=False)
+                print(f"✓ Advanced multimodal fusion model saved to {model_path}")
+            except Exception as e:
+                print(f"Could not save fusion model: {e}")
+        
+        # Direct graph call with a fixed batch signature, traced once instead of going through predict()
+        spec = tf.TensorSpec(shape=(None, 7), dtype=tf.float32)
+        self.fusion_graph = tf.function(
+            lambda face, voice, text: self.fusion_model([face, voice, text], training=False),
+            input_signature=[spec, spec, spec]
+        )
+        return self.fusion_graph, 'ready'
+    
     def predict_face_emotions(self, face_image):
         """Predict emotions from face image"""
         try:
@@ -154,45 +232,60 @@ class AdvancedPsychologicalStatePredictor:
             face_image = np.expand_dims(face_image, axis=0)
             
             # Predict emotions
-            emotions = self.face_model.predict(face_image, verbose=0)
+            emotions = self.get_model('face').predict(face_image, verbose=0)
             return emotions[0]  # Return probabilities
         except Exception as e:
             print(f"Face prediction error: {e}")
             return np.array([0.14, 0.14, 0.14, 0.14, 0.14, 0.14, 0.16])
     
-    def predict_voice_emotions(self, audio_file):
-        """Predict emotions from voice"""
+    def voice_model_input(self, mel_spect):
+        """Convert a mel power spectrogram to the 128x128 voice model input"""
+        import librosa
+        import cv2
+        
+        mel_spect = librosa.power_to_db(mel_spect, ref=np.max)
+        
+        # Resize to fixed dimensions
+        mel_spect = cv2.resize(mel_spect, (128, 128))
+        
+        # Reshape for model
+        mel_spect = np.expand_dims(mel_spect, axis=-1)
+        return np.expand_dims(mel_spect, axis=0)
+    
+    def predict_voice_spectrogram(self, mel_spect):
+        """Predict emotions from the mel power spectrogram of a recording"""
+        try:
+            emotions = self.get_model('voice').predict(self.voice_model_input(mel_spect), verbose=0)
+            return emotions[0]  # Return probabilities
+        except Exception as e:
+            print(f"Voice prediction error: {e}")
+            return np.array([0.14, 0.14, 0.14, 0.14, 0.14, 0.14, 0.16])
+    
+    def predict_voice_emotions(self, audio):
+        """Predict emotions from voice, given an audio file or a float32 signal sampled at 16 kHz"""
         try:
             import librosa
-            import cv2
             
-            # Load audio
-            y, sr = librosa.load(audio_file, sr=16000)
+            # Load audio, unless it is already in memory
+            if isinstance(audio, np.ndarray):
+                y, sr = audio, 16000
+            else:
+                y, sr = librosa.load(audio, sr=16000)
             
             # Compute mel spectrogram
             mel_spect = np.abs(librosa.stft(y, n_fft=512, hop_length=128)) ** 2
             mel_spect = librosa.feature.melspectrogram(S=mel_spect, sr=sr, n_mels=128)
-            mel_spect = librosa.power_to_db(mel_spect, ref=np.max)
-            
-            # Resize to fixed dimensions
-            mel_spect = cv2.resize(mel_spect, (128, 128))
-            
-            # Reshape for model
-            mel_spect = np.expand_dims(mel_spect, axis=-1)
-            mel_spect = np.expand_dims(mel_spect, axis=0)
-            
-            # Predict emotions
-            emotions = self.voice_model.predict(mel_spect, verbose=0)
-            return emotions[0]  # Return probabilities
         except Exception as e:
             print(f"Voice prediction error: {e}")
             return np.array([0.14, 0.14, 0.14, 0.14, 0.14, 0.14, 0.16])
+        return self.predict_voice_spectrogram(mel_spect)
     
     def predict_text_emotions(self, text):
         """Predict emotions from text"""
         try:
-            if self.text_model is not None:
-                emotions = self.text_model.predict_proba([text])
+            text_model = self.get_model('text')
+            if text_model is not None:
+                emotions = text_model.predict_proba([text])
                 # Ensure we have exactly 7 emotions
                 if emotions.shape[1] > 7:
                     emotions = emotions[:, :7]  # Take first 7
@@ -208,65 +301,105 @@ class AdvancedPsychologicalStatePredictor:
             print(f"Text prediction error: {e}")
             return np.array([0.14, 0.14, 0.14, 0.14, 0.14, 0.14, 0.16])
     
+    def calculate_consistency_scores(self, face_emotions, voice_emotions, text_emotions):
+        """Calculate the consistency score between modalities of a batch of (N, 7) emotion arrays"""
+        # Row-wise Pearson correlation of the 3 modality pairs
+        stacked = np.stack([face_emotions, voice_emotions, text_emotions], axis=1).astype(np.float64)
+        centered = stacked - stacked.mean(axis=2, keepdims=True)
+        norms = np.sqrt((centered ** 2).sum(axis=2))
+        pairs = ([0, 0, 1], [1, 2, 2])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlations = (centered[:, pairs[0]] * centered[:, pairs[1]]).sum(axis=2) / (norms[:, pairs[0]] * norms[:, pairs[1]])
+        
+        # Average correlation as consistency score, constant modalities have no correlation
+        consistency = np.clip(correlations, -1.0, 1.0).mean(axis=1)
+        return np.where(np.isnan(consistency), 0.0, consistency)
+    
     def calculate_consistency_score(self, face_emotions, voice_emotions, text_emotions):
         """Calculate consistency score between modalities"""
         try:
-            # Calculate correlations between modalities
-            face_voice_corr = np.corrcoef(face_emotions, voice_emotions)[0, 1]
-            face_text_corr = np.corrcoef(face_emotions, text_emotions)[0, 1]
-            voice_text_corr = np.corrcoef(voice_emotions, text_emotions)[0, 1]
-            
-            # Average correlation as consistency score
-            consistency = (face_voice_corr + face_text_corr + voice_text_corr) / 3
-            
-            # Handle NaN values
-            if np.isnan(consistency):
-                consistency = 0.0
-                
-            return float(consistency)
+            return float(self.calculate_consistency_scores([face_emotions], [voice_emotions], [text_emotions])[0])
         except:
             return 0.0
     
+    def detect_deception_scores(self, face_emotions, voice_emotions, text_emotions):
+        """Detect deception patterns of a batch of (N, 7) emotion arrays based on emotion inconsistencies"""
+        stacked = np.stack([face_emotions, voice_emotions, text_emotions], axis=1)
+        
+        # Emotion intensities and dominant emotion indices, as (N, 3) face, voice, text columns
+        intensity = stacked.max(axis=2)
+        dominant = stacked.argmax(axis=2)
+        face_intensity, voice_intensity, text_intensity = intensity.T
+        
+        # Check for inconsistencies
+        emotion_mismatch = (dominant != dominant[:, :1]).any(axis=1)
+        
+        # Check for intensity mismatches (acting often shows exaggerated emotions)
+        intensity_variance = intensity.var(axis=1)
+        
+        # Calculate deception score
+        deception_score = (0.4 * emotion_mismatch
+                           + 0.3 * (intensity_variance > 0.1)  # High variance suggests acting
+                           + 0.3 * ((face_intensity > 0.8) & (voice_intensity < 0.3))  # Overacting face, underacting voice
+                           + 0.2 * ((text_intensity > 0.7) & (face_intensity < 0.4)))  # Strong text, weak face
+        return np.minimum(deception_score, 1.0)
+    
     def detect_deception_patterns(self, face_emotions, voice_emotions, text_emotions):
         """Detect deception patterns based on emotion inconsistencies"""
         try:
-            # Calculate emotion intensity differences
-            face_intensity = np.max(face_emotions)
-            voice_intensity = np.max(voice_emotions)
-            text_intensity = np.max(text_emotions)
-            
-            # Calculate dominant emotion indices
-            face_dominant = np.argmax(face_emotions)
-            voice_dominant = np.argmax(voice_emotions)
-            text_dominant = np.argmax(text_emotions)
-            
-            # Check for inconsistencies
-            emotion_mismatch = len(set([face_dominant, voice_dominant, text_dominant])) > 1
-            
-            # Check for intensity mismatches (acting often shows exaggerated emotions)
-            intensity_variance = np.var([face_intensity, voice_intensity, text_intensity])
-            
-            # Calculate deception score
-            deception_score = 0.0
-            
-            if emotion_mismatch:
-                deception_score += 0.4
-            
-            if intensity_variance > 0.1:  # High variance suggests acting
-                deception_score += 0.3
-            
-            # Check for specific deception patterns
-            if face_intensity > 0.8 and voice_intensity < 0.3:  # Overacting face, underacting voice
-                deception_score += 0.3
-            
-            if text_intensity > 0.7 and face_intensity < 0.4:  # Strong text, weak face
-                deception_score += 0.2
-            
-            return min(deception_score, 1.0)
-            
+            return float(self.detect_deception_scores([face_emotions], [voice_emotions], [text_emotions])[0])
         except:
             return 0.0
     
+    def predict_batch(self, face_emotions, voice_emotions, text_emotions):
+        """
+        Advanced psychological state prediction with deception detection for a batch of
+        (face, voice, text) emotion triples, given as sequences of N emotion vectors
+        """
+        # Ensure all inputs are (N, 7) arrays
+        face_emotions = np.array([np.asarray(emotions[:7], dtype=np.float32) for emotions in face_emotions])
+        voice_emotions = np.array([np.asarray(emotions[:7], dtype=np.float32) for emotions in voice_emotions])
+        text_emotions = np.array([np.asarray(emotions[:7], dtype=np.float32) for emotions in text_emotions])
+        n = len(face_emotions)
+        rows = np.arange(n)
+        
+        consistency_scores = self.calculate_consistency_scores(face_emotions, voice_emotions, text_emotions)
+        deception_scores = self.detect_deception_scores(face_emotions, voice_emotions, text_emotions)
+        
+        # Predict psychological state and deception
+        psychological_predictions, deception_predictions = [
+            output.numpy() for output in self.get_model('fusion')(face_emotions, voice_emotions, text_emotions)]
+        
+        state_idx = psychological_predictions.argmax(axis=1)
+        confidence = psychological_predictions[rows, state_idx]
+        deception_idx = deception_predictions.argmax(axis=1)
+        deception_confidence = deception_predictions[rows, deception_idx]
+        
+        # Adjust predictions based on consistency and deception scores
+        # Low consistency + high deception = likely deceptive
+        deceptive = (consistency_scores < 0.3) & (deception_scores > 0.6)
+        # High consistency + low deception = likely genuine
+        genuine = ~deceptive & (consistency_scores > 0.7) & (deception_scores < 0.3)
+        
+        state_idx = np.where(deceptive, 7, np.where(genuine, self.genuine_states[state_idx], state_idx))
+        confidence = np.where(deceptive, np.maximum(confidence, 0.7), confidence)
+        deception_idx = np.where(deceptive, 2, np.where(genuine, 0, deception_idx))
+        deception_confidence = np.where(deceptive | genuine, np.maximum(deception_confidence, 0.8), deception_confidence)
+        
+        return [{
+            'psychological_state': self.psychological_states[state_idx[i]],
+            'confidence': float(confidence[i]),
+            'all_probabilities': psychological_predictions[i].tolist(),
+            'deception_type': self.deception_types[deception_idx[i]],
+            'deception_confidence': float(deception_confidence[i]),
+            'deception_probabilities': deception_predictions[i].tolist(),
+            'face_emotions': face_emotions[i].tolist(),
+            'voice_emotions': voice_emotions[i].tolist(),
+            'text_emotions': text_emotions[i].tolist(),
+            'consistency_score': float(consistency_scores[i]),
+            'deception_score': float(deception_scores[i])
+        } for i in range(n)]
+    
     def predict_advanced_psychological_state(self, face_emotions, voice_emotions, text_emotions):
         """
         Advanced psychological state prediction with deception detection
@@ -277,75 +410,16 @@ class AdvancedPsychologicalStatePredictor:
             voice_emotions = np.array(voice_emotions[:7])  # Take first 7
             text_emotions = np.array(text_emotions[:7])  # Take first 7
             
-            # Calculate consistency score
-            consistency_score = self.calculate_consistency_score(face_emotions, voice_emotions, text_emotions)
+            result = self.predict_batch([face_emotions], [voice_emotions], [text_emotions])[0]
             
-            # Detect deception patterns
-            deception_score = self.detect_deception_patterns(face_emotions, voice_emotions, text_emotions)
+            print(f"Consistency score: {result['consistency_score']:.3f}")
+            print(f"Deception score: {result['deception_score']:.3f}")
+            print(f"Psychological prediction: {result['all_probabilities']}")
+            print(f"Deception prediction: {result['deception_probabilities']}")
+            print(f"Final state: {result['psychological_state']} (Confidence: {result['confidence']:.3f})")
+            print(f"Final deception: {result['deception_type']} (Confidence: {result['deception_confidence']:.3f})")
             
-            # Prepare inputs for fusion model
-            face_input = np.expand_dims(face_emotions, axis=0)
-            voice_input = np.expand_dims(voice_emotions, axis=0)
-            text_input = np.expand_dims(text_emotions, axis=0)
-            
-            print(f"Face input shape: {face_input.shape}")
-            print(f"Voice input shape: {voice_input.shape}")
-            print(f"Text input shape: {text_input.shape}")
-            print(f"Consistency score: {consistency_score:.3f}")
-            print(f"Deception score: {deception_score:.3f}")
-            
-            # Predict psychological state and deception
-            predictions = self.fusion_model.predict(
-                [face_input, voice_input, text_input], 
-                verbose=0
-            )
-            
-            psychological_prediction = predictions[0][0]
-            deception_prediction = predictions[1][0]
-            
-            # Get the predicted psychological state
-            predicted_state_idx = np.argmax(psychological_prediction)
-            predicted_state = self.psychological_states[predicted_state_idx]
-            confidence = psychological_prediction[predicted_state_idx]
-            
-            # Get deception analysis
-            deception_types = ['Genuine', 'Acted', 'Deceptive']
-            deception_idx = np.argmax(deception_prediction)
-            deception_type = deception_types[deception_idx]
-            deception_confidence = deception_prediction[deception_idx]
-            
-            # Adjust prediction based on consistency and deception scores
-            if consistency_score < 0.3 and deception_score > 0.6:
-                # Low consistency + high deception = likely deceptive
-                predicted_state = 'Deceptive_Neutral'
-                confidence = max(confidence, 0.7)
-                deception_type = 'Deceptive'
-                deception_confidence = max(deception_confidence, 0.8)
-            elif consistency_score > 0.7 and deception_score < 0.3:
-                # High consistency + low deception = likely genuine
-                if predicted_state.startswith('Acted'):
-                    predicted_state = predicted_state.replace('Acted_', 'Genuine_')
-                deception_type = 'Genuine'
-                deception_confidence = max(deception_confidence, 0.8)
-            
-            print(f"Psychological prediction: {psychological_prediction}")
-            print(f"Deception prediction: {deception_prediction}")
-            print(f"Final state: {predicted_state} (Confidence: {confidence:.3f})")
-            print(f"Final deception: {deception_type} (Confidence: {deception_confidence:.3f})")
-            
-            return {
-                'psychological_state': predicted_state,
-                'confidence': float(confidence),
-                'all_probabilities': psychological_prediction.tolist(),
-                'deception_type': deception_type,
-                'deception_confidence': float(deception_confidence),
-                'deception_probabilities': deception_prediction.tolist(),
-                'face_emotions': face_emotions.tolist(),
-                'voice_emotions': voice_emotions.tolist(),
-                'text_emotions': text_emotions.tolist(),
-                'consistency_score': consistency_score,
-                'deception_score': deception_score
-            }
+            return result
             
         except Exception as e:
             print(f"Advanced prediction error: {e}")
@@ -0,0 +1,58 @@
+import numpy as np
+
+class MelSpectrogramBuilder:
+    """
+    Incremental mel spectrogram of a live audio stream. STFT columns are computed with
+    overlap-save as audio chunks arrive (only the last n_fft - hop_length samples are
+    carried over between chunks), and their mel power is written into a preallocated
+    rolling buffer. The result matches librosa.stft(center=True) followed by
+    librosa.feature.melspectrogram on the whole recording.
+    """
+
+    def __init__(self, sr=16000, n_fft=512, hop_length=128, n_mels=128, max_seconds=12):
+        import librosa
+
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.window = librosa.filters.get_window('hann', n_fft, fftbins=True).astype(np.float32)
+        self.mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels)
+        self.mel = np.empty((n_mels, 1 + int(max_seconds * sr) // hop_length), dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        """Start a new recording"""
+        # Centered frames : the signal is zero-padded by n_fft // 2 samples on both sides
+        self.pending = np.zeros(self.n_fft // 2, dtype=np.float32)
+        self.n_frames = 0
+        self.n_samples = 0
+
+    def push(self, samples):
+        """Consume a chunk of float32 samples, computing every STFT column it completes"""
+        self.n_samples += len(samples)
+        self._compute(np.concatenate([self.pending, samples]))
+
+    def _compute(self, signal):
+        n_new = 0 if len(signal) < self.n_fft else 1 + (len(signal) - self.n_fft) // self.hop_length
+        if n_new:
+            frames = np.lib.stride_tricks.sliding_window_view(signal, self.n_fft)[::self.hop_length][:n_new]
+            power = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+            if self.n_frames + n_new > self.mel.shape[1]:
+                self.mel = np.concatenate([self.mel, np.empty_like(self.mel)], axis=1)
+            self.mel[:, self.n_frames:self.n_frames + n_new] = self.mel_basis @ power.T
+            self.n_frames += n_new
+        # Keep the samples overlapping the next frames
+        self.pending = signal[n_new * self.hop_length:]
+
+    def finish(self):
+        """Compute the last STFT columns of the recording and return its mel power spectrogram"""
+        self._compute(np.concatenate([self.pending, np.zeros(self.n_fft // 2, dtype=np.float32)]))
+        return self.spectrogram()
+
+    def spectrogram(self):
+        """Return the mel power spectrogram of the columns computed so far"""
+        return self.mel[:, :self.n_frames]
+
+    def duration(self):
+        """Return the duration of the audio consumed so far, in seconds"""
+        return self.n_samples / self.sr
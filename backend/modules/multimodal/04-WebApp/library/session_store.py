@@ -0,0 +1,99 @@
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+from library.video_pipeline import put_dropping
+
+class AssessmentSession:
+    """
+    State of one sequential assessment (video + audio, text, analysis)
+    """
+
+    def __init__(self):
+        self.current_step = 1  # 1: Video+Audio, 2: Text, 3: Analysis
+        self.face_emotions = None
+        self.voice_emotions = None
+        self.provisional_voice_emotions = None  # Scored while the user is still speaking
+        self.text_emotions = None
+        self.psychological_state = None
+        self.start_recording = False
+        self.last_access = time.monotonic()
+        
+        # Event queues of the progress streams opened for this session
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        """Return the results available so far"""
+        return {
+            'current_step': self.current_step,
+            'face_emotions': self.face_emotions,
+            'voice_emotions': self.voice_emotions,
+            'provisional_voice_emotions': self.provisional_voice_emotions,
+            'text_emotions': self.text_emotions,
+            'psychological_state': self.psychological_state
+        }
+
+    def subscribe(self, maxsize=100):
+        """Open a progress stream, returning the queue its events are pushed to"""
+        events = queue.Queue(maxsize=maxsize)
+        with self.lock:
+            self.subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        """Close a progress stream"""
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+    def publish(self, event, data):
+        """Push an event to every progress stream, dropping the oldest events of slow streams"""
+        with self.lock:
+            for events in self.subscribers:
+                put_dropping(events, (event, data))
+
+class SessionStore:
+    """
+    Bounded in-memory store of assessment sessions keyed by session id.
+    Sessions idle for more than ttl seconds are evicted, as are the least
+    recently used ones once max_sessions is reached.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def evict(self, now):
+        """Evict expired sessions, then the least recently used ones above max_sessions"""
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.last_access <= self.ttl and len(self.sessions) <= self.max_sessions:
+                break
+            self.sessions.popitem(last=False)
+
+    def get(self, session_id):
+        """Return the session of session_id, starting a new one if it does not exist or expired"""
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or now - session.last_access > self.ttl:
+                session = self.sessions[session_id] = AssessmentSession()
+            session.last_access = now
+            self.sessions.move_to_end(session_id)
+            self.evict(now)
+            return session
+
+    def reset(self, session_id):
+        """Start a new session for session_id"""
+        with self.lock:
+            session = self.sessions[session_id] = AssessmentSession()
+            self.sessions.move_to_end(session_id)
+            self.evict(session.last_access)
+            return session
+
+    def __len__(self):
+        return len(self.sessions)
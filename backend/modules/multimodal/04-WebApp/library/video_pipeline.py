@@ -0,0 +1,50 @@
+import queue
+import threading
+
+class LatestValue:
+    """
+    Single-slot mailbox holding only the most recent value, for consumers that
+    must never fall behind (e.g. inference on the latest camera frame)
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def set(self, value):
+        """Replace the current value and wake up waiting consumers"""
+        with self.condition:
+            self.value = value
+            self.version += 1
+            self.condition.notify_all()
+
+    def get(self):
+        """Return the current value without waiting"""
+        with self.condition:
+            return self.value
+
+    def wait_newer(self, version, timeout=None):
+        """Wait for a value newer than version, returning (version, value), or (version, None) on timeout"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.version > version, timeout):
+                return version, None
+            return self.version, self.value
+
+def put_dropping(bounded_queue, item):
+    """Put an item in a bounded queue, dropping the oldest item when the queue is full"""
+    while True:
+        try:
+            bounded_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                bounded_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+def start_stage(target, *args):
+    """Run a pipeline stage on a daemon thread"""
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
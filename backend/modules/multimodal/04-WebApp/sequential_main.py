@@ -8,12 +8,17 @@ import pandas as pd
 import time
 import re
 import os
+import json
+import uuid
+import queue
+import threading
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import altair as alt
 
 ### Flask imports
 import requests
-from flask import Flask, render_template, session, request, redirect, flash, Response, jsonify
+from flask import Flask, render_template, session, request, redirect, flash, Response, jsonify, stream_with_context
 
 ### Video imports ###
 import cv2
@@ -30,21 +35,49 @@ import joblib
 
 ### Multimodal imports ###
 from library.advanced_psychological_predictor import AdvancedPsychologicalStatePredictor
+from library.session_store import SessionStore
+from library.video_pipeline import LatestValue, put_dropping, start_stage
+from library.mel_spectrogram import MelSpectrogramBuilder
 
 # Flask config
 app = Flask(__name__)
 app.secret_key = b'(\xee\x00\xd4\xce"\xcf\xe8@\r\xde\xfc\xbdJ\x08W'
 app.config['UPLOAD_FOLDER'] = '/Upload'
 
-# Initialize the advanced psychological predictor
+# Initialize the advanced psychological predictor, its models are loaded on first use
 multimodal_predictor = AdvancedPsychologicalStatePredictor()
 
-# Global variables for session management
-current_step = 1  # 1: Video+Audio, 2: Text, 3: Analysis
-face_emotions = None
-voice_emotions = None
-text_emotions = None
-psychological_state = None
+# Per-user assessment state, keyed by the id stored in the Flask session
+sessions = SessionStore(max_sessions=int(os.environ.get('MAX_SESSIONS', 1000)),
+                        ttl=int(os.environ.get('SESSION_TTL', 3600)))
+
+# Live audio recording settings, recordings are only written to disk if ARCHIVE_AUDIO is set
+AUDIO_RATE = 16000
+AUDIO_CHUNK = 1024
+RECORDING_DURATION = 10  # seconds
+PROVISIONAL_INTERVAL = 2  # seconds of audio between provisional voice predictions
+ARCHIVE_AUDIO = os.environ.get('ARCHIVE_AUDIO', '').lower() in ('1', 'true', 'yes')
+
+# Executors shared across sessions, bounding the number of concurrent model calls. Per-frame face
+# inference has its own workers, so that slow voice, text or analysis jobs never stall the video
+# stream, and file writes run apart from both.
+face_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('FACE_INFERENCE_WORKERS', 1)))
+inference_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('INFERENCE_WORKERS', 2)))
+io_executor = ThreadPoolExecutor(max_workers=1)
+
+def session_id():
+    """Return the assessment session id of the current user, creating it if needed"""
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def get_state():
+    """Return the assessment state of the current user"""
+    return sessions.get(session_id())
+
+def run_inference(function, *args):
+    """Run a per-frame model call on the shared face executor and wait for its result"""
+    return face_executor.submit(function, *args).result()
 
 ################################################################################
 ################################## INDEX #######################################
@@ -53,27 +86,88 @@ psychological_state = None
 # Home page
 @app.route('/', methods=['GET'])
 def index():
-    global current_step, face_emotions, voice_emotions, text_emotions, psychological_state
     # Reset session
-    current_step = 1
-    face_emotions = None
-    voice_emotions = None
-    text_emotions = None
-    psychological_state = None
+    state = sessions.reset(session_id())
     return render_template('sequential_index.html', 
-                          current_step=current_step,
-                          face_emotions=face_emotions,
-                          voice_emotions=voice_emotions,
-                          text_emotions=text_emotions,
-                          psychological_state=psychological_state)
+                          current_step=state.current_step,
+                          face_emotions=state.face_emotions,
+                          voice_emotions=state.voice_emotions,
+                          text_emotions=state.text_emotions,
+                          psychological_state=state.psychological_state)
+
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    Server-Sent Events stream of the assessment progress : a snapshot of the results so far,
+    then recording progress, per-modality results and the final psychological state as they
+    become available
+    """
+    state = get_state()
+    subscription = state.subscribe()
+    
+    def stream():
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(state.snapshot())}\n\n"
+            while True:
+                try:
+                    event, data = subscription.get(timeout=15)
+                except queue.Empty:
+                    # Keep the connection alive through proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            state.unsubscribe(subscription)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/model_status', methods=['GET'])
+def model_status():
+    """Loading status of the modality models"""
+    return jsonify(multimodal_predictor.get_status())
 
 ################################################################################
 ############################### STEP 1: VIDEO + AUDIO #########################
 ################################################################################
 
-def generate_frames():
-    """Generate video frames with real-time face emotion detection and audio recording"""
-    global current_step, face_emotions, voice_emotions, start_recording
+def archive_audio(signal, audio_filename):
+    """Write a recorded float32 signal to a 16-bit WAV file"""
+    wf = wave.open(audio_filename, 'w')
+    wf.setnchannels(1)
+    wf.setsampwidth(2)
+    wf.setframerate(AUDIO_RATE)
+    wf.writeframes((signal * 32768).astype(np.int16).tobytes())
+    wf.close()
+    print(f"🎤 Audio saved: {audio_filename}")
+
+def score_provisional_voice(state, mel_spect):
+    """Score the mel spectrogram of a recording in progress"""
+    state.provisional_voice_emotions = multimodal_predictor.predict_voice_spectrogram(mel_spect).tolist()
+    state.publish('voice_provisional', {'voice_emotions': state.provisional_voice_emotions})
+
+def score_voice(state, mel_spect):
+    """Score the mel spectrogram of a finished recording and store the voice emotions in the session state"""
+    try:
+        voice_emotion_probs = multimodal_predictor.predict_voice_spectrogram(mel_spect)
+        state.voice_emotions = voice_emotion_probs.tolist()
+        print(f"🎤 Voice emotions detected: {state.voice_emotions}")
+    except Exception as e:
+        print(f"Voice processing error: {e}")
+        state.voice_emotions = [0.14] * 7
+    state.publish('voice', {'voice_emotions': state.voice_emotions})
+
+def generate_frames(state):
+    """
+    Generate video frames with real-time face emotion detection and audio recording.
+    Capture, audio recording and face inference run as separate stages on their own threads,
+    so that a slow model call never stalls the camera or the microphone :
+        - capture pushes frames to a bounded queue for encoding, dropping the oldest ones,
+          and publishes the latest frame for inference
+        - inference only ever processes the latest frame and publishes its detections
+        - audio reads the microphone continuously and scores recordings in the background
+        - this generator draws the latest detections on each frame and encodes it as MJPEG
+    """
     
     # Start video capture
     video_capture = cv2.VideoCapture(0)
@@ -95,9 +189,9 @@ def generate_frames():
         # Try to open audio stream
         audio_stream = p.open(format=pyaudio.paInt16,
                              channels=1,
-                             rate=16000,
+                             rate=AUDIO_RATE,
                              input=True,
-                             frames_per_buffer=1024,
+                             frames_per_buffer=AUDIO_CHUNK,
                              input_device_index=None)  # Use default device
         print("✓ Microphone access granted")
     except Exception as e:
@@ -105,292 +199,362 @@ def generate_frames():
         audio_stream = None
         p = None
     
-    # Variables for audio recording
-    audio_frames = []
-    recording_duration = 10  # seconds
-    recording_start_time = None
-    recording_progress = 0
+    # Pipeline state shared by the stages
+    stop = threading.Event()
+    frames = queue.Queue(maxsize=2)  # Frames waiting to be encoded
+    latest_frame = LatestValue()  # Latest frame, for inference
+    detections = LatestValue([])  # Latest face detections, for the overlay
+    recording = {'progress': 0}
     
     # Variables for face emotion detection
-    face_detection_count = 0
+    face_emotion_labels = ['Angry', 'Disgust', 'Fear', 'Happy', 'Neutral', 'Sad', 'Surprise']
     face_emotions_list = []
     
-    while current_step == 1:
-        ret, frame = video_capture.read()
-        if not ret:
-            break
+    def capture():
+        while not stop.is_set():
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            latest_frame.set(frame)
+            put_dropping(frames, frame)
+        # Signal the end of the video to the encoder
+        put_dropping(frames, None)
+    
+    def infer():
+        version = 0
+        while not stop.is_set():
+            version, frame = latest_frame.wait_newer(version, timeout=0.1)
+            if frame is None:
+                continue
             
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-        
-        # Process each detected face
-        for (x, y, w, h) in faces:
-            # Extract face region
-            face = gray[y:y+h, x:x+w]
-            face_resized = cv2.resize(face, (48, 48))
+            # Convert to grayscale for face detection
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             
-            # Draw rectangle around face
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            # Detect faces
+            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
             
-            # Add face emotion prediction
+            # Process each detected face
+            frame_detections = []
+            for (x, y, w, h) in faces:
+                # Extract face region
+                face = gray[y:y+h, x:x+w]
+                face_resized = cv2.resize(face, (48, 48))
+                
+                # Add face emotion prediction
+                try:
+                    face_emotion_probs = run_inference(multimodal_predictor.predict_face_emotions, face_resized)
+                    dominant_emotion_idx = np.argmax(face_emotion_probs)
+                    
+                    # Store face emotions for analysis
+                    face_emotions_list.append(face_emotion_probs)
+                    frame_detections.append((x, y, w, h, face_emotion_labels[dominant_emotion_idx], face_emotion_probs[dominant_emotion_idx]))
+                except Exception as e:
+                    frame_detections.append((x, y, w, h, None, None))
+            detections.set(frame_detections)
+    
+    def record():
+        if audio_stream is None:
+            return
+        
+        # Recorded int16 chunks are converted on arrival into a preallocated float32 buffer,
+        # and their mel spectrogram columns are computed as they arrive
+        audio_buffer = np.empty(AUDIO_RATE * (RECORDING_DURATION + 1), dtype=np.float32)
+        spectrogram = MelSpectrogramBuilder(sr=AUDIO_RATE, max_seconds=RECORDING_DURATION + 1)
+        provisional = None
+        next_provisional = 0
+        recorded = 0
+        recording_start_time = None
+        while not stop.is_set():
+            # Keep reading while idle, so that a recording never starts with stale buffered audio
             try:
-                face_emotion_probs = multimodal_predictor.predict_face_emotions(face_resized)
-                dominant_emotion_idx = np.argmax(face_emotion_probs)
-                emotion_labels = ['Angry', 'Disgust', 'Fear', 'Happy', 'Neutral', 'Sad', 'Surprise']
-                dominant_emotion = emotion_labels[dominant_emotion_idx]
-                confidence = face_emotion_probs[dominant_emotion_idx]
+                audio_data = audio_stream.read(AUDIO_CHUNK, exception_on_overflow=False)
+            except Exception as e:
+                print(f"Audio recording error: {e}")
+                state.start_recording = False
+                recording_start_time = None
+                stop.wait(0.1)
+                continue
+            
+            current_time = time.time()
+            if not state.start_recording:
+                recording_start_time = None
+                recording['progress'] = 0
+                continue
+            
+            if recording_start_time is None:
+                recording_start_time = current_time
+                recorded = 0
+                next_provisional = PROVISIONAL_INTERVAL * AUDIO_RATE
+                spectrogram.reset()
+                state.provisional_voice_emotions = None
+                state.publish('recording', {'recording': True, 'progress': 0})
+                print("🎤 Started recording audio...")
+            
+            samples = np.frombuffer(audio_data, dtype=np.int16)
+            if recorded + len(samples) > len(audio_buffer):
+                audio_buffer = np.concatenate([audio_buffer, np.empty_like(audio_buffer)])
+            np.multiply(samples, 1 / 32768, out=audio_buffer[recorded:recorded + len(samples)], casting='unsafe')
+            spectrogram.push(audio_buffer[recorded:recorded + len(samples)])
+            recorded += len(samples)
+            
+            # Provisional voice prediction every few seconds, skipped while the previous one is running
+            if recorded >= next_provisional:
+                next_provisional += PROVISIONAL_INTERVAL * AUDIO_RATE
+                if provisional is None or provisional.done():
+                    provisional = inference_executor.submit(score_provisional_voice, state, spectrogram.spectrogram().copy())
+            
+            # Calculate recording progress, published every 10%
+            progress = (current_time - recording_start_time) / RECORDING_DURATION
+            if int(progress * 10) > int(recording['progress'] * 10):
+                state.publish('recording', {'recording': True, 'progress': min(progress, 1.0)})
+            recording['progress'] = progress
+            
+            # Check if recording duration is complete
+            if current_time - recording_start_time >= RECORDING_DURATION:
+                # Process voice emotions in the background, without blocking the microphone
+                inference_executor.submit(score_voice, state, spectrogram.finish().copy())
+                if ARCHIVE_AUDIO:
+                    io_executor.submit(archive_audio, audio_buffer[:recorded].copy(), f"tmp/live_audio_{int(current_time)}.wav")
                 
-                # Store face emotions for analysis
-                face_emotions_list.append(face_emotion_probs)
-                face_detection_count += 1
+                # Reset recording
+                state.start_recording = False
+                state.publish('recording', {'recording': False, 'progress': 1.0})
+                recording_start_time = None
+                recorded = 0
+                recording['progress'] = 0
+    
+    stages = [start_stage(capture), start_stage(infer), start_stage(record)]
+    
+    try:
+        while state.current_step == 1:
+            try:
+                frame = frames.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            
+            # Draw the latest face detections
+            for (x, y, w, h, dominant_emotion, confidence) in detections.get():
+                # Draw rectangle around face
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                if dominant_emotion is None:
+                    cv2.putText(frame, "Face: Processing...", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                    continue
                 
                 # Display emotion on frame
                 cv2.putText(frame, f"Face: {dominant_emotion} ({confidence:.2f})", 
                            (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-                cv2.putText(frame, f"Detections: {face_detection_count}", 
+                cv2.putText(frame, f"Detections: {len(face_emotions_list)}", 
                            (x, y+h+20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            except Exception as e:
-                cv2.putText(frame, "Face: Processing...", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        
-        # Audio recording logic
-        current_time = time.time()
-        
-        if start_recording and audio_stream is not None:
-            if recording_start_time is None:
-                recording_start_time = current_time
-                audio_frames = []
-                recording_progress = 0
-                print("🎤 Started recording audio...")
             
-            # Record audio data
-            try:
-                audio_data = audio_stream.read(1024, exception_on_overflow=False)
-                audio_frames.append(audio_data)
+            current_time = time.time()
+            recording_progress = recording['progress']
+            
+            # Display current status
+            if audio_stream is None:
+                status_text = "❌ Microphone Not Available"
+                cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            elif state.start_recording:
+                status_text = f"🎤 Recording... {int(recording_progress * 100)}%"
+                cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
                 
-                # Calculate recording progress
-                recording_progress = (current_time - recording_start_time) / recording_duration
+                # Draw recording progress bar
+                bar_width = 300
+                bar_height = 20
+                bar_x = 10
+                bar_y = 60
                 
-                # Check if recording duration is complete
-                if current_time - recording_start_time >= recording_duration:
-                    # Save recorded audio
-                    audio_filename = f"tmp/live_audio_{int(current_time)}.wav"
-                    wf = wave.open(audio_filename, 'w')
-                    wf.setnchannels(1)
-                    wf.setsampwidth(p.get_sample_size(pyaudio.paInt16))
-                    wf.setframerate(16000)
-                    wf.writeframes(b''.join(audio_frames))
-                    wf.close()
-                    
-                    print(f"🎤 Audio saved: {audio_filename}")
-                    
-                    # Process voice emotions
-                    try:
-                        voice_emotion_probs = multimodal_predictor.predict_voice_emotions(audio_filename)
-                        voice_emotions = voice_emotion_probs.tolist()
-                        print(f"🎤 Voice emotions detected: {voice_emotions}")
-                    except Exception as e:
-                        print(f"Voice processing error: {e}")
-                        voice_emotions = [0.14] * 7
-                    
-                    # Reset recording
-                    start_recording = False
-                    recording_start_time = None
-                    audio_frames = []
-                    recording_progress = 0
-                    
-            except Exception as e:
-                print(f"Audio recording error: {e}")
-                start_recording = False
-        
-        # Display current status
-        if audio_stream is None:
-            status_text = "❌ Microphone Not Available"
-            cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-        elif start_recording:
-            status_text = f"🎤 Recording... {int(recording_progress * 100)}%"
-            cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                # Background bar
+                cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), (50, 50, 50), -1)
+                # Progress bar
+                progress_width = int(bar_width * recording_progress)
+                cv2.rectangle(frame, (bar_x, bar_y), (bar_x + progress_width, bar_y + bar_height), (0, 255, 0), -1)
+                # Border
+                cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), (255, 255, 255), 2)
+                
+                # Recording indicator (pulsing red circle)
+                center_x = frame.shape[1] - 50
+                center_y = 50
+                pulse_size = int(20 + 10 * np.sin(current_time * 10))
+                cv2.circle(frame, (center_x, center_y), pulse_size, (0, 0, 255), -1)
+                cv2.circle(frame, (center_x, center_y), pulse_size, (255, 255, 255), 2)
+                
+                # Provisional voice emotion while the user is still speaking
+                if state.provisional_voice_emotions is not None:
+                    voice_emotion = face_emotion_labels[int(np.argmax(state.provisional_voice_emotions))]
+                    cv2.putText(frame, f"Voice (live): {voice_emotion}", (10, 130), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+            else:
+                status_text = "⏸️ Ready to Record"
+                cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
             
-            # Draw recording progress bar
-            bar_width = 300
-            bar_height = 20
-            bar_x = 10
-            bar_y = 60
+            # Display progress
+            cv2.putText(frame, f"Step 1: Video + Audio Analysis", (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+            cv2.putText(frame, f"Face Detections: {len(face_emotions_list)}", (10, 100), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
             
-            # Background bar
-            cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), (50, 50, 50), -1)
-            # Progress bar
-            progress_width = int(bar_width * recording_progress)
-            cv2.rectangle(frame, (bar_x, bar_y), (bar_x + progress_width, bar_y + bar_height), (0, 255, 0), -1)
-            # Border
-            cv2.rectangle(frame, (bar_x, bar_y), (bar_x + bar_width, bar_y + bar_height), (255, 255, 255), 2)
+            # Encode frame as JPEG
+            ret, buffer = cv2.imencode('.jpg', frame)
+            frame_bytes = buffer.tobytes()
             
-            # Recording indicator (pulsing red circle)
-            center_x = frame.shape[1] - 50
-            center_y = 50
-            pulse_size = int(20 + 10 * np.sin(current_time * 10))
-            cv2.circle(frame, (center_x, center_y), pulse_size, (0, 0, 255), -1)
-            cv2.circle(frame, (center_x, center_y), pulse_size, (255, 255, 255), 2)
-        else:
-            status_text = "⏸️ Ready to Record"
-            cv2.putText(frame, status_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    finally:
+        # Stop the stages, including when the client disconnects
+        stop.set()
+        for stage in stages:
+            stage.join()
         
-        # Display progress
-        cv2.putText(frame, f"Step 1: Video + Audio Analysis", (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
-        cv2.putText(frame, f"Face Detections: {face_detection_count}", (10, 100), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
+        # Clean up
+        video_capture.release()
+        if audio_stream is not None:
+            audio_stream.stop_stream()
+            audio_stream.close()
+        if p is not None:
+            p.terminate()
         
-        # Encode frame as JPEG
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame_bytes = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    
-    # Clean up
-    video_capture.release()
-    if audio_stream is not None:
-        audio_stream.stop_stream()
-        audio_stream.close()
-    if p is not None:
-        p.terminate()
-    
-    # Calculate average face emotions
-    if face_emotions_list:
-        face_emotions = np.mean(face_emotions_list, axis=0).tolist()
-        print(f"🎥 Average face emotions: {face_emotions}")
+        # Calculate average face emotions
+        if face_emotions_list:
+            state.face_emotions = np.mean(face_emotions_list, axis=0).tolist()
+            print(f"🎥 Average face emotions: {state.face_emotions}")
+            state.publish('face', {'face_emotions': state.face_emotions})
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(),
+    # Load the vision and audio models in the background while the camera starts
+    multimodal_predictor.preload('face', 'voice')
+    return Response(generate_frames(get_state()),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/start_recording', methods=['POST'])
 def start_recording():
     """Start audio recording"""
-    global start_recording
-    start_recording = True
+    get_state().start_recording = True
     return jsonify({'status': 'recording_started'})
 
 @app.route('/stop_recording', methods=['POST'])
 def stop_recording():
     """Stop audio recording"""
-    global start_recording
-    start_recording = False
+    get_state().start_recording = False
     return jsonify({'status': 'recording_stopped'})
 
 @app.route('/complete_step1', methods=['POST'])
 def complete_step1():
     """Complete step 1 and move to step 2"""
-    global current_step, face_emotions, voice_emotions
-    current_step = 2
+    state = get_state()
+    state.current_step = 2
     return jsonify({
         'status': 'step1_completed',
-        'current_step': current_step,
-        'face_emotions': face_emotions,
-        'voice_emotions': voice_emotions
+        'current_step': state.current_step,
+        'face_emotions': state.face_emotions,
+        'voice_emotions': state.voice_emotions
     })
 
 ################################################################################
 ############################### STEP 2: TEXT INPUT ############################
 ################################################################################
 
+def score_text(state, text):
+    """Score a text and publish the text emotions"""
+    try:
+        text_emotion_probs = multimodal_predictor.predict_text_emotions(text)
+        state.text_emotions = text_emotion_probs.tolist()
+        print(f"📝 Text emotions detected: {state.text_emotions}")
+        state.publish('text', {'text_emotions': state.text_emotions})
+    except Exception as e:
+        print(f"Text processing error: {e}")
+        state.publish('error', {'message': str(e)})
+
 @app.route('/process_text', methods=['POST'])
 def process_text():
-    """Process text input for emotion analysis"""
-    global text_emotions
+    """Process text input for emotion analysis, the result is pushed to the progress stream"""
+    state = get_state()
     text = request.form.get('text', '')
     
-    try:
-        if text.strip():
-            text_emotion_probs = multimodal_predictor.predict_text_emotions(text)
-            text_emotions = text_emotion_probs.tolist()
-            print(f"📝 Text emotions detected: {text_emotions}")
-        else:
-            text_emotions = [0.14] * 7
-            
+    if not text.strip():
+        state.text_emotions = [0.14] * 7
+        state.publish('text', {'text_emotions': state.text_emotions})
         return jsonify({
             'status': 'text_processed',
-            'text_emotions': text_emotions
-        })
-    except Exception as e:
-        print(f"Text processing error: {e}")
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
+            'text_emotions': state.text_emotions
         })
+    
+    inference_executor.submit(score_text, state, text)
+    return jsonify({'status': 'processing'}), 202
 
 @app.route('/complete_step2', methods=['POST'])
 def complete_step2():
     """Complete step 2 and move to step 3"""
-    global current_step
-    current_step = 3
+    state = get_state()
+    state.current_step = 3
+    # Load the fusion model in the background for the analysis step
+    multimodal_predictor.preload('fusion')
     return jsonify({
         'status': 'step2_completed',
-        'current_step': current_step
+        'current_step': state.current_step
     })
 
 ################################################################################
 ############################### STEP 3: PSYCHOLOGICAL ANALYSIS ###############
 ################################################################################
 
-@app.route('/analyze_psychological_state', methods=['POST'])
-def analyze_psychological_state():
-    """Analyze final psychological state"""
-    global psychological_state, face_emotions, voice_emotions, text_emotions
-    
+def score_psychological_state(state, face_emotions, voice_emotions, text_emotions):
+    """Predict the psychological state and publish it"""
     try:
-        if face_emotions and voice_emotions and text_emotions:
-            print(f"Face emotions: {face_emotions}")
-            print(f"Voice emotions: {voice_emotions}")
-            print(f"Text emotions: {text_emotions}")
-            
-            # Use the advanced method for psychological state prediction
-            result = multimodal_predictor.predict_advanced_psychological_state(
-                face_emotions, voice_emotions, text_emotions
-            )
-            
-            psychological_state = {
-                'state': result['psychological_state'],
-                'confidence': result['confidence'],
-                'all_probabilities': result['all_probabilities'],
-                'deception_type': result['deception_type'],
-                'deception_confidence': result['deception_confidence'],
-                'deception_probabilities': result['deception_probabilities'],
-                'consistency_score': result['consistency_score']
-            }
-            
-            print(f"🧠 Final Psychological State: {result['psychological_state']} (Confidence: {result['confidence']:.3f})")
-            print(f"🎭 Deception Type: {result['deception_type']} (Confidence: {result['deception_confidence']:.3f})")
-            print(f"📊 Consistency Score: {result['consistency_score']:.3f}")
-            
-            return jsonify({
-                'status': 'analysis_complete',
-                'psychological_state': psychological_state,
-                'face_emotions': face_emotions,
-                'voice_emotions': voice_emotions,
-                'text_emotions': text_emotions
-            })
-        else:
-            missing = []
-            if not face_emotions: missing.append("face")
-            if not voice_emotions: missing.append("voice")
-            if not text_emotions: missing.append("text")
-            
-            return jsonify({
-                'status': 'error',
-                'message': f'Missing emotion data: {", ".join(missing)}. Please complete all steps.'
-            })
-            
+        print(f"Face emotions: {face_emotions}")
+        print(f"Voice emotions: {voice_emotions}")
+        print(f"Text emotions: {text_emotions}")
+        
+        # Use the advanced method for psychological state prediction
+        result = multimodal_predictor.predict_advanced_psychological_state(
+            face_emotions, voice_emotions, text_emotions
+        )
+        
+        state.psychological_state = {
+            'state': result['psychological_state'],
+            'confidence': result['confidence'],
+            'all_probabilities': result['all_probabilities'],
+            'deception_type': result['deception_type'],
+            'deception_confidence': result['deception_confidence'],
+            'deception_probabilities': result['deception_probabilities'],
+            'consistency_score': result['consistency_score']
+        }
+        
+        print(f"🧠 Final Psychological State: {result['psychological_state']} (Confidence: {result['confidence']:.3f})")
+        print(f"🎭 Deception Type: {result['deception_type']} (Confidence: {result['deception_confidence']:.3f})")
+        print(f"📊 Consistency Score: {result['consistency_score']:.3f}")
+        
+        state.publish('analysis', {
+            'status': 'analysis_complete',
+            'psychological_state': state.psychological_state,
+            'face_emotions': face_emotions,
+            'voice_emotions': voice_emotions,
+            'text_emotions': text_emotions
+        })
     except Exception as e:
         print(f"Psychological analysis error: {e}")
         import traceback
         traceback.print_exc()
+        state.publish('error', {'message': str(e)})
+
+@app.route('/analyze_psychological_state', methods=['POST'])
+def analyze_psychological_state():
+    """Analyze final psychological state, the result is pushed to the progress stream"""
+    state = get_state()
+    face_emotions, voice_emotions, text_emotions = state.face_emotions, state.voice_emotions, state.text_emotions
+    
+    if not (face_emotions and voice_emotions and text_emotions):
+        missing = []
+        if not face_emotions: missing.append("face")
+        if not voice_emotions: missing.append("voice")
+        if not text_emotions: missing.append("text")
+        
         return jsonify({
             'status': 'error',
-            'message': str(e)
+            'message': f'Missing emotion data: {", ".join(missing)}. Please complete all steps.'
         })
+    
+    inference_executor.submit(score_psychological_state, state, face_emotions, voice_emotions, text_emotions)
+    return jsonify({'status': 'processing'}), 202
 
 ################################################################################
 ################################# MAIN ########################################
@@ -401,9 +565,6 @@ if __name__ == '__main__':
     if not os.path.exists('tmp'):
         os.makedirs('tmp')
     
-    # Global variables for audio recording
-    start_recording = False
-    
     print("🚀 Starting Sequential Multimodal Psychological State Predictor...")
     print("📱 Open your browser and go to: http://127.0.0.1:5000")
     print("📋 Workflow:")
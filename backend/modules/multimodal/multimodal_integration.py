@@ -52,123 +52,159 @@ class MultimodalAnalyzer:
         }
         
         self.final_emotions = ['anger', 'disgust', 'fear', 'joy', 'neutral', 'sadness', 'shame', 'surprise']
+        self.emotion_index = {emotion: i for i, emotion in enumerate(self.final_emotions)}
+        self.neutral_index = self.emotion_index['neutral']
+        
+        # Fusion settings per modality, in the order of self.modalities
+        self.modalities = ['facial', 'voice', 'text']
+        self.base_weights = np.array([0.4, 0.3, 0.3])
+        # Contribution of the primary emotion and of the detail scores to the fused scores
+        self.primary_coef = np.array([0.0, 1.0, 0.0])
+        self.detail_coef = np.array([1.0, 0.5, 1.0])
+        # Facial and text only contribute through their details, voice always contributes its primary emotion
+        self.requires_details = np.array([True, False, True])
+        
+        # Cache of (modality, labels) -> (final emotion index of each label, override candidate mask)
+        self.label_vectors = {}
     
     def normalize_emotion(self, emotion, modality):
         """Normalize emotions from different modalities to common scale"""
         return self.emotion_mapping.get(emotion, 'neutral')
     
-    def weighted_average(self, facial_data, voice_data, text_data):
-        """Calculate weighted average of emotion scores with confidence weighting"""
-        # Dynamic weights based on confidence and availability
-        base_weights = {
-            'facial': 0.4,
-            'voice': 0.3, 
-            'text': 0.3
+    def label_vector(self, modality, labels):
+        """Map the labels of a modality once to an index vector over final_emotions"""
+        key = (modality, labels)
+        if key not in self.label_vectors:
+            if modality == 'voice':
+                # Voice scores are gender-prefixed ('female_angry'), calm is the voice neutral
+                mapped = [self.normalize_emotion(label.split('_')[-1] if '_' in label else label, modality) for label in labels]
+                candidates = ['calm' not in label.lower() for label in labels]
+            else:
+                mapped = [self.normalize_emotion(label, modality) for label in labels]
+                candidates = [label != 'neutral' for label in labels]
+            self.label_vectors[key] = (np.array([self.emotion_index[emotion] for emotion in mapped], dtype=np.int64),
+                                       np.array(candidates, dtype=bool))
+        return self.label_vectors[key]
+    
+    def encode_batch(self, records):
+        """Encode (facial, voice, text) result dicts into the fixed-shape arrays used by fuse_batch"""
+        n, m, e = len(records), len(self.modalities), len(self.final_emotions)
+        batch = {
+            'details': np.zeros((n, m, e)),
+            'has_details': np.zeros((n, m), dtype=bool),
+            'confidence': np.zeros((n, m)),
+            'primary': np.full((n, m), self.neutral_index, dtype=np.int64),
+            'neutral_primary': np.zeros((n, m), dtype=bool),
+            'candidate': np.full((n, m), -1, dtype=np.int64),
+            'candidate_score': np.zeros((n, m)),
+            'agree': np.full((n, m), -1, dtype=np.int64)
         }
+        for i, record in enumerate(records):
+            for j, (modality, data) in enumerate(zip(self.modalities, record)):
+                if not data:
+                    continue
+                emotion = data.get('emotion', 'neutral')
+                batch['confidence'][i, j] = data.get('confidence', 0)
+                batch['primary'][i, j] = self.emotion_index[self.normalize_emotion(emotion, modality)]
+                if modality == 'voice':
+                    batch['neutral_primary'][i, j] = batch['primary'][i, j] == self.neutral_index
+                else:
+                    batch['neutral_primary'][i, j] = emotion == 'neutral'
+                batch['agree'][i, j] = self.emotion_index.get(data.get('emotion'), -1)
+                
+                details = data.get('details')
+                if modality == 'voice':
+                    details = details.get('all_scores') if details and 'all_scores' in details else None
+                elif 'details' not in data:
+                    details = None
+                if details is None:
+                    continue
+                batch['has_details'][i, j] = True
+                indices, candidates = self.label_vector(modality, tuple(details))
+                values = np.fromiter(details.values(), dtype=float, count=len(indices))
+                batch['details'][i, j] = np.bincount(indices, weights=values, minlength=e)
+                # Strongest non-neutral signal, used when the modality is neutral with low confidence
+                if modality != 'voice':
+                    candidates = candidates & (values > 0.15)
+                if candidates.any():
+                    best = np.argmax(np.where(candidates, values, -np.inf))
+                    batch['candidate'][i, j] = indices[best]
+                    batch['candidate_score'][i, j] = values[best]
+        return batch
+    
+    def fuse_batch(self, batch):
+        """Fuse a batch of encoded modality results with fixed-shape NumPy operations"""
+        confidence = batch['confidence']
+        n = len(confidence)
+        rows = np.arange(n)
         
-        # Adjust weights based on confidence and availability
-        available_modalities = []
-        if facial_data and facial_data.get('confidence', 0) > 0.1:
-            available_modalities.append('facial')
-        if voice_data and voice_data.get('confidence', 0) > 0.1:
-            available_modalities.append('voice')
-        if text_data and text_data.get('confidence', 0) > 0.1:
-            available_modalities.append('text')
-        
-        # Normalize weights if some modalities are missing
-        if len(available_modalities) == 0:
-            # All neutral - return default
-            return {emotion: 0.0 if emotion != 'neutral' else 1.0 for emotion in self.final_emotions}
+        # Redistribute the base weights among the available modalities
+        available = confidence > 0.1
+        base = np.where(available, self.base_weights, 0.0)
+        total_weight = base.sum(axis=1, keepdims=True)
+        weights = np.divide(base, total_weight, out=np.zeros_like(base), where=total_weight > 0)
         
-        # Redistribute weights among available modalities
-        total_weight = sum(base_weights[m] for m in available_modalities)
-        weights = {m: base_weights[m] / total_weight for m in available_modalities}
+        # Low-confidence neutral modalities use their strongest non-neutral signal instead
+        modality_override = batch['neutral_primary'] & (confidence < 0.6) & (batch['candidate'] >= 0)
+        modality_confidence = np.where(modality_override, batch['candidate_score'], confidence)
+        primary = np.where(modality_override, batch['candidate'], batch['primary'])
+        contributes = available & (batch['has_details'] | ~self.requires_details)
+        modality_weight = weights * modality_confidence * contributes
         
-        # Initialize emotion scores
-        emotion_scores = {emotion: 0.0 for emotion in self.final_emotions}
+        # Weighted sum of the primary emotion and detail scores of every modality
+        primary_onehot = np.zeros_like(batch['details'])
+        np.put_along_axis(primary_onehot, primary[:, :, None], 1.0, axis=2)
+        contributions = self.primary_coef[:, None] * primary_onehot + self.detail_coef[:, None] * batch['details']
+        scores = np.einsum('nm,nme->ne', modality_weight, contributions)
         
-        # Process facial data with confidence weighting
-        if 'facial' in weights and facial_data and 'details' in facial_data:
-            facial_emotion = facial_data.get('emotion', 'neutral')
-            facial_confidence = facial_data.get('confidence', 0.5)
-            weight = weights['facial'] * facial_confidence
-            
-            # If facial emotion is neutral but confidence is low, look for non-neutral signals in details
-            if facial_emotion == 'neutral' and facial_confidence < 0.6:
-                # Check details for non-neutral emotions with reasonable scores
-                non_neutral_details = {k: v for k, v in facial_data['details'].items() if k != 'neutral' and v > 0.15}
-                if non_neutral_details:
-                    # Use the strongest non-neutral emotion instead
-                    strongest_facial = max(non_neutral_details, key=non_neutral_details.get)
-                    facial_emotion = strongest_facial
-                    facial_confidence = non_neutral_details[strongest_facial]
-                    weight = weights['facial'] * facial_confidence
-                    print(f"Overriding facial neutral with {facial_emotion} (confidence: {facial_confidence:.3f})")
-            
-            for emotion, score in facial_data['details'].items():
-                normalized_emotion = self.normalize_emotion(emotion, 'facial')
-                emotion_scores[normalized_emotion] += score * weight
+        # Normalize scores to sum to 1, falling back to neutral if all scores are zero
+        total_score = scores.sum(axis=1, keepdims=True)
+        neutral = np.zeros(len(self.final_emotions))
+        neutral[self.neutral_index] = 1.0
+        scores = np.where(total_score > 0, scores / np.where(total_score > 0, total_score, 1.0), neutral)
         
-        # Process voice data with confidence weighting
-        if 'voice' in weights and voice_data:
-            voice_emotion = voice_data.get('emotion', 'neutral')
-            normalized_emotion = self.normalize_emotion(voice_emotion, 'voice')
-            confidence = voice_data.get('confidence', 0.0)
-            weight = weights['voice'] * confidence
-            
-            # If voice emotion is neutral/calm but confidence is low, look for non-neutral signals in details
-            if normalized_emotion == 'neutral' and confidence < 0.6 and 'details' in voice_data:
-                # Check all_scores for non-neutral emotions
-                if 'all_scores' in voice_data['details']:
-                    non_neutral_scores = {k: v for k, v in voice_data['details']['all_scores'].items() if 'calm' not in k.lower()}
-                    if non_neutral_scores:
-                        # Use the strongest non-neutral emotion instead
-                        strongest_voice = max(non_neutral_scores, key=non_neutral_scores.get)
-                        voice_emotion = strongest_voice.split('_')[-1] if '_' in strongest_voice else strongest_voice
-                        normalized_emotion = self.normalize_emotion(voice_emotion, 'voice')
-                        confidence = non_neutral_scores[strongest_voice]
-                        weight = weights['voice'] * confidence
-                        print(f"Overriding voice neutral with {normalized_emotion} (confidence: {confidence:.3f})")
-            
-            emotion_scores[normalized_emotion] += weight
-            # Also add from details if available
-            if 'details' in voice_data and 'all_scores' in voice_data['details']:
-                for emotion, score in voice_data['details']['all_scores'].items():
-                    # Map voice emotion labels to common set
-                    mapped_emotion = self.normalize_emotion(emotion.split('_')[-1] if '_' in emotion else emotion, 'voice')
-                    emotion_scores[mapped_emotion] += score * weight * 0.5
+        final_emotion = scores.argmax(axis=1)
+        final_confidence = scores[rows, final_emotion]
         
-        # Process text data with confidence weighting
-        if 'text' in weights and text_data and 'details' in text_data:
-            text_emotion = text_data.get('emotion', 'neutral')
-            text_confidence = text_data.get('confidence', 0.5)
-            weight = weights['text'] * text_confidence
-            
-            # If text emotion is neutral but confidence is low, look for non-neutral signals in details
-            if text_emotion == 'neutral' and text_confidence < 0.6:
-                # Check details for non-neutral emotions with reasonable scores
-                non_neutral_details = {k: v for k, v in text_data['details'].items() if k != 'neutral' and v > 0.15}
-                if non_neutral_details:
-                    # Use the strongest non-neutral emotion instead
-                    strongest_text = max(non_neutral_details, key=non_neutral_details.get)
-                    text_emotion = strongest_text
-                    text_confidence = non_neutral_details[strongest_text]
-                    weight = weights['text'] * text_confidence
-                    print(f"Overriding text neutral with {text_emotion} (confidence: {text_confidence:.3f})")
-            
-            for emotion, score in text_data['details'].items():
-                normalized_emotion = self.normalize_emotion(emotion, 'text')
-                emotion_scores[normalized_emotion] += score * weight
+        # Prefer the strongest non-neutral emotion when neutral wins by a small margin
+        non_neutral = scores.copy()
+        non_neutral[:, self.neutral_index] = -np.inf
+        strongest = non_neutral.argmax(axis=1)
+        strongest_score = non_neutral[rows, strongest]
+        neutral_override = (final_emotion == self.neutral_index) & (
+            ((final_confidence < 0.6) & (strongest_score > 0.2)) |
+            ((final_confidence < 0.5) & (strongest_score > 0.15)) |
+            ((final_confidence >= 0.5) & (strongest_score > final_confidence - 0.25) & (strongest_score > 0.15)))
+        final_emotion = np.where(neutral_override, strongest, final_emotion)
+        final_confidence = np.where(neutral_override, strongest_score, final_confidence)
         
-        # Normalize scores to sum to 1
-        total_score = sum(emotion_scores.values())
-        if total_score > 0:
-            emotion_scores = {k: v / total_score for k, v in emotion_scores.items()}
-        else:
-            # Fallback to neutral if all scores are zero
-            emotion_scores['neutral'] = 1.0
+        # Boost confidence if at least 2 modalities agree on a non-neutral emotion
+        agreement = (batch['agree'] == final_emotion[:, None]).sum(axis=1)
+        boosted = (final_emotion != self.neutral_index) & (agreement >= 2)
+        final_confidence = np.where(boosted, np.minimum(final_confidence * 1.2, 0.95), final_confidence)
         
-        return emotion_scores
+        return {
+            'scores': scores,
+            'emotion': final_emotion,
+            'confidence': final_confidence,
+            'neutral_override': neutral_override,
+            'agreement': agreement,
+            'boosted': boosted
+        }
+    
+    def fuse_records(self, records):
+        """Fuse a list of (facial, voice, text) results, e.g. a patient's whole history, in one call"""
+        fused = self.fuse_batch(self.encode_batch(records))
+        return [{
+            'emotion': self.final_emotions[fused['emotion'][i]],
+            'confidence': float(fused['confidence'][i]),
+            'combined_scores': dict(zip(self.final_emotions, fused['scores'][i].tolist()))
+        } for i in range(len(records))]
+    
+    def weighted_average(self, facial_data, voice_data, text_data):
+        """Calculate weighted average of emotion scores with confidence weighting"""
+        fused = self.fuse_batch(self.encode_batch([(facial_data, voice_data, text_data)]))
+        return dict(zip(self.final_emotions, fused['scores'][0].tolist()))
     
     def analyze_multimodal(self, facial_data, voice_data, text_data):
         """Analyze combined emotional state from all modalities"""
@@ -184,58 +220,16 @@ class MultimodalAnalyzer:
             # Log input data for debugging
             print(f"Multimodal analysis input - Facial: {facial_data.get('emotion', 'N/A')}, Voice: {voice_data.get('emotion', 'N/A')}, Text: {text_data.get('emotion', 'N/A')}")
             
-            # Calculate weighted emotion scores
-            emotion_scores = self.weighted_average(facial_data, voice_data, text_data)
+            # Fuse the modalities
+            fused = self.fuse_batch(self.encode_batch([(facial_data, voice_data, text_data)]))
+            emotion_scores = dict(zip(self.final_emotions, fused['scores'][0].tolist()))
+            final_emotion = self.final_emotions[fused['emotion'][0]]
+            final_confidence = float(fused['confidence'][0])
             
-            # Find the emotion with highest score
-            final_emotion = max(emotion_scores, key=emotion_scores.get)
-            final_confidence = emotion_scores[final_emotion]
-            
-            # Very aggressive bias reduction: prefer non-neutral emotions even if neutral is slightly higher
-            # This helps overcome the tendency of individual models to predict neutral
-            neutral_score = emotion_scores.get('neutral', 0)
-            non_neutral_scores = {k: v for k, v in emotion_scores.items() if k != 'neutral'}
-            
-            if non_neutral_scores:
-                strongest_non_neutral = max(non_neutral_scores, key=non_neutral_scores.get)
-                strongest_non_neutral_score = non_neutral_scores[strongest_non_neutral]
-                
-                # More aggressive override conditions:
-                # 1. If neutral confidence < 0.6 and a non-neutral emotion has > 0.2, prefer non-neutral
-                # 2. If neutral confidence < 0.5, prefer any non-neutral emotion with > 0.15 confidence
-                # 3. If a non-neutral emotion is within 0.25 (increased from 0.15) of neutral and has at least 0.15 confidence, prefer it
-                should_override = False
-                if final_emotion == 'neutral':
-                    if final_confidence < 0.6 and strongest_non_neutral_score > 0.2:
-                        # Neutral is weak and another emotion is reasonably strong
-                        should_override = True
-                    elif final_confidence < 0.5:
-                        # Neutral is very weak, prefer any reasonable non-neutral
-                        if strongest_non_neutral_score > 0.15:
-                            should_override = True
-                    elif strongest_non_neutral_score > (neutral_score - 0.25) and strongest_non_neutral_score > 0.15:
-                        # Non-neutral is close to neutral (within 0.25) and has minimum confidence
-                        should_override = True
-                
-                if should_override:
-                    final_emotion = strongest_non_neutral
-                    final_confidence = strongest_non_neutral_score
-                    print(f"Overriding neutral with {final_emotion} (confidence: {final_confidence:.3f} vs neutral: {neutral_score:.3f})")
-            
-            # Additional boost: if multiple modalities agree on a non-neutral emotion, increase confidence
-            if final_emotion != 'neutral':
-                agreement_count = 0
-                if facial_data and facial_data.get('emotion') == final_emotion:
-                    agreement_count += 1
-                if voice_data and voice_data.get('emotion') == final_emotion:
-                    agreement_count += 1
-                if text_data and text_data.get('emotion') == final_emotion:
-                    agreement_count += 1
-                
-                # Boost confidence if at least 2 modalities agree
-                if agreement_count >= 2:
-                    final_confidence = min(final_confidence * 1.2, 0.95)
-                    print(f"Boosted confidence due to modality agreement ({agreement_count} modalities agree on {final_emotion})")
+            if fused['neutral_override'][0]:
+                print(f"Overriding neutral with {final_emotion} (confidence: {emotion_scores[final_emotion]:.3f} vs neutral: {emotion_scores['neutral']:.3f})")
+            if fused['boosted'][0]:
+                print(f"Boosted confidence due to modality agreement ({fused['agreement'][0]} modalities agree on {final_emotion})")
             
             print(f"Final multimodal emotion: {final_emotion} with confidence: {final_confidence:.3f}")
             print(f"All emotion scores: {emotion_scores}")
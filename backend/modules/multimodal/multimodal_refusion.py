@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Bulk Multimodal Re-fusion Job
+Re-applies the MultimodalAnalyzer fusion to stored facial, voice and text results,
+e.g. after a change of the fusion weights, streaming them in chunks across cores
+"""
+
+import os
+import sys
+import json
+import argparse
+from itertools import islice
+from multiprocessing import Pool
+
+from multimodal_integration import MultimodalAnalyzer
+
+# emotion_type of the multimodal analyses saved by the app
+MULTIMODAL_TYPE = 'combined'
+
+def fuse_chunk(chunk):
+    """Fuse a chunk of (id, facial, voice, text) rows, returning (id, emotion, confidence, scores) rows"""
+    analyzer = MultimodalAnalyzer()
+    results = analyzer.fuse_records([(facial or {}, voice or {}, text or {}) for _, facial, voice, text in chunk])
+    return [(row[0], result['emotion'], result['confidence'], result['combined_scores'])
+            for row, result in zip(chunk, results)]
+
+def iter_chunks(rows, chunk_size):
+    """Group an iterable of rows into lists of chunk_size rows"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def refuse(rows, chunk_size=5000, n_jobs=None):
+    """Stream rows through the fusion across n_jobs processes, yielding fused chunks in order"""
+    n_jobs = n_jobs or os.cpu_count()
+    chunks = iter_chunks(rows, chunk_size)
+    with Pool(n_jobs) as pool:
+        # Pool.imap reads its whole input up front, so feed it a bounded window of chunks at a time
+        while True:
+            window = list(islice(chunks, n_jobs * 2))
+            if not window:
+                return
+            yield from pool.imap(fuse_chunk, window)
+
+def read_jsonl(path):
+    """Read stored results from a JSONL export with one {"id", "facial", "voice", "text"} object per line"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record.get('id'), record.get('facial'), record.get('voice'), record.get('text')
+
+def write_jsonl(path, fused_chunks):
+    """Write fused results to a JSONL file, one chunk at a time"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in fused_chunks:
+            f.write(''.join(json.dumps({"id": row_id, "emotion": emotion, "confidence": confidence, "combined_scores": scores}) + '\n'
+                            for row_id, emotion, confidence, scores in chunk))
+            count += len(chunk)
+    return count
+
+def connect_database():
+    """Connect to the PostgreSQL database with the same settings as the backend"""
+    try:
+        import psycopg2
+    except ImportError:
+        raise ImportError("psycopg2 is required to re-fuse results stored in the database (pip install psycopg2-binary)")
+    return psycopg2.connect(
+        user=os.environ.get('DB_USER', 'openpg'),
+        host=os.environ.get('DB_HOST', 'localhost'),
+        dbname=os.environ.get('DB_NAME', 'psychemirror'),
+        password=os.environ.get('DB_PASSWORD', 'openpgpwd'),
+        port=os.environ.get('DB_PORT', 5432)
+    )
+
+def read_database(connection, emotion_type=MULTIMODAL_TYPE, complete_only=False, fetch_size=10000):
+    """
+    Stream stored results of the emotions table through a server-side cursor. Rows missing some
+    modalities are fused from the available ones, unless complete_only is set.
+    """
+    if complete_only:
+        query = """SELECT id, facial_data, voice_data, text_data FROM emotions
+                   WHERE facial_data IS NOT NULL AND voice_data IS NOT NULL AND text_data IS NOT NULL"""
+    else:
+        query = """SELECT id, facial_data, voice_data, text_data FROM emotions
+                   WHERE (facial_data IS NOT NULL OR voice_data IS NOT NULL OR text_data IS NOT NULL)"""
+    params = []
+    if emotion_type:
+        query += " AND emotion_type = %s"
+        params.append(emotion_type)
+    with connection.cursor(name='multimodal_refusion') as cursor:
+        cursor.itersize = fetch_size
+        cursor.execute(query + " ORDER BY id", params)
+        yield from cursor
+
+def write_database(connection, fused_chunks):
+    """
+    Bulk insert fused results into a staging table, then update the emotions table in one statement.
+    The combined score of a row is the fused score of its emotion.
+    """
+    from psycopg2.extras import execute_values
+
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute("""CREATE TEMP TABLE refused_emotions (
+                            id INTEGER PRIMARY KEY,
+                            emotion_value VARCHAR(50) NOT NULL,
+                            confidence DECIMAL(5,2),
+                            combined_score DECIMAL(5,2)
+                          ) ON COMMIT DROP""")
+        for chunk in fused_chunks:
+            execute_values(cursor, "INSERT INTO refused_emotions (id, emotion_value, confidence, combined_score) VALUES %s",
+                           [(row_id, emotion, confidence, scores[emotion]) for row_id, emotion, confidence, scores in chunk],
+                           page_size=len(chunk))
+            count += len(chunk)
+        cursor.execute("""UPDATE emotions SET emotion_value = r.emotion_value, confidence = r.confidence,
+                                              combined_score = r.combined_score
+                          FROM refused_emotions r WHERE emotions.id = r.id""")
+    connection.commit()
+    return count
+
+def main():
+    """Main function for command line usage"""
+    parser = argparse.ArgumentParser(description="Re-fuse stored multimodal results with the current fusion weights")
+    parser.add_argument('--input', help="JSONL export to read from (default: the emotions table)")
+    parser.add_argument('--output', help="JSONL file to write to (default: update the emotions table)")
+    parser.add_argument('--emotion-type', default=MULTIMODAL_TYPE,
+                        help="Only re-fuse database rows of this emotion_type (default: %(default)s)")
+    parser.add_argument('--all-types', action='store_true', help="Re-fuse database rows of every emotion_type")
+    parser.add_argument('--complete-only', action='store_true',
+                        help="Only re-fuse database rows with facial, voice and text results")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--jobs', type=int, default=None, help="Number of worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    connection = None
+    if not args.input or not args.output:
+        connection = connect_database()
+
+    try:
+        # Database reads and writes share one transaction, committed once every chunk is written
+        if args.input:
+            rows = read_jsonl(args.input)
+        else:
+            rows = read_database(connection, None if args.all_types else args.emotion_type, args.complete_only)
+
+        fused_chunks = refuse(rows, args.chunk_size, args.jobs)
+        if args.output:
+            count = write_jsonl(args.output, fused_chunks)
+        else:
+            count = write_database(connection, fused_chunks)
+        print(json.dumps({"refused": count}))
+    finally:
+        if connection is not None:
+            connection.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,47 +1,269 @@
+import queue
+import atexit
+import logging
 import sqlite3
+import threading
+import time
 import pytz
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 # Load Database Packages
-conn = sqlite3.connect('./data/data.db', check_same_thread=False)
-c = conn.cursor()
+DB_PATH = './data/data.db'
+BATCH_SIZE = 500      # Pending inserts written at once
+FLUSH_INTERVAL = 1.0  # Seconds before pending inserts are written anyway
+PAGE_SIZE = 100       # Default rows per page of the queries
 
 IST = pytz.timezone('Asia/Kolkata')  # Indian Standard Time
 
+logger = logging.getLogger(__name__)
+
+def connect(check_same_thread=True):
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=check_same_thread)
+    # WAL lets the readers run while the writer commits
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+# One read connection per thread
+local = threading.local()
+
+def get_connection():
+    if not hasattr(local, 'conn'):
+        local.conn = connect()
+    return local.conn
+
+@lru_cache(maxsize=1024)
+def format_time(seconds):
+    """IST timestamp of a second, cached as inserts come in bursts within the same seconds"""
+    return datetime.fromtimestamp(seconds, IST).strftime("%Y-%m-%d %H:%M:%S")
+
+def to_timestamp(timeOfvisit):
+    """Stored timestamp of a visit time, now if None"""
+    if timeOfvisit is None:
+        return format_time(int(time.time()))
+    return format_time(int(timeOfvisit.timestamp()))
+
+class TrackingWriter:
+    """
+    Dedicated writer thread: inserts are queued by the callers and written with executemany,
+    in one transaction per batch of batch_size rows or every flush_interval seconds
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        # Functions(conn, rows) run in the transaction of the rows inserted by a statement
+        self.after_insert = {}
+        # Only used by the writer thread
+        self.conn = connect(check_same_thread=False)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def insert(self, statement, params):
+        self.queue.put((statement, params))
+
+    def flush(self):
+        """Wait until the inserts queued so far are written"""
+        done = threading.Event()
+        self.queue.put((None, done))
+        done.wait()
+
+    def run(self):
+        pending = {}
+        count = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done = None
+            try:
+                statement, params = self.queue.get(timeout=timeout)
+                if statement is None:
+                    done = params
+                else:
+                    pending.setdefault(statement, []).append(params)
+                    count += 1
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    if count < self.batch_size:
+                        continue
+            except queue.Empty:
+                pass
+            # The thread must survive any error, or every later flush would wait forever
+            try:
+                if pending:
+                    self.write(pending)
+            except Exception:
+                logger.exception("Tracking writer failed")
+            finally:
+                if pending:
+                    pending = {}
+                    count = 0
+                    deadline = None
+                if done is not None:
+                    done.set()
+
+    def write_rows(self, pending, hooks=True):
+        """Write {statement: rows} in one transaction, with the after_insert functions unless hooks is False"""
+        with self.conn:
+            for statement, rows in pending.items():
+                self.conn.executemany(statement, rows)
+                if hooks and statement in self.after_insert:
+                    self.after_insert[statement](self.conn, rows)
+
+    def write(self, pending):
+        """Write the pending rows, one at a time if the batch fails so that a bad row does not lose the others"""
+        try:
+            self.write_rows(pending)
+            return
+        except Exception:
+            logger.exception("Could not write a batch of %d tracking rows, retrying them one by one",
+                             sum(map(len, pending.values())))
+        for statement, rows in pending.items():
+            for row in rows:
+                try:
+                    self.write_rows({statement: [row]})
+                except Exception:
+                    # Keep the row even if its rollups cannot be updated
+                    try:
+                        self.write_rows({statement: [row]}, hooks=False)
+                        logger.exception("Tracking row written without its rollups: %r", row)
+                    except Exception:
+                        logger.exception("Could not write tracking row %r", row)
+
+writer = TrackingWriter()
+atexit.register(writer.flush)
+
+PREDICTION_INSERT = 'INSERT INTO emotionclfTable(rawtext, prediction, probability, timeOfvisit) VALUES (?, ?, ?, ?)'
+
+# Rollup tables of the predictions, and the length of their timeOfvisit prefix
+ROLLUPS = {'emotionHourlyTable': 13, 'emotionDailyTable': 10}
+
+def as_number(value):
+    """Probability added to the rollups, None if missing so that it is left out of the mean like avg() does"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def rollup_predictions(conn, rows):
+    """Add a batch of predictions to the counts, probability sums and probability counts of their hour and day"""
+    for table, length in ROLLUPS.items():
+        totals = {}
+        for _, prediction, probability, timeOfvisit in rows:
+            total = totals.setdefault((timeOfvisit[:length], prediction), [0, 0.0, 0])
+            total[0] += 1
+            number = as_number(probability)
+            if number is not None:
+                total[1] += number
+                total[2] += 1
+        conn.executemany(f'INSERT INTO {table}(period, prediction, count, probabilitySum, probabilityCount) VALUES (?, ?, ?, ?, ?) '
+                         'ON CONFLICT(period, prediction) DO UPDATE SET count = count + excluded.count, '
+                         'probabilitySum = probabilitySum + excluded.probabilitySum, '
+                         'probabilityCount = probabilityCount + excluded.probabilityCount',
+                         [(period, prediction, *total) for (period, prediction), total in totals.items()])
+
+writer.after_insert[PREDICTION_INSERT] = rollup_predictions
+
+def query(statement, params=()):
+    """Run a read query on the thread's connection, after the pending inserts are written"""
+    writer.flush()
+    return get_connection().execute(statement, params).fetchall()
+
+def time_range(start=None, end=None, after=None):
+    """WHERE clause and parameters of a time range (start included, end excluded) and rowid page"""
+    clauses = []
+    params = []
+    if start is not None:
+        clauses.append('timeOfvisit >= ?')
+        params.append(to_timestamp(start))
+    if end is not None:
+        clauses.append('timeOfvisit < ?')
+        params.append(to_timestamp(end))
+    if after is not None:
+        clauses.append('rowid > ?')
+        params.append(after)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
 # Function to create page visited table
 def create_page_visited_table():
-    c.execute('CREATE TABLE IF NOT EXISTS pageTrackTable(pagename TEXT, timeOfvisit TIMESTAMP)')
+    conn = get_connection()
+    with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS pageTrackTable(pagename TEXT, timeOfvisit TIMESTAMP)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_pageTrack_time ON pageTrackTable(timeOfvisit)')
 
 # Function to add page visited details
 def add_page_visited_details(pagename, timeOfvisit=None):
-    if timeOfvisit is None:
-        timeOfvisit = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
-    else:
-        timeOfvisit = timeOfvisit.astimezone(IST).strftime("%Y-%m-%d %H:%M:%S")
-    c.execute('INSERT INTO pageTrackTable(pagename, timeOfvisit) VALUES (?, ?)', (pagename, timeOfvisit))
-    conn.commit()
+    writer.insert('INSERT INTO pageTrackTable(pagename, timeOfvisit) VALUES (?, ?)', (pagename, to_timestamp(timeOfvisit)))
+
+# Function to view a page of page visited details, as (id, pagename, timeOfvisit) rows
+def view_page_visited_details(start=None, end=None, after=None, limit=PAGE_SIZE):
+    where, params = time_range(start, end, after)
+    return query(f'SELECT rowid, pagename, timeOfvisit FROM pageTrackTable{where} ORDER BY rowid LIMIT ?', params + [limit])
 
 # Function to view all page visited details
 def view_all_page_visited_details():
-    c.execute('SELECT * FROM pageTrackTable')
-    data = c.fetchall()
-    return data
+    return query('SELECT * FROM pageTrackTable')
 
-# Function to create emotion classifier table
+# Function to create emotion classifier table, and its rollup tables
 def create_emotionclf_table():
-    c.execute('CREATE TABLE IF NOT EXISTS emotionclfTable(rawtext TEXT, prediction TEXT, probability NUMBER, timeOfvisit TIMESTAMP)')
+    conn = get_connection()
+    # Hold the write lock so that no batch is inserted between the rollups creation and their backfill
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS emotionclfTable(rawtext TEXT, prediction TEXT, probability NUMBER, timeOfvisit TIMESTAMP)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_emotionclf_time ON emotionclfTable(timeOfvisit)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_emotionclf_prediction ON emotionclfTable(prediction)')
+        for table, length in ROLLUPS.items():
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+            if 'probabilityCount' in columns:
+                continue
+            # Rollups created without probabilityCount are rebuilt from the predictions
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
+            conn.execute(f'CREATE TABLE {table}(period TEXT, prediction TEXT, count INTEGER, probabilitySum REAL, '
+                         'probabilityCount INTEGER, PRIMARY KEY(period, prediction))')
+            # Backfill the predictions tracked before the rollups existed
+            conn.execute(f'INSERT INTO {table}(period, prediction, count, probabilitySum, probabilityCount) '
+                         f'SELECT substr(timeOfvisit, 1, {length}), prediction, count(*), total(probability), count(probability) '
+                         'FROM emotionclfTable GROUP BY 1, 2')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 # Function to add prediction details
 def add_prediction_details(rawtext, prediction, probability, timeOfvisit=None):
-    if timeOfvisit is None:
-        timeOfvisit = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
-    else:
-        timeOfvisit = timeOfvisit.astimezone(IST).strftime("%Y-%m-%d %H:%M:%S")
-    c.execute('INSERT INTO emotionclfTable(rawtext, prediction, probability, timeOfvisit) VALUES (?, ?, ?, ?)', (rawtext, prediction, probability, timeOfvisit))
-    conn.commit()
+    writer.insert(PREDICTION_INSERT, (rawtext, prediction, probability, to_timestamp(timeOfvisit)))
+
+# Function to view a page of prediction details, as (id, rawtext, prediction, probability, timeOfvisit) rows
+def view_prediction_details(start=None, end=None, prediction=None, after=None, limit=PAGE_SIZE):
+    where, params = time_range(start, end, after)
+    if prediction is not None:
+        where += (' AND ' if where else ' WHERE ') + 'prediction = ?'
+        params.append(prediction)
+    return query(f'SELECT rowid, rawtext, prediction, probability, timeOfvisit FROM emotionclfTable{where} ORDER BY rowid LIMIT ?', params + [limit])
 
 # Function to view all prediction details
 def view_all_prediction_details():
-    c.execute('SELECT * FROM emotionclfTable')
-    data = c.fetchall()
-    return data
+    return query('SELECT * FROM emotionclfTable')
+
+# Function to view the emotion mix of the last days, as (prediction, count, mean probability) rows
+def view_emotion_mix(days=7):
+    first_day = (datetime.now(IST) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    return query('SELECT prediction, sum(count), sum(probabilitySum) / sum(probabilityCount) FROM emotionDailyTable '
+                 'WHERE period >= ? GROUP BY prediction ORDER BY sum(count) DESC', (first_day,))
+
+# Function to view the emotion trend by hour or day, as (period, prediction, count, mean probability) rows
+def view_emotion_trend(start=None, end=None, by='day'):
+    table, length = ('emotionHourlyTable', 13) if by == 'hour' else ('emotionDailyTable', 10)
+    clauses = []
+    params = []
+    if start is not None:
+        clauses.append('period >= ?')
+        params.append(to_timestamp(start)[:length])
+    if end is not None:
+        clauses.append('period <= ?')
+        params.append(to_timestamp(end)[:length])
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    return query(f'SELECT period, prediction, count, probabilitySum / probabilityCount FROM {table}{where} ORDER BY period, prediction', params)
@@ -1,25 +1,29 @@
 # Configuration file for Activity & Therapy Recommendations Module
 
 # Database Configuration
-DATABASE_URL = sqlite:///therapy_recommendations.db
+DATABASE_URL = 'sqlite:///therapy_recommendations.db'
 
 # Application Configuration
-SECRET_KEY = your-secret-key-change-this-in-production
+SECRET_KEY = 'your-secret-key-change-this-in-production'
 DEBUG = True
-HOST = 0.0.0.0
+HOST = '0.0.0.0'
 PORT = 5000
 
 # API Configuration
-API_PREFIX = /api
-CORS_ORIGINS = *
+API_PREFIX = '/api'
+CORS_ORIGINS = '*'
 
 # Session Configuration
 SESSION_TIMEOUT = 3600  # 1 hour in seconds
 
 # Multimedia Configuration
-MULTIMEDIA_PATH = static/multimedia
+MULTIMEDIA_PATH = 'static/multimedia'
 ALLOWED_EXTENSIONS = ['mp3', 'mp4', 'gif', 'jpg', 'png', 'webm']
 
+# Therapy Catalog Configuration (relative paths are relative to this module)
+CATALOG_PATH = 'data/therapy_catalog.json'
+CATALOG_CHECK_INTERVAL = 5  # seconds between checks for a new catalog
+
 # Emotional States Configuration
 SUPPORTED_EMOTIONAL_STATES = ['anxious', 'depressed', 'stressed', 'angry']
 
@@ -27,10 +31,10 @@ SUPPORTED_EMOTIONAL_STATES = ['anxious', 'depressed', 'stressed', 'angry']
 ACTIVITY_TYPES = ['relaxation', 'mindfulness', 'cbt', 'journaling']
 
 # Default Settings
-DEFAULT_INTENSITY = medium
+DEFAULT_INTENSITY = 'medium'
 DEFAULT_SESSION_TIMEOUT = 30  # minutes
 MAX_ACTIVITY_DURATION = 60  # minutes
 
 # Logging Configuration
-LOG_LEVEL = INFO
-LOG_FILE = logs/app.log
+LOG_LEVEL = 'INFO'
+LOG_FILE = 'logs/app.log'
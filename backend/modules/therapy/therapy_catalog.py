@@ -0,0 +1,79 @@
+"""
+Therapy Catalog
+Loads the versioned therapy content data file into immutable in-memory snapshots,
+and hot-reloads it when the file changes
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import namedtuple
+
+from config import CATALOG_PATH, CATALOG_CHECK_INTERVAL
+
+# A loaded catalog: its version, its read-only content and the index built from it
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['version', 'data', 'index'])
+
+class FrozenDict(dict):
+    """Read-only dict, still serializable with json"""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Recommendations are read-only")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+def freeze(value):
+    """Recursively convert dicts and lists to read-only dicts and tuples"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+class TherapyCatalog:
+    """
+    Hot-reloaded therapy catalog. The data file is checked at most every check_interval
+    seconds; when it changed, the new content and its index are built aside and swapped in
+    at once, so that requests keep being served from the previous snapshot until the swap.
+    An invalid file is reported and leaves the current snapshot in place.
+    """
+
+    def __init__(self, build_index, path=CATALOG_PATH, check_interval=CATALOG_CHECK_INTERVAL):
+        self.build_index = build_index
+        self.path = path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.file_stat = None
+        self.next_check = 0
+        self.snapshot = None
+        self.reload()
+
+    def stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        """Load the data file and swap in its snapshot if it changed since the last load"""
+        with self.lock:
+            self.next_check = time.monotonic() + self.check_interval
+            try:
+                file_stat = self.stat()
+                if file_stat == self.file_stat:
+                    return self.snapshot
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = freeze(json.load(f))
+                snapshot = CatalogSnapshot(data.get('version'), data, self.build_index(data))
+            except Exception as e:
+                if self.snapshot is None:
+                    raise
+                print(f"Could not reload therapy catalog, keeping version {self.snapshot.version}: {e}", file=sys.stderr)
+                return self.snapshot
+            self.file_stat = file_stat
+            self.snapshot = snapshot
+            return snapshot
+
+    def current(self):
+        """Return the current snapshot, checking for a new catalog if the check interval elapsed"""
+        if time.monotonic() >= self.next_check:
+            return self.reload()
+        return self.snapshot
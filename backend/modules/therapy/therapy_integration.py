@@ -8,114 +8,71 @@ import sys
 import os
 import json
 
+from therapy_catalog import TherapyCatalog, freeze
+from therapy_ranking import RankingIndex, UserFeatureCache, DatabaseHistory
+
+# Confidence buckets, from the highest lower bound down
+CONFIDENCE_BUCKETS = [(0.8, 'high'), (0.6, 'medium'), (float('-inf'), 'low')]
+
+def confidence_bucket(confidence):
+    """Return the bucket of a confidence level"""
+    for lower_bound, bucket in CONFIDENCE_BUCKETS:
+        if confidence >= lower_bound:
+            return bucket
+
 class TherapyRecommender:
-    def __init__(self):
-        self.therapy_database = {
-            'anger': {
-                'therapyType': 'anger_management',
-                'recommendations': [
-                    'Practice deep breathing exercises for 5-10 minutes daily',
-                    'Engage in physical exercise to release tension',
-                    'Try progressive muscle relaxation techniques',
-                    'Use cognitive restructuring to challenge angry thoughts',
-                    'Practice mindfulness meditation'
-                ],
-                'duration': '4-6 weeks',
-                'intensity': 'moderate',
-                'techniques': ['CBT', 'Mindfulness', 'Physical Activity', 'Breathing Exercises']
-            },
-            'disgust': {
-                'therapyType': 'cognitive_behavioral',
-                'recommendations': [
-                    'Identify triggers that cause disgust reactions',
-                    'Practice exposure therapy with gradual desensitization',
-                    'Use cognitive restructuring to reframe negative thoughts',
-                    'Engage in activities that promote positive emotions',
-                    'Practice grounding techniques when feeling overwhelmed'
-                ],
-                'duration': '6-8 weeks',
-                'intensity': 'moderate',
-                'techniques': ['CBT', 'Exposure Therapy', 'Grounding', 'Positive Psychology']
-            },
-            'fear': {
-                'therapyType': 'anxiety_therapy',
-                'recommendations': [
-                    'Practice the 5-4-3-2-1 grounding technique',
-                    'Use systematic desensitization for specific fears',
-                    'Learn and practice relaxation techniques',
-                    'Challenge catastrophic thinking patterns',
-                    'Build a support network of trusted individuals'
-                ],
-                'duration': '8-12 weeks',
-                'intensity': 'moderate',
-                'techniques': ['CBT', 'Exposure Therapy', 'Relaxation', 'Support Groups']
-            },
-            'joy': {
-                'therapyType': 'positive_psychology',
-                'recommendations': [
-                    'Continue engaging in activities that bring happiness',
-                    'Practice gratitude journaling daily',
-                    'Share positive experiences with others',
-                    'Set meaningful goals to maintain motivation',
-                    'Help others to amplify positive emotions'
-                ],
-                'duration': '2-4 weeks',
-                'intensity': 'low',
-                'techniques': ['Positive Psychology', 'Gratitude Practice', 'Goal Setting', 'Social Connection']
-            },
-            'neutral': {
-                'therapyType': 'mindfulness',
-                'recommendations': [
-                    'Practice mindfulness meditation for 10-15 minutes daily',
-                    'Engage in activities that promote emotional awareness',
-                    'Try new hobbies or activities to add variety',
-                    'Practice emotional regulation techniques',
-                    'Maintain healthy daily routines'
-                ],
-                'duration': '3-4 weeks',
-                'intensity': 'low',
-                'techniques': ['Mindfulness', 'Emotional Awareness', 'Routine Building', 'Self-Care']
-            },
-            'sadness': {
-                'therapyType': 'depression_therapy',
-                'recommendations': [
-                    'Engage in regular physical exercise',
-                    'Maintain social connections with supportive people',
-                    'Practice self-compassion and self-care',
-                    'Consider behavioral activation therapy',
-                    'Establish a consistent sleep schedule'
-                ],
-                'duration': '8-12 weeks',
-                'intensity': 'moderate',
-                'techniques': ['CBT', 'Behavioral Activation', 'Social Support', 'Physical Activity']
-            },
-            'shame': {
-                'therapyType': 'trauma_therapy',
-                'recommendations': [
-                    'Practice self-compassion exercises',
-                    'Work on challenging shame-based thoughts',
-                    'Build self-esteem through positive affirmations',
-                    'Consider individual therapy for deeper issues',
-                    'Practice forgiveness towards yourself'
-                ],
-                'duration': '12-16 weeks',
-                'intensity': 'high',
-                'techniques': ['Trauma Therapy', 'Self-Compassion', 'CBT', 'Individual Therapy']
-            },
-            'surprise': {
-                'therapyType': 'adjustment_therapy',
-                'recommendations': [
-                    'Take time to process unexpected events',
-                    'Practice stress management techniques',
-                    'Maintain flexibility in your thinking',
-                    'Build resilience through challenging situations',
-                    'Seek support from friends and family'
-                ],
-                'duration': '4-6 weeks',
-                'intensity': 'moderate',
-                'techniques': ['Adjustment Therapy', 'Stress Management', 'Resilience Building', 'Social Support']
-            }
-        }
+    def __init__(self, catalog=None, load_history=None):
+        # Therapy content is loaded from the hot-reloaded catalog data file
+        self.catalog = catalog or TherapyCatalog(self.build_index)
+        # Features of the recently active users, for personalized recommendations
+        self.user_features = UserFeatureCache(load_history)
+    
+    @property
+    def therapy_database(self):
+        return self.catalog.current().data['therapy_database']
+    
+    def build_index(self, catalog_data):
+        """
+        Precompute the read-only recommendation of every (emotion, intensity, confidence bucket)
+        of a catalog, its JSON serialization around the confidence echoed in each response, and
+        the ranking index of the personalized recommendations
+        """
+        index = {}
+        json_index = {}
+        for emotion, therapy_info in catalog_data['therapy_database'].items():
+            for lower_bound, bucket in CONFIDENCE_BUCKETS:
+                # Any confidence of the bucket gives the same recommendations and note
+                confidence = max(lower_bound, 0.0)
+                entry = freeze({
+                    "therapyType": therapy_info['therapyType'],
+                    "recommendations": self.adjust_recommendations_by_confidence(list(therapy_info['recommendations']), confidence),
+                    "duration": therapy_info['duration'],
+                    "intensity": therapy_info['intensity'],
+                    "techniques": therapy_info['techniques'],
+                    "personalizedNote": self.generate_personalized_note(emotion, confidence)
+                })
+                index[emotion, bucket] = entry
+                json_index[emotion, bucket] = (
+                    json.dumps(entry)[:-1].encode('utf-8') + b', "confidence": ',
+                    f', "emotion": {json.dumps(emotion)}, "error": null}}'.encode('utf-8')
+                )
+        return index, json_index, RankingIndex(catalog_data['therapy_database'])
+    
+    def get_therapy_recommendation_json(self, emotional_state_data):
+        """Get therapy recommendations based on emotional state, serialized as JSON bytes"""
+        try:
+            emotion = emotional_state_data.get('emotion', 'neutral')
+            confidence = emotional_state_data.get('confidence', 0.0)
+            user_id = emotional_state_data.get('userId')
+            _, json_index, ranking = self.catalog.current().index
+            # Only the users whose history changes the catalog order miss the precomputed recommendations
+            if user_id is None or not self.user_features.personalized(user_id, ranking):
+                prefix, suffix = json_index[emotion, confidence_bucket(confidence)]
+                return prefix + json.dumps(confidence).encode('utf-8') + suffix
+        except Exception:
+            pass
+        # Personalized recommendations, unknown emotions and invalid requests are answered without the index
+        return json.dumps(self.get_therapy_recommendation(emotional_state_data)).encode('utf-8')
     
     def get_therapy_recommendation(self, emotional_state_data):
         """Get therapy recommendations based on emotional state"""
@@ -123,12 +80,31 @@ class TherapyRecommender:
             emotion = emotional_state_data.get('emotion', 'neutral')
             confidence = emotional_state_data.get('confidence', 0.0)
             
+            user_id = emotional_state_data.get('userId')
+            
+            snapshot = self.catalog.current()
+            index, _, ranking = snapshot.index
+            
+            personalized = user_id is not None and self.user_features.personalized(user_id, ranking)
+            
+            # Precomputed recommendation of known emotions
+            key = (emotion, confidence_bucket(confidence))
+            if not personalized and key in index:
+                return dict(index[key], confidence=confidence, emotion=emotion, error=None)
+            
             # Get base therapy information
-            therapy_info = self.therapy_database.get(emotion, self.therapy_database['neutral'])
+            therapy_database = snapshot.data['therapy_database']
+            base_emotion = emotion if emotion in therapy_database else 'neutral'
+            therapy_info = therapy_database[base_emotion]
+            base_recommendations = list(therapy_info['recommendations'])
+            
+            # Rank the recommendations with the user's history
+            if personalized:
+                base_recommendations = self.user_features.rank(user_id, ranking, base_emotion, len(base_recommendations))
             
             # Adjust recommendations based on confidence level
             recommendations = self.adjust_recommendations_by_confidence(
-                therapy_info['recommendations'], 
+                base_recommendations, 
                 confidence
             )
             
@@ -148,7 +124,7 @@ class TherapyRecommender:
             }
             
         except Exception as e:
-            print(f"Error generating therapy recommendations: {e}")
+            print(f"Error generating therapy recommendations: {e}", file=sys.stderr)
             return {
                 "error": str(e),
                 "therapyType": "general_therapy",
@@ -157,6 +133,16 @@ class TherapyRecommender:
                 "intensity": "moderate"
             }
     
+    def record_emotion(self, user_id, emotion):
+        """Update the features of a user with a newly detected emotion"""
+        _, _, ranking = self.catalog.current().index
+        self.user_features.record(user_id, ranking, ('emotion', emotion))
+    
+    def record_activity(self, user_id, activity, completed):
+        """Update the features of a user with a new therapy activity, completed or not"""
+        _, _, ranking = self.catalog.current().index
+        self.user_features.record(user_id, ranking, ('activity', activity, completed))
+    
     def adjust_recommendations_by_confidence(self, base_recommendations, confidence):
         """Adjust recommendations based on confidence level"""
         if confidence >= 0.8:
@@ -183,16 +169,45 @@ class TherapyRecommender:
         else:
             return f"While the analysis suggests a {emotion} emotional state, the confidence level is lower. Consider consulting with a mental health professional for a more detailed assessment."
 
+def serve(recommender, input_stream=sys.stdin, output_stream=sys.stdout.buffer):
+    """
+    Long-lived mode: answer one emotional state JSON per input line with one JSON line.
+    Lines with "event": "emotion" (userId, emotion) or "event": "activity" (userId, activity,
+    completed) record a new event of a user instead, and are acknowledged.
+    """
+    for line in input_stream:
+        if line.strip():
+            # Every line gets one JSON line back, an invalid line must not stop the server
+            try:
+                data = json.loads(line)
+                if data.get('event') == 'emotion':
+                    recommender.record_emotion(data['userId'], data['emotion'])
+                    response = b'{"recorded": true}'
+                elif data.get('event') == 'activity':
+                    recommender.record_activity(data['userId'], data['activity'], data.get('completed', False))
+                    response = b'{"recorded": true}'
+                else:
+                    response = recommender.get_therapy_recommendation_json(data)
+            except Exception as e:
+                print(f"Invalid therapy server request: {e!r}", file=sys.stderr)
+                response = json.dumps({"error": f"Invalid request: {e!r}"}).encode('utf-8')
+            output_stream.write(response + b'\n')
+            output_stream.flush()
+
 def main():
     """Main function for command line usage"""
     if len(sys.argv) != 2:
-        print("Usage: python therapy_integration.py <emotional_state_json>")
+        print("Usage: python therapy_integration.py <emotional_state_json> | --serve", file=sys.stderr)
         sys.exit(1)
     
+    # Users missing from the features cache are loaded from the database
+    recommender = TherapyRecommender(load_history=DatabaseHistory())
+    if sys.argv[1] == '--serve':
+        serve(recommender)
+        return
+    
     emotional_state_data = json.loads(sys.argv[1])
-    recommender = TherapyRecommender()
-    result = recommender.get_therapy_recommendation(emotional_state_data)
-    print(json.dumps(result))
+    print(recommender.get_therapy_recommendation_json(emotional_state_data).decode('utf-8'))
 
 if __name__ == "__main__":
     main()
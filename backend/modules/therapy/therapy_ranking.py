@@ -0,0 +1,230 @@
+"""
+Therapy Ranking
+Personalizes the order of therapy recommendations with per-user features : recent
+emotions, completed activities and engagement, loaded from the stored history, kept
+in an LRU cache and updated incrementally as new events arrive
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Scoring weights
+TREND_WEIGHT = 0.4        # Share of the relevance given by the recent emotions, the rest by the current one
+FAMILIARITY_WEIGHT = 0.6  # Bonus (engaged users) or penalty (disengaged users) of completed activities
+
+# Feature updates
+DECAY = 0.8               # Weight kept by the past sessions at each new session
+ENGAGEMENT_RATE = 0.3     # Moving average rate of the engagement
+HISTORY_SIZE = 200        # Stored events replayed for a user missing from the cache
+
+class RankingIndex:
+    """
+    Candidate recommendations of a therapy catalog and their (candidates x emotions)
+    affinity matrix
+    """
+
+    def __init__(self, therapy_database):
+        self.emotions = tuple(therapy_database)
+        self.emotion_ids = {emotion: i for i, emotion in enumerate(self.emotions)}
+        self.candidate_ids = {}
+        for therapy_info in therapy_database.values():
+            for recommendation in therapy_info['recommendations']:
+                self.candidate_ids.setdefault(recommendation, len(self.candidate_ids))
+        self.candidates = tuple(self.candidate_ids)
+
+        self.affinity = np.zeros((len(self.candidates), len(self.emotions)))
+        for emotion, therapy_info in therapy_database.items():
+            rows = [self.candidate_ids[recommendation] for recommendation in therapy_info['recommendations']]
+            self.affinity[rows, self.emotion_ids[emotion]] = 1.0
+
+        # Candidates of each emotion in its catalog order, followed by all the others
+        self.orders = {}
+        for emotion, therapy_info in therapy_database.items():
+            rows = [self.candidate_ids[recommendation] for recommendation in therapy_info['recommendations']]
+            rows = list(dict.fromkeys(rows))
+            self.orders[emotion] = np.array(rows + sorted(set(range(len(self.candidates))) - set(rows)), dtype=int)
+
+    def rank(self, features, emotion, k):
+        """Return the k best recommendations for a user currently in an emotional state"""
+        relevance = (1 - TREND_WEIGHT) * self.affinity[:, self.emotion_ids[emotion]]
+        total = features.emotions.sum()
+        if total > 0:
+            relevance = relevance + TREND_WEIGHT * (self.affinity @ (features.emotions / total))
+        familiarity = FAMILIARITY_WEIGHT * (features.engagement - 0.5) * np.minimum(features.completed, 1.0)
+        score = relevance + familiarity
+
+        # Only recommendations relevant to the current or recent emotions are ranked, ties keep the catalog order
+        order = self.orders[emotion]
+        order = order[np.argsort(-score[order], kind='stable')]
+        order = order[relevance[order] > 0][:k]
+        return [self.candidates[i] for i in order]
+
+class UserFeatures:
+    """
+    Decayed history of a user, as vectors aligned with a ranking index : recent emotions,
+    completed activities, and engagement (moving average of the activities completed)
+    """
+
+    def __init__(self, ranking):
+        self.ranking = ranking
+        self.emotions = np.zeros(len(ranking.emotions))
+        self.completed = np.zeros(len(ranking.candidates))
+        self.engagement = 0.5
+
+    def align(self, ranking):
+        """Realign the feature vectors with the ranking index of a reloaded catalog"""
+        if ranking is self.ranking:
+            return
+        emotions = np.array([self.ranking.emotion_ids.get(emotion, -1) for emotion in ranking.emotions], dtype=int)
+        candidates = np.array([self.ranking.candidate_ids.get(candidate, -1) for candidate in ranking.candidates], dtype=int)
+        self.emotions = np.where(emotions >= 0, self.emotions[emotions], 0.0) if len(emotions) else np.zeros(0)
+        self.completed = np.where(candidates >= 0, self.completed[candidates], 0.0) if len(candidates) else np.zeros(0)
+        self.ranking = ranking
+
+    def record_emotion(self, emotion):
+        """Add a detected emotion"""
+        self.emotions *= DECAY
+        if emotion in self.ranking.emotion_ids:
+            self.emotions[self.ranking.emotion_ids[emotion]] += 1.0
+
+    def record_activity(self, activity, completed):
+        """Add a therapy activity, completed or not"""
+        self.completed *= DECAY
+        if completed and activity in self.ranking.candidate_ids:
+            self.completed[self.ranking.candidate_ids[activity]] += 1.0
+        self.engagement += ENGAGEMENT_RATE * (bool(completed) - self.engagement)
+
+    def personal(self):
+        """Return whether the features can change the catalog order of the recommendations"""
+        return bool(self.emotions.any()) or (self.engagement != 0.5 and bool(self.completed.any()))
+
+    def record(self, event):
+        """Add an ('emotion', emotion) or ('activity', activity, completed) event"""
+        if event[0] == 'emotion':
+            self.record_emotion(event[1])
+        elif event[0] == 'activity':
+            self.record_activity(event[1], event[2])
+
+class UserFeatureCache:
+    """
+    Thread-safe LRU cache of the features of the most recently active users. Users missing
+    from the cache are loaded by replaying their stored events, from load_history(user_id)
+    (oldest first, None if the history is unavailable).
+    """
+
+    def __init__(self, load_history=None, maxsize=10000):
+        self.load_history = load_history
+        self.maxsize = maxsize
+        self.features = OrderedDict()
+        self.loading = set()
+        self.lock = threading.Lock()
+
+    def _cached(self, user_id, ranking):
+        features = self.features.get(user_id)
+        if features is not None:
+            self.features.move_to_end(user_id)
+            features.align(ranking)
+        return features
+
+    def _get(self, user_id, ranking):
+        """Return the features of a user, and whether they were just loaded from the stored history"""
+        with self.lock:
+            features = self._cached(user_id, ranking)
+            if features is not None:
+                return features, False
+
+        # Load outside of the lock, a slow history query must not block the other users
+        history = self.load_history(user_id) if self.load_history else None
+        loaded = UserFeatures(ranking)
+        for event in history or ():
+            loaded.record(event)
+
+        with self.lock:
+            features = self._cached(user_id, ranking)
+            if features is not None:
+                return features, False
+            self.features[user_id] = loaded
+            if len(self.features) > self.maxsize:
+                self.features.popitem(last=False)
+            return loaded, history is not None
+
+    def _load(self, user_id, ranking):
+        try:
+            self._get(user_id, ranking)
+        finally:
+            with self.lock:
+                self.loading.discard(user_id)
+
+    def personalized(self, user_id, ranking):
+        """
+        Return whether the cached features of a user change the catalog order of the recommendations.
+        A user missing from the cache is loaded in the background, and gets the catalog order meanwhile.
+        """
+        with self.lock:
+            features = self._cached(user_id, ranking)
+            if features is None and user_id not in self.loading:
+                self.loading.add(user_id)
+                threading.Thread(target=self._load, args=(user_id, ranking), daemon=True).start()
+            return features is not None and features.personal()
+
+    def rank(self, user_id, ranking, emotion, k):
+        """Rank the recommendations of an emotional state for a user"""
+        features, _ = self._get(user_id, ranking)
+        with self.lock:
+            return ranking.rank(features, emotion, k)
+
+    def record(self, user_id, ranking, event):
+        """Add a new event to the features of a user"""
+        features, loaded = self._get(user_id, ranking)
+        # A history just loaded already holds the event, stored before it was sent
+        if not loaded:
+            with self.lock:
+                features.align(ranking)
+                features.record(event)
+
+def connect_database():
+    """Connect to the PostgreSQL database with the same settings as the backend"""
+    import psycopg2
+    return psycopg2.connect(
+        user=os.environ.get('DB_USER', 'openpg'),
+        host=os.environ.get('DB_HOST', 'localhost'),
+        dbname=os.environ.get('DB_NAME', 'psychemirror'),
+        password=os.environ.get('DB_PASSWORD', 'openpgpwd'),
+        port=os.environ.get('DB_PORT', 5432)
+    )
+
+class DatabaseHistory:
+    """
+    Stored events of the users: their detected emotions (emotions table) and therapy
+    activities (therapy_activities table), the history_size most recent ones
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history_size = history_size
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def __call__(self, user_id):
+        try:
+            with self.lock:
+                if self.connection is None or self.connection.closed:
+                    self.connection = connect_database()
+                    self.connection.autocommit = True
+                with self.connection.cursor() as cursor:
+                    cursor.execute("""SELECT kind, name, completed FROM (
+                                        SELECT 'emotion' AS kind, emotion_value AS name, NULL AS completed, created_at, id
+                                        FROM emotions WHERE user_id = %s
+                                        UNION ALL
+                                        SELECT 'activity', activity_name, completed, created_at, id
+                                        FROM therapy_activities WHERE user_id = %s
+                                      ) events ORDER BY created_at DESC, id DESC LIMIT %s""",
+                                   (user_id, user_id, self.history_size))
+                    rows = cursor.fetchall()
+        except Exception as e:
+            print(f"Could not load the history of user {user_id}: {e}", file=sys.stderr)
+            return None
+        return [(kind, name) if kind == 'emotion' else (kind, name, completed) for kind, name, completed in reversed(rows)]
@@ -3,6 +3,7 @@ const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 const multer = require('multer');
+const { sendTherapyRequest } = require('../utils/therapyServer');
 
 const router = express.Router();
 
@@ -740,8 +741,8 @@ router.post('/therapy-recommendation', verifyToken, async (req, res) => {
       });
     }
 
-    const scriptPath = path.join(__dirname, '..', 'modules', 'therapy', 'therapy_integration.py');
-    const result = await runPythonScript(scriptPath, [JSON.stringify(emotionalState)]);
+    // Served by a persistent process, which keeps the precomputed recommendations and the users' features in memory
+    const result = await sendTherapyRequest({ ...emotionalState, userId: req.user.userId });
 
     if (result.error) {
       return res.status(500).json({ 
@@ -805,6 +806,10 @@ router.post('/save', verifyToken, async (req, res) => {
       ]
     );
 
+    // Update the user's features for personalized therapy recommendations
+    sendTherapyRequest({ event: 'emotion', userId, emotion: emotion_value })
+      .catch((therapyError) => console.error('Error recording emotion for therapy ranking (non-critical):', therapyError));
+
     // Trigger notification hook for saved emotion
     try {
       const emotionNotificationHook = require('../modules/notifications_module/integration/emotionNotificationHook');
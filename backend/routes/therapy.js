@@ -1,5 +1,6 @@
 const express = require('express');
 const pool = require('../config/database');
+const { sendTherapyRequest } = require('../utils/therapyServer');
 
 const router = express.Router();
 
@@ -201,6 +202,10 @@ router.post('/session', verifyToken, async (req, res) => {
     const savedSession = result.rows[0];
     console.log('Session saved successfully:', savedSession);
 
+    // Update the user's features for personalized therapy recommendations
+    sendTherapyRequest({ event: 'activity', userId, activity: activityName, completed: Boolean(completed) })
+      .catch((therapyError) => console.error('Error recording activity for therapy ranking (non-critical):', therapyError));
+
     res.json({
       success: true,
       sessionId: savedSession.id,
@@ -0,0 +1,84 @@
+const { spawn } = require('child_process');
+const path = require('path');
+const readline = require('readline');
+
+const scriptPath = path.join(__dirname, '..', 'modules', 'therapy', 'therapy_integration.py');
+
+// A request unanswered after this delay means the process is stuck, so it is restarted
+const REQUEST_TIMEOUT = parseInt(process.env.THERAPY_REQUEST_TIMEOUT_MS, 10) || 10000;
+
+// Long-lived therapy_integration.py --serve process, answering one JSON line per request line in order
+let serverProcess = null;
+
+/**
+ * Stop a therapy server process and fail its pending requests
+ */
+function stopServer(child, reason) {
+  if (serverProcess === child) {
+    serverProcess = null;
+  }
+  const failed = child.pending;
+  child.pending = [];
+  failed.forEach((request) => {
+    clearTimeout(request.timeout);
+    request.reject(new Error('Therapy server stopped: ' + reason));
+  });
+}
+
+/**
+ * Start the therapy server process, failing its pending requests if it exits
+ */
+function startServer() {
+  const pythonCmd = process.env.PYTHON_CMD || 'python';
+  const child = spawn(pythonCmd, [scriptPath, '--serve'], { stdio: ['pipe', 'pipe', 'pipe'] });
+  // Requests of this process only, a replaced process must not fail the requests of the new one
+  child.pending = [];
+
+  readline.createInterface({ input: child.stdout }).on('line', (line) => {
+    const request = child.pending.shift();
+    if (!request) {
+      return;
+    }
+    clearTimeout(request.timeout);
+    try {
+      request.resolve(JSON.parse(line));
+    } catch (parseError) {
+      request.reject(new Error('Failed to parse therapy server output: ' + line));
+    }
+  });
+
+  child.stderr.on('data', (data) => {
+    console.error('Therapy server stderr:', data.toString());
+  });
+
+  child.on('error', (err) => stopServer(child, err.message));
+  child.on('exit', (code) => stopServer(child, 'exit code ' + code));
+  // Writes to a process that just exited must not crash the backend
+  child.stdin.on('error', (err) => stopServer(child, err.message));
+
+  return child;
+}
+
+/**
+ * Send a request object to the therapy server and resolve with its JSON response
+ */
+function sendTherapyRequest(message) {
+  return new Promise((resolve, reject) => {
+    if (!serverProcess) {
+      serverProcess = startServer();
+    }
+    const child = serverProcess;
+    // A stuck request blocks every later one, so the whole process is killed and respawned on the next request
+    const timeout = setTimeout(() => {
+      console.error('Therapy server request timed out, restarting the therapy server');
+      stopServer(child, 'request timed out');
+      child.kill('SIGKILL');
+    }, REQUEST_TIMEOUT);
+    child.pending.push({ resolve, reject, timeout });
+    child.stdin.write(JSON.stringify(message) + '\n');
+  });
+}
+
+module.exports = {
+  sendTherapyRequest
+};